@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks - run them from the project root, e.g. `python -m benchmarks.auth`.
+They run against a throwaway test database (just like `./manage.py test` does).
+'''
+from __future__ import unicode_literals, absolute_import, print_function
+from contextlib import contextmanager
+import io
+import json
+import os
+import platform
+import subprocess
+import timeit
+
+import six
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dlogr_api.settings')
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database(keepdb=False):
+    ''' With `keepdb`, the test database is reused across runs (and left behind) - handy for big datasets. '''
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def measure(func, iterations):
+    ''' Runs `func` `iterations` times. Returns how many runs per second it made. '''
+    start = timeit.default_timer()
+    for i in range(iterations):
+        func()
+    return iterations / (timeit.default_timer() - start)
+
+
+def percentile(values, fraction):
+    ''' Nearest-rank percentile of `values` (already sorted). '''
+    return values[max(0, int(round(fraction * len(values))) - 1)]
+
+
+def measure_latency(func, iterations, warmup=1):
+    '''
+    Runs `func` `iterations` times (after `warmup` runs that are not taken into account), timing every run.
+    Returns {'iterations', 'rate' (runs per second), 'mean', 'p50', 'p95', 'p99', 'max' (in milliseconds)}.
+    '''
+    for i in range(warmup):
+        func()
+
+    timings = []
+    for i in range(iterations):
+        start = timeit.default_timer()
+        func()
+        timings.append((timeit.default_timer() - start) * 1000)
+
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'rate': iterations / (sum(timings) / 1000),
+        'mean': sum(timings) / iterations,
+        'p50': percentile(timings, 0.5),
+        'p95': percentile(timings, 0.95),
+        'p99': percentile(timings, 0.99),
+        'max': timings[-1],
+    }
+
+
+def report(name, value, unit):
+    print('{:<50} {:>12.1f} {}'.format(name, value, unit))
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment():
+    ''' What results of a run depend on, other than the code itself - so runs can be told apart. '''
+    from django.db import connection
+    from django.utils import timezone
+
+    return {
+        'commit': get_commit(),
+        'date': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': connection.vendor,
+    }
+
+
+def write_results(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(six.text_type(json.dumps(data, indent=2, separators=(',', ': '), sort_keys=True)))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+'''
+HTTP Basic authentication throughput, with and without the credentials cache:
+    python -m benchmarks.auth
+'''
+from __future__ import unicode_literals, absolute_import
+import base64
+
+from benchmarks import measure, report, setup_django, test_database
+
+ITERATIONS = 200
+
+
+def run():
+    from rest_framework.authentication import BasicAuthentication
+    from rest_framework.request import Request
+
+    from django.core.cache import cache
+    from django.test import RequestFactory
+
+    from main.authentication import CachedBasicAuthentication
+    from main.models import Customer
+
+    customer = Customer.objects.create_user(
+        email='bench@example.com', password='supersikret', name='Bench', timezone='UTC'
+    )
+    credentials = base64.b64encode('{}:{}'.format(customer.email, 'supersikret').encode('utf-8')).decode('ascii')
+    request = Request(RequestFactory().get('/api/events/', HTTP_AUTHORIZATION='Basic {}'.format(credentials)))
+
+    for authentication_class in (BasicAuthentication, CachedBasicAuthentication):
+        cache.clear()
+        authentication = authentication_class()
+        rate = measure(lambda: authentication.authenticate(request), ITERATIONS)
+        report('auth.basic.{}'.format(authentication_class.__name__), rate, 'requests/s')
+
+
+if __name__ == '__main__':
+    setup_django()
+    with test_database():
+        run()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+'''
+Synthetic datasets for benchmarks: customers and their events, inserted in bulk (factories would take hours for
+millions of events). Data is generated from a fixed random seed, so the same arguments give the same dataset.
+'''
+from __future__ import unicode_literals, absolute_import
+from datetime import timedelta
+import random
+
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'supersikret'
+OBJECT_TYPES = ['{}.models.{}'.format(x.lower(), x) for x in (
+    'User', 'Order', 'Invoice', 'Payment', 'Subscription', 'Product', 'Shipment', 'Ticket', 'Coupon', 'Review',
+)]
+VERBS = ('created', 'updated', 'deleted', 'paid', 'refunded', 'shipped', 'cancelled', 'approved', 'rejected', 'viewed')
+WORDS = (
+    'customer', 'checkout', 'mobile', 'website', 'support', 'manual', 'automatic', 'retry', 'partner', 'import',
+    'promotion', 'renewal', 'trial', 'upgrade', 'downgrade', 'export', 'warehouse', 'fraud', 'review', 'priority',
+)
+OBJECT_IDS_PER_TYPE = 1000
+DAYS = 365
+
+
+def get_customers(count, bench_customer):
+    '''
+    `count` customers: `bench_customer` (the one benchmarks make requests as) plus others, inserted in bulk - they
+    only add volume to events table.
+    '''
+    from django.db.models import QuerySet
+
+    from main.models import Customer
+    from main.utils import generate_id
+
+    others = [
+        Customer(
+            id=generate_id(), email='bench-{}@example.com'.format(x), name='Bench #{}'.format(x), timezone='UTC',
+            password=bench_customer.password, email_verified=True,
+        )
+        for x in range(1, count)
+    ]
+    QuerySet(Customer).bulk_create(others, batch_size=1000)
+    return [bench_customer] + others
+
+
+def generate_events(customers, count, seed=0):
+    ''' Yields `count` events, spread evenly over `customers` and over the last `DAYS` days. '''
+    from django.utils import timezone
+
+    from main.models import Event
+    from main.utils import generate_id
+
+    rand = random.Random(seed)
+    now = timezone.now()
+    for x in range(count):
+        object_type = rand.choice(OBJECT_TYPES)
+        object_id = '{}'.format(rand.randint(1, OBJECT_IDS_PER_TYPE))
+        name = object_type.rsplit('.', 1)[-1]
+        yield Event(
+            id=generate_id(), customer=customers[x % len(customers)], object_type=object_type, object_id=object_id,
+            human_identifier='{} #{}'.format(name, object_id),
+            message='{} {} ({})'.format(name, rand.choice(VERBS), ' '.join(rand.sample(WORDS, 2))),
+            timestamp=now - timedelta(seconds=rand.randint(0, DAYS * 24 * 60 * 60)),
+            metadata={'index': x, 'source': rand.choice(WORDS), 'amount': rand.randint(1, 10000)},
+        )
+
+
+def seed(customers_count, events_count, batch_size=5000, progress=None):
+    '''
+    Creates the dataset: `customers_count` customers and `events_count` events. Returns the customer to make requests
+    as (`BENCH_EMAIL`, `BENCH_PASSWORD`). `progress(inserted)` is called after each batch.
+    Events are inserted with no signals: rollups are counted once per batch and events versions are not touched.
+    '''
+    from django.db import transaction
+    from django.db.models import QuerySet
+
+    from main.models import Customer, Event, EventRollup
+    from main.utils import chunked
+
+    bench_customer = Customer.objects.create_user(
+        email=BENCH_EMAIL, password=BENCH_PASSWORD, name='Bench', timezone='UTC', email_verified=True
+    )
+    customers = get_customers(customers_count, bench_customer)
+
+    inserted = 0
+    for batch in chunked(generate_events(customers, events_count), batch_size):
+        with transaction.atomic():
+            QuerySet(Event).bulk_create(batch)
+            EventRollup.objects.add(batch)
+        inserted += len(batch)
+        if progress:
+            progress(inserted)
+
+    return bench_customer
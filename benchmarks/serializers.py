@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+'''
+Events list representation (a 30 items page), DRF serializer vs compiled serializer:
+    python -m benchmarks.serializers
+'''
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime
+import uuid
+
+import pytz
+
+from benchmarks import measure, report, setup_django
+
+ITERATIONS = 1000
+PAGE_SIZE = 30
+
+
+def run():
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from main.models import Event
+    from main.serializers import CompiledSerializer, EventSerializer
+
+    now = datetime.now(pytz.utc)
+    events = [
+        Event(
+            id=uuid.uuid4(), created=now, modified=now, object_id='{}'.format(i), object_type='users.models.User',
+            human_identifier='User #{}'.format(i), timestamp=now, message='User signed up', metadata={'index': i},
+        )
+        for i in range(PAGE_SIZE)
+    ]
+
+    for label, query_string in (('all_fields', ''), ('some_fields', 'fields=id,timestamp,message')):
+        request = Request(APIRequestFactory().get('/api/events/?{}'.format(query_string)))
+
+        def drf():
+            return EventSerializer(events, many=True, context={'request': request}).data
+
+        def compiled():
+            return CompiledSerializer.for_request(EventSerializer, request).to_representation_many(events)
+
+        assert drf() == compiled()
+        name = 'serializers.events.{}'.format(label)
+        report('{}.EventSerializer'.format(name), measure(drf, ITERATIONS), 'pages/s')
+        report('{}.CompiledSerializer'.format(name), measure(compiled, ITERATIONS), 'pages/s')
+
+
+if __name__ == '__main__':
+    setup_django()
+    run()
@@ -3,8 +3,9 @@ from __future__ import unicode_literals, absolute_import
 
 from rest_framework import routers
 
-from main.api import EventAPI, CustomerAPI
+from main.api import EventAPI, CustomerAPI, RetentionPolicyAPI
 
 router = routers.SimpleRouter(trailing_slash=False)
 router.register(r'events', EventAPI, base_name='events')
 router.register(r'customers', CustomerAPI, base_name='customers')
+router.register(r'retention-policies', RetentionPolicyAPI, base_name='retention-policies')
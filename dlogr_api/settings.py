@@ -153,9 +153,9 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
+        'main.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'main.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -163,6 +163,44 @@ REST_FRAMEWORK = {
 }
 
 AUTH_USER_MODEL = 'main.Customer'
+TIME_ORDERED_IDS = env.bool('TIME_ORDERED_IDS', default=False)  # UUIDv7-like primary keys (see `main.utils.uuid7`).
+
+EVENTS_BULK_MAX_SIZE = env.int('EVENTS_BULK_MAX_SIZE', default=1000)
+EVENTS_NDJSON_CHUNK_SIZE = env.int('EVENTS_NDJSON_CHUNK_SIZE', default=500)
+EVENTS_NDJSON_MAX_REPORTED_ERRORS = env.int('EVENTS_NDJSON_MAX_REPORTED_ERRORS', default=100)
+EVENTS_SEARCH_INCLUDE_METADATA = env.bool('EVENTS_SEARCH_INCLUDE_METADATA', default=False)
+EVENTS_PARTITIONS_MONTHS_AHEAD = env.int('EVENTS_PARTITIONS_MONTHS_AHEAD', default=3)
+EVENTS_LIST_DEFER_METADATA = env.bool('EVENTS_LIST_DEFER_METADATA', default=False)
+EVENTS_EXPORT_CHUNK_SIZE = env.int('EVENTS_EXPORT_CHUNK_SIZE', default=2000)
+EVENTS_HISTOGRAM_MAX_RESULTS = env.int('EVENTS_HISTOGRAM_MAX_RESULTS', default=5000)
+EVENTS_HISTOGRAM_USE_ROLLUPS = env.bool('EVENTS_HISTOGRAM_USE_ROLLUPS', default=True)
+EVENTS_BUFFER_BACKEND = env('EVENTS_BUFFER_BACKEND', default='main.buffers.SQLiteEventBuffer')
+EVENTS_BUFFER_SQLITE_PATH = env('EVENTS_BUFFER_SQLITE_PATH', default=os.path.join(BASE_DIR, 'events-buffer.sqlite3'))
+EVENTS_BUFFER_REDIS_KEY = env('EVENTS_BUFFER_REDIS_KEY', default='events-buffer')
+EVENTS_BUFFER_MAX_SIZE = env.int('EVENTS_BUFFER_MAX_SIZE', default=100000)
+EVENTS_BUFFER_RETRY_AFTER_IN_SECONDS = env.int('EVENTS_BUFFER_RETRY_AFTER_IN_SECONDS', default=30)
+EVENTS_BUFFER_FLUSH_BATCH_SIZE = env.int('EVENTS_BUFFER_FLUSH_BATCH_SIZE', default=5000)
+EVENTS_BUFFER_POLL_INTERVAL_IN_SECONDS = env.int('EVENTS_BUFFER_POLL_INTERVAL_IN_SECONDS', default=1)
+EVENTS_BUFFER_MAX_ATTEMPTS = env.int('EVENTS_BUFFER_MAX_ATTEMPTS', default=5)  # Then events go to dead letters.
+# Whether the flusher runs on another host than web processes - e.g. its own dyno (Procfile's `events`) on Heroku.
+EVENTS_BUFFER_FLUSHED_ELSEWHERE = env.bool('EVENTS_BUFFER_FLUSHED_ELSEWHERE', default='DYNO' in os.environ)
+EVENTS_IDEMPOTENCY_TTL_IN_SECONDS = env.int('EVENTS_IDEMPOTENCY_TTL_IN_SECONDS', default=60 * 60 * 24)
+EVENTS_IDEMPOTENCY_PENDING_TTL_IN_SECONDS = env.int('EVENTS_IDEMPOTENCY_PENDING_TTL_IN_SECONDS', default=60)
+EVENTS_IDEMPOTENCY_MAX_KEYS = env.int('EVENTS_IDEMPOTENCY_MAX_KEYS', default=100000)
+EVENTS_PURGE_CHUNK_SIZE = env.int('EVENTS_PURGE_CHUNK_SIZE', default=1000)
+EVENTS_PURGE_PAUSE_IN_SECONDS = env.float('EVENTS_PURGE_PAUSE_IN_SECONDS', default=0.5)
+EVENTS_PURGE_INTERVAL_IN_SECONDS = env.int('EVENTS_PURGE_INTERVAL_IN_SECONDS', default=60 * 60)
+EVENTS_THROTTLE_BACKEND = env('EVENTS_THROTTLE_BACKEND', default='main.throttling.CacheTokenBucket')
+EVENTS_THROTTLE_RATE = env.float('EVENTS_THROTTLE_RATE', default=200)  # Events per second, per customer.
+EVENTS_THROTTLE_BURST = env.int('EVENTS_THROTTLE_BURST', default=5000)
+EVENTS_MONTHLY_QUOTA = env.int('EVENTS_MONTHLY_QUOTA', default=0)  # Events per customer, `0` for no limit.
+EVENTS_ARCHIVE_AFTER_DAYS = env.int('EVENTS_ARCHIVE_AFTER_DAYS', default=365)
+EVENTS_ARCHIVE_SEGMENT_MAX_EVENTS = env.int('EVENTS_ARCHIVE_SEGMENT_MAX_EVENTS', default=100000)
+EVENTS_ARCHIVE_CHUNK_SIZE = env.int('EVENTS_ARCHIVE_CHUNK_SIZE', default=2000)
+EVENTS_ARCHIVE_STORAGE = env('EVENTS_ARCHIVE_STORAGE', default='django.core.files.storage.FileSystemStorage')
+EVENTS_ARCHIVE_STORAGE_OPTIONS = env.json(
+    'EVENTS_ARCHIVE_STORAGE_OPTIONS', default={'location': os.path.join(BASE_DIR, 'events-archive')}
+)
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -170,7 +208,15 @@ CACHE_DEFAULT_TIME_TO_LIVE_IN_SECONDS = env.int('CACHE_DEFAULT_TIME_TO_LIVE_IN_S
 CACHE_PREFIX = {
     'VERIFY_ACCOUNT': 'verify-account',
     'RESET_PASSWORD': 'reset-password',
+    'AUTH_TOKEN': 'auth-token',
+    'AUTH_BASIC': 'auth-basic',
+    'EVENTS_VERSION': 'events-version',
+    'EVENTS_BUFFER_STATS': 'events-buffer-stats',
+    'IDEMPOTENCY': 'idempotency',
+    'EVENTS_THROTTLE': 'events-throttle',
 }
+AUTH_TOKEN_CACHE_TIME_TO_LIVE_IN_SECONDS = env.int('AUTH_TOKEN_CACHE_TIME_TO_LIVE_IN_SECONDS', default=60)
+AUTH_BASIC_CACHE_TIME_TO_LIVE_IN_SECONDS = env.int('AUTH_BASIC_CACHE_TIME_TO_LIVE_IN_SECONDS', default=60)
 
 WEB_CLIENT_URLS = {
     'VERIFY_ACCOUNT': 'https://www.dlogr.com/auth/verify-account?token={key}&joined={joined}',
@@ -183,12 +229,21 @@ EMAIL_PORT = env.int("EMAIL_PORT", default=587)
 EMAIL_USE_TLS = True
 SERVER_EMAIL = 'support@dlogr.com'
 
+EMAIL_OUTBOX_BATCH_SIZE = env.int('EMAIL_OUTBOX_BATCH_SIZE', default=50)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5)
+EMAIL_OUTBOX_RETRY_DELAY_IN_SECONDS = env.int('EMAIL_OUTBOX_RETRY_DELAY_IN_SECONDS', default=60)
+EMAIL_OUTBOX_POLL_INTERVAL_IN_SECONDS = env.int('EMAIL_OUTBOX_POLL_INTERVAL_IN_SECONDS', default=5)
+EMAIL_OUTBOX_CLAIM_TIMEOUT_IN_SECONDS = env.int('EMAIL_OUTBOX_CLAIM_TIMEOUT_IN_SECONDS', default=10 * 60)
+
 # CORS
 MIDDLEWARE = MIDDLEWARE + [
     'corsheaders.middleware.CorsMiddleware',
 ]
 CORS_ORIGIN_WHITELIST = env.list('CORS_ORIGIN_WHITELIST', default=[])
-CORS_ALLOW_HEADERS = default_headers + ('X-BUNDLE-SECRET', )
+CORS_ALLOW_HEADERS = default_headers + ('X-BUNDLE-SECRET', 'Idempotency-Key')
+CORS_EXPOSE_HEADERS = (
+    'Retry-After', 'X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-Quota-Limit', 'X-Quota-Remaining', 'X-Quota-Reset',
+)
 CORS_ORIGIN_ALLOW_ALL = env.bool('CORS_ORIGIN_ALLOW_ALL', default=False)
 
 if env.bool('ROLLBAR_ENABLED', default=False):
@@ -222,6 +277,10 @@ if env.bool('FORCE_HTTPS', default=False):
 
 if env.bool('CACHE_ENABLED', default=False):
     _redis_url = env('REDIS_URL', default='redis://localhost:6379/')  # pragma: no cover
+    EVENTS_BUFFER_BACKEND = env('EVENTS_BUFFER_BACKEND', default='main.buffers.RedisEventBuffer')  # pragma: no cover
+    EVENTS_THROTTLE_BACKEND = env(  # pragma: no cover
+        'EVENTS_THROTTLE_BACKEND', default='main.throttling.RedisTokenBucket'
+    )
     CACHES = {  # pragma: no cover
         'default': {
             'BACKEND': 'django_redis.cache.RedisCache',
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from collections import OrderedDict
+from datetime import datetime
+
+import pytz
+
+from django.db.models import Count, DateTimeField, Sum
+from django.db.models.functions import Trunc
+
+from main.models import EventRollup
+
+# Interval (as sent on querystring) -> datetime part it truncates to.
+INTERVALS = OrderedDict([
+    ('1m', 'minute'),
+    ('1h', 'hour'),
+    ('1d', 'day'),
+    ('1M', 'month'),
+])
+GROUP_BY_FIELDS = ('object_type', 'object_id', 'human_identifier')
+
+# Event filters (named as on querystring) rollups are able to answer.
+ROLLUP_FILTERS = ('object_type', 'timestamp__gte', 'timestamp__lt')
+_timezone_offsets = {}
+
+
+class LocalTrunc(Trunc):
+    '''
+    `Trunc` on `tzinfo` that copes with DST changes. Truncated local times may not exist (e.g. midnight, on days
+    clocks are moved forward at midnight) or happen twice (on the hour clocks are moved back), and Django makes
+    them aware with `is_dst=None` - raising for both. Here they are taken as standard time and normalized instead:
+    missing times become the first instant that exists, repeated ones the second time they happen.
+    '''
+    def convert_value(self, value, expression, connection, context):
+        if value is None or not isinstance(self.output_field, DateTimeField):
+            return super(LocalTrunc, self).convert_value(value, expression, connection, context)
+        return self.tzinfo.normalize(self.tzinfo.localize(value.replace(tzinfo=None), is_dst=False))
+
+
+def count_by_bucket(queryset, field, interval, tzinfo, group_by, count):
+    fields = ['bucket'] + ([group_by] if group_by else [])
+    queryset = queryset.annotate(bucket=LocalTrunc(field, INTERVALS[interval], tzinfo=tzinfo))
+
+    # Clearing the default ordering first: it would be part of the GROUP BY otherwise.
+    return queryset.order_by().values(*fields).annotate(count=count).order_by(*fields)
+
+
+def get_event_histogram(queryset, interval, tzinfo, group_by=None):
+    '''
+    Counts of events per time bucket (and per `group_by` field, if given), computed by the database.
+    Buckets are truncated on `tzinfo` - so a "day" is a day for the customer, not an UTC one.
+    '''
+    return count_by_bucket(queryset, 'timestamp', interval, tzinfo, group_by, Count('id'))
+
+
+def get_timezone_offsets(tzinfo):
+    ''' Every UTC offset (in seconds) `tzinfo` had since 1970 - as seen on the first day of each month. '''
+    zone = getattr(tzinfo, 'zone', None) or str(tzinfo)
+    if zone not in _timezone_offsets:
+        _timezone_offsets[zone] = set(
+            int(pytz.utc.localize(datetime(year, month, 1)).astimezone(tzinfo).utcoffset().total_seconds())
+            for year in range(1970, 2038) for month in range(1, 13)
+        )
+    return _timezone_offsets[zone]
+
+
+def get_rollup_period(interval, tzinfo):
+    '''
+    Rollup period able to serve `interval` buckets on `tzinfo`, if any.
+    Rollups are UTC ones: days only match customer days on UTC, and hours only match customer hours on timezones
+    whose offsets are whole hours.
+    '''
+    if INTERVALS[interval] == 'minute':
+        return None
+
+    offsets = get_timezone_offsets(tzinfo)
+    if offsets == set([0]) and INTERVALS[interval] != 'hour':
+        return EventRollup.PERIOD_DAY
+    if all(x % 3600 == 0 for x in offsets):
+        return EventRollup.PERIOD_HOUR
+    return None
+
+
+def get_rollup_histogram(customer, interval, tzinfo, group_by=None, filters=None):
+    '''
+    Same as `get_event_histogram` (for the events of `customer` matching `filters`), read from the rollups instead.
+    Returns None when rollups can't answer it: minute buckets, grouping by anything but object type, filters other
+    than `ROLLUP_FILTERS` or timestamp ranges not aligned with rollup periods.
+    '''
+    filters = filters or {}
+    period = get_rollup_period(interval, tzinfo)
+    if not period or group_by not in (None, 'object_type') or set(filters) - set(ROLLUP_FILTERS):
+        return None
+
+    queryset = EventRollup.objects.filter(customer=customer, period=period)
+    if 'object_type' in filters:
+        queryset = queryset.filter(object_type=filters['object_type'])
+
+    for name, lookup in (('timestamp__gte', 'gte'), ('timestamp__lt', 'lt')):
+        if name not in filters:
+            continue
+        if EventRollup.objects.get_periods(filters[name])[period] != filters[name]:
+            return None  # A rollup would be counted partially.
+        queryset = queryset.filter(**{'period_start__{}'.format(lookup): filters[name]})
+
+    return count_by_bucket(queryset, 'period_start', interval, tzinfo, group_by, Sum('total'))
@@ -1,16 +1,41 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
-
-from rest_framework import viewsets, status, permissions
-from rest_framework.exceptions import MethodNotAllowed
+import inspect
+
+from django_filters.rest_framework import DjangoFilterBackend
+import pytz
+from rest_framework import viewsets, status, permissions, serializers
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import APIException, MethodNotAllowed, ParseError, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from main.models import Event, Customer
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+
+from main.aggregations import get_event_histogram, get_rollup_histogram
+from main.archives import EventArchive, merge_events
+from main.buffers import get_event_buffer
+from main.conditional import get_events_etag
+from main.exporters import EXPORTERS
+from main.filters import EventMetadataFilter, EventSearchFilter
+from main.idempotency import IDEMPOTENCY_KEY_HEADER, IdempotencyStore, pop_idempotency_key
+from main.metadata import get_metadata_filters
+from main.models import Event, Customer, RetentionPolicy
+from main.pagination import ArchivedEventCursorPagination, EventCursorPagination, iterate_by_position
+from main.parsers import NDJSONParser
 from main.serializers import (
     EventSerializer, CustomerSerializer, LoginSerializer, CustomerAuthenticatedSerializer, VerifyAccountSerializer,
-    ResetPasswordSerializer, ChangePasswordSerializer
+    ResetPasswordSerializer, ChangePasswordSerializer, CompiledSerializer, EventHistogramSerializer,
+    RetentionPolicySerializer
 )
+from main.throttling import EventsThrottled, IngestionLimits
+from main.utils import chunked
 
 
 def handler500(request):
@@ -22,6 +47,20 @@ class BaseAPIMixin(object):
     pass
 
 
+class EventBufferFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many events waiting to be stored. Try again later.'
+
+    def __init__(self, wait):
+        super(EventBufferFull, self).__init__()
+        self.wait = wait  # Sent on `Retry-After` header.
+
+
+class LengthRequired(APIException):
+    status_code = status.HTTP_411_LENGTH_REQUIRED
+    default_detail = 'Content-Length header is required: chunked uploads are not supported.'
+
+
 class CustomerAPI(BaseAPIMixin, viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
 
@@ -44,17 +83,393 @@ class CustomerAPI(BaseAPIMixin, viewsets.ModelViewSet):
 
 class EventAPI(BaseAPIMixin, viewsets.ModelViewSet):
     serializer_class = EventSerializer
-    filter_fields = ('object_id', 'object_type', 'human_identifier')
+    filter_fields = {
+        'object_id': ['exact'],
+        'object_type': ['exact'],
+        'human_identifier': ['exact'],
+        'timestamp': ['gte', 'lt'],
+    }
     search_fields = ('object_id', 'object_type', 'human_identifier', 'message')
+    filter_backends = (DjangoFilterBackend, OrderingFilter, EventSearchFilter, EventMetadataFilter)
+    pagination_class = EventCursorPagination
+    LIMIT_OFFSET_QUERY_PARAMS = ('limit', 'offset', 'ordering')
+    INCLUDE_ARCHIVED_QUERY_PARAM = 'include_archived'
+
+    # Fields needed no matter what is serialized (cursor pagination is based on them).
+    ALWAYS_LOADED_FIELDS = ('id', 'timestamp')
 
     def get_queryset(self):
-        return Event.objects.filter(customer=self.request.user)
+        queryset = Event.objects.filter(customer=self.request.user)
+
+        if self.action in ('list', 'export'):
+            # Only SELECT the columns that are going to be serialized.
+            field_names = self.get_compiled_serializer().model_field_names
+            if field_names is not None:
+                queryset = queryset.only(*set(field_names + self.ALWAYS_LOADED_FIELDS))
+
+        return queryset
+
+    def get_used_filters(self):
+        ''' {filter name: cleaned value} of the filters used on querystring, or None if they are not valid. '''
+        filterset_class = DjangoFilterBackend().get_filter_class(self, self.get_queryset())
+        form = filterset_class(self.request.query_params).form
+        if not form.is_valid():
+            return None
+
+        filters = {name: value for name, value in form.cleaned_data.items() if value not in (None, '')}
+        search = self.request.query_params.get(api_settings.SEARCH_PARAM)
+        if search:
+            filters[api_settings.SEARCH_PARAM] = search
+        metadata = get_metadata_filters(self.request.query_params)
+        if metadata:
+            filters['metadata'] = metadata
+        return filters
+
+    def get_compiled_serializer(self):
+        if not hasattr(self, '_compiled_serializer'):
+            default_exclude = ('metadata', ) if settings.EVENTS_LIST_DEFER_METADATA and self.action == 'list' else ()
+            self._compiled_serializer = CompiledSerializer.for_request(
+                self.get_serializer_class(), self.request, default_exclude=default_exclude
+            )
+        return self._compiled_serializer
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = self.get_pagination_class()()
+        return self._paginator
+
+    def get_pagination_class(self):
+        # Cursors only work on (timestamp, id) ordering. Other orderings (and old clients) go for limit/offset.
+        limit_offset = any(x in self.request.query_params for x in self.LIMIT_OFFSET_QUERY_PARAMS)
+        if self.is_archive_included():
+            if limit_offset:
+                raise ValidationError({self.INCLUDE_ARCHIVED_QUERY_PARAM: [
+                    'Cannot be used along with {}.'.format(', '.join(self.LIMIT_OFFSET_QUERY_PARAMS))
+                ]})
+            return ArchivedEventCursorPagination
+
+        if limit_offset:
+            return LimitOffsetPagination
+        return self.pagination_class
+
+    def is_archive_included(self):
+        return self.request.query_params.get(self.INCLUDE_ARCHIVED_QUERY_PARAM) in ('1', 'true')
+
+    def get_event_archive(self):
+        return EventArchive(self.request.user, self.get_used_filters())
 
     def create(self, request):
+        key = request.META.get(IDEMPOTENCY_KEY_HEADER)
+        if key is None:
+            return self.perform_create_event(request)
+
+        store = IdempotencyStore(request.user.pk)
+        result = store.claim(key, request.data)
+        if result is not None:
+            return Response(result['data'], status=result['status'], headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = self.perform_create_event(request)
+        except Exception:
+            store.release(key)
+            raise
+
+        store.save(key, request.data, {'status': response.status_code, 'data': response.data})
+        return response
+
+    def perform_create_event(self, request):
+        buffer = self.get_event_buffer()
         serializer = self.get_serializer_class()(data=request.data, context=self.get_serializer_context())
         serializer.is_valid(raise_exception=True)
+
+        if buffer is None:
+            limits = self.get_ingestion_limits()
+            limits.consume(1)
+            try:
+                serializer.save(customer=self.request.user)
+            except Exception:
+                limits.refund(1)
+                raise
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        event = Event(customer=self.request.user, **serializer.validated_data)
+        self.save_events([event], buffer=buffer)
+        return self.get_accepted_response(self.get_serializer(event).data)
+
+    @list_route(methods=['get'])
+    def export(self, request):
+        exporter_class = EXPORTERS.get(request.query_params.get('output', 'ndjson'))
+        if not exporter_class:
+            raise ValidationError({'output': ['Choose one of: {}.'.format(', '.join(sorted(EXPORTERS)))]})
+
+        serializer = self.get_compiled_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        events = iterate_by_position(queryset, settings.EVENTS_EXPORT_CHUNK_SIZE)
+        if self.is_archive_included():
+            events = merge_events(events, self.get_event_archive().iterate())
+
+        exporter = exporter_class(serializer.field_names)
+        response = StreamingHttpResponse(
+            exporter.iter_lines(serializer.to_representation(x) for x in events), content_type=exporter.content_type
+        )
+        response['Content-Disposition'] = 'attachment; filename="events.{}"'.format(exporter.extension)
+        return response
+
+    @list_route(methods=['get'])
+    def histogram(self, request):
+        params = EventHistogramSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        interval, group_by = params.validated_data['interval'], params.validated_data.get('group_by')
+
+        tzinfo = pytz.timezone(request.user.timezone)
+        buckets = None
+        if settings.EVENTS_HISTOGRAM_USE_ROLLUPS:
+            filters = self.get_used_filters()
+            if filters is not None:
+                buckets = get_rollup_histogram(request.user, interval, tzinfo, group_by=group_by, filters=filters)
+
+        if buckets is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            buckets = get_event_histogram(queryset, interval, tzinfo, group_by=group_by)
+        buckets = list(buckets[:settings.EVENTS_HISTOGRAM_MAX_RESULTS + 1])
+
+        if len(buckets) > settings.EVENTS_HISTOGRAM_MAX_RESULTS:
+            raise ValidationError({'interval': [
+                'Too many results (more than {}). Use a bigger interval or a shorter timestamp range.'.format(
+                    settings.EVENTS_HISTOGRAM_MAX_RESULTS
+                )
+            ]})
+
+        bucket_field = serializers.DateTimeField()
+        for bucket in buckets:
+            bucket['bucket'] = bucket_field.to_representation(bucket['bucket'])
+
+        return Response({'interval': interval, 'timezone': request.user.timezone, 'results': buckets})
+
+    @list_route(methods=['post'], parser_classes=list(api_settings.DEFAULT_PARSER_CLASSES) + [NDJSONParser])
+    def bulk(self, request):
+        if request.content_type.startswith(NDJSONParser.media_type):
+            return self.bulk_ndjson(request)
+
+        if not isinstance(request.data, list):
+            raise ValidationError('Expected a list of events.')
+
+        if len(request.data) > settings.EVENTS_BULK_MAX_SIZE:
+            raise ValidationError('Up to {} events are allowed per request.'.format(settings.EVENTS_BULK_MAX_SIZE))
+
+        buffer = self.get_event_buffer()
+        results = self.perform_bulk_create(request.data, buffer=buffer)
+        if any(x['status'] >= status.HTTP_400_BAD_REQUEST for x in results):
+            return Response({'results': results}, status=status.HTTP_207_MULTI_STATUS)
+        if buffer is not None:
+            return self.get_accepted_response({'results': results})
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+    def bulk_ndjson(self, request):
+        '''
+        Streams the request body in chunks, so memory usage does not depend on the upload size.
+        Only a summary is returned (instead of every created event), with errors reported up to a limit.
+        '''
+        if not inspect.isgenerator(request.data):
+            # DRF takes bodies with no Content-Length (e.g. `Transfer-Encoding: chunked`) as empty ones.
+            if not request.META.get('CONTENT_LENGTH'):
+                raise LengthRequired()
+            raise ValidationError('Expected newline-delimited events.')
+
+        buffer = self.get_event_buffer()
+        accepted, rejected, errors = 0, 0, []
+
+        for index, chunk in enumerate(chunked(request.data, settings.EVENTS_NDJSON_CHUNK_SIZE)):
+            try:
+                if index:  # The buffer may have filled up since the previous chunk.
+                    self.check_event_buffer(buffer)
+                results = self.perform_bulk_create([item for _, item in chunk], buffer=buffer, with_data=False)
+            except (EventsThrottled, EventBufferFull) as exc:
+                # Lines before this chunk were stored already: the summary tells where to resume from.
+                data = {'detail': exc.detail, 'accepted': accepted, 'rejected': rejected, 'errors': errors}
+                return Response(data, status=exc.status_code, headers={'Retry-After': str(exc.wait)})
+
+            for (line_number, _), result in zip(chunk, results):
+                if result['status'] < status.HTTP_400_BAD_REQUEST:
+                    accepted += 1
+                    continue
+
+                rejected += 1
+                if len(errors) < settings.EVENTS_NDJSON_MAX_REPORTED_ERRORS:
+                    errors.append({'line': line_number, 'errors': result['errors']})
+
+        data = {'accepted': accepted, 'rejected': rejected, 'errors': errors}
+        if rejected:
+            return Response(data, status=status.HTTP_207_MULTI_STATUS)
+        if buffer is not None:
+            return self.get_accepted_response(data)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def perform_bulk_create(self, items, buffer=None, with_data=True):
+        '''
+        Validates every item on its own and inserts the valid ones with a single query (or queues them on `buffer`).
+        Returns one result per item, in the same order they were sent - with the created event `data`, if asked to.
+        Items carrying an idempotency key seen before get the original result back instead (see `IdempotencyStore`).
+        '''
+        results = [None] * len(items)
+        store = IdempotencyStore(self.request.user.pk)
+        claimed = []  # (index, item, key) of the items to go on with.
+
+        for index, item in enumerate(items):
+            key, item = pop_idempotency_key(item)
+            if key is not None:
+                try:
+                    results[index] = store.claim(key, item)
+                except APIException as exc:
+                    results[index] = {'status': exc.status_code, 'errors': self.get_item_errors(exc)}
+                if results[index] is not None:
+                    continue
+            claimed.append((index, item, key))
+
+        keys = [key for _, _, key in claimed if key is not None]
+        try:
+            events, errors = self.validate_bulk([item for _, item, _ in claimed])
+            self.save_events([event for _, event in events], buffer=buffer)
+        except Exception:
+            store.release(*keys)
+            raise
+
+        for position, item_errors in errors:
+            index, _, key = claimed[position]
+            results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': item_errors}
+            if key is not None:
+                store.release(key)
+
+        item_status = status.HTTP_201_CREATED if buffer is None else status.HTTP_202_ACCEPTED
+        data = self.get_serializer([event for _, event in events], many=True).data if with_data else None
+        for position, (claimed_position, _) in enumerate(events):
+            index, item, key = claimed[claimed_position]
+            results[index] = {'status': item_status}
+            if with_data:
+                results[index]['data'] = data[position]
+            if key is not None:
+                store.save(key, item, results[index])
+
+        return results
+
+    def get_item_errors(self, exc):
+        if isinstance(exc.detail, dict):
+            return exc.detail
+        return {api_settings.NON_FIELD_ERRORS_KEY: [exc.detail]}
+
+    def is_write_behind(self):
+        ''' Clients opt in for write-behind mode by sending `Prefer: respond-async` header. '''
+        preferences = self.request.META.get('HTTP_PREFER', '').split(',')
+        return 'respond-async' in [x.split(';')[0].strip().lower() for x in preferences]
+
+    def get_event_buffer(self):
+        ''' Events buffer on write-behind mode, None otherwise. Requests are turned down while the buffer is full. '''
+        if not self.is_write_behind():
+            return None
+
+        buffer = get_event_buffer()
+        self.check_event_buffer(buffer)
+        return buffer
+
+    def check_event_buffer(self, buffer):
+        ''' Raises `EventBufferFull` if `buffer` (if any) is full. '''
+        if buffer is not None and buffer.is_full():
+            raise EventBufferFull(wait=settings.EVENTS_BUFFER_RETRY_AFTER_IN_SECONDS)
+
+    def save_events(self, events, buffer=None):
+        ''' Inserts `events` (or queues them on `buffer`), as long as customer's rate limit and quota allow it. '''
+        self.get_ingestion_limits().consume(len(events))
+        try:
+            if buffer is not None:
+                buffer.append(events)
+                return
+
+            with transaction.atomic():
+                Event.objects.bulk_create(events)
+        except Exception:
+            self.get_ingestion_limits().refund(len(events))
+            raise
+
+    def get_ingestion_limits(self):
+        if not hasattr(self, '_ingestion_limits'):
+            self._ingestion_limits = IngestionLimits(self.request.user.pk)
+        return self._ingestion_limits
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(EventAPI, self).finalize_response(request, response, *args, **kwargs)
+        if hasattr(self, '_ingestion_limits'):
+            for name, value in self._ingestion_limits.get_headers().items():
+                response[name] = value
+        return response
+
+    def get_accepted_response(self, data):
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers={'Preference-Applied': 'respond-async'})
+
+    def validate_bulk(self, items):
+        '''
+        Returns the `(index, event)` pairs for the valid items (events are not saved yet) and the
+        `(index, errors)` pairs for the invalid ones.
+        '''
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        events, errors = [], []
+
+        for index, item in enumerate(items):
+            if isinstance(item, ParseError):
+                errors.append((index, {api_settings.NON_FIELD_ERRORS_KEY: [item.detail]}))
+                continue
+
+            serializer = serializer_class(data=item, context=context)
+            if serializer.is_valid():
+                events.append((index, Event(customer=self.request.user, **serializer.validated_data)))
+            else:
+                errors.append((index, serializer.errors))
+
+        return events, errors
+
+    def get_conditional_response(self, request, handler, *args, **kwargs):
+        '''
+        Runs `handler` and tags its response with an ETag (see `main.conditional`). Requests sending it back on
+        If-None-Match get a 304 as long as no event of the customer has changed - without querying events at all.
+        '''
+        etag = get_events_etag(request)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = quote_etag(etag)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(request, super(EventAPI, self).retrieve, *args, **kwargs)
+
+    def list_events(self, request):
+        # Same as ListModelMixin.list, but skipping serializer machinery on the way out.
+        serializer = self.get_compiled_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation_many(page))
+
+        return Response(serializer.to_representation_many(queryset))
+
+    # Defined down here so it doesn't shadow the `list` builtin on the class body above.
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(request, self.list_events)
+
+
+class RetentionPolicyAPI(BaseAPIMixin, viewsets.ModelViewSet):
+    serializer_class = RetentionPolicySerializer
+
+    def get_queryset(self):
+        return RetentionPolicy.objects.filter(customer=self.request.user)
+
+    def perform_create(self, serializer):
         serializer.save(customer=self.request.user)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class LoginAPI(BaseAPIMixin, APIView):
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from collections import Counter, deque
+import calendar
+import gzip
+import heapq
+import itertools
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import Min
+
+from main.buffers import decode_event, encode_event
+from main.conditional import bump_events_version
+from main.metadata import matches_metadata
+from main.models import Event, EventArchiveSegment, EventRollup
+from main.pagination import iterate_by_position
+from main.partitions import add_months, month_range
+from main.search import get_event_search
+from main.utils import chunked
+
+SEARCH_FIELDS = ('message', 'object_type', 'object_id', 'human_identifier')
+EXACT_FILTERS = ('object_type', 'object_id', 'human_identifier')
+
+
+def get_descending_key(timestamp, pk):
+    ''' Sort key putting events on `(-timestamp, -id)` ordering (the one of events list) when sorted ascending. '''
+    microseconds = calendar.timegm(timestamp.utctimetuple()) * 10 ** 6 + timestamp.microsecond
+    return -microseconds, -pk.int
+
+
+def get_event_key(event):
+    return get_descending_key(event.timestamp, event.id)
+
+
+def merge_events(*streams):
+    ''' Merges streams of events on `(-timestamp, -id)` ordering into a single one (on the same ordering). '''
+    decorated = [((get_event_key(x), index, x) for x in stream) for index, stream in enumerate(streams)]
+    return (x[-1] for x in heapq.merge(*decorated))
+
+
+class EventArchiver(object):
+    '''
+    Moves events older than a cutoff out of events table, into gzipped NDJSON files (one event per line, newest
+    first) on EVENTS_ARCHIVE_STORAGE - a Django storage, so anything from local disk to an object store will do.
+    Files are per customer and per month, holding up to `segment_size` events each (a busy month takes a few of them),
+    and are indexed by `EventArchiveSegment`.
+
+    An events chunk is deleted on the same transaction its segment is indexed on, so events are never found on both
+    places. Note that changes to events made while their segment is being written are lost - archive old enough
+    events only.
+    '''
+
+    def __init__(self, storage=None, segment_size=None, chunk_size=None):
+        self.storage = storage or EventArchiveSegment.get_storage()
+        self.segment_size = segment_size or settings.EVENTS_ARCHIVE_SEGMENT_MAX_EVENTS
+        self.chunk_size = chunk_size or settings.EVENTS_ARCHIVE_CHUNK_SIZE
+
+    def archive(self, cutoff, customers):
+        ''' Archives events of `customers` older than `cutoff`. Yields (segment, seconds) per segment written. '''
+        for customer in customers:
+            events = Event.objects.filter(customer=customer, timestamp__lt=cutoff)
+            oldest = events.aggregate(oldest=Min('timestamp'))['oldest']
+            if oldest is None:
+                continue
+
+            for month in month_range(oldest, cutoff):
+                for result in self.archive_range(customer, month, min(add_months(month, 1), cutoff)):
+                    yield result
+
+    def archive_range(self, customer, start, end):
+        events = Event.objects.filter(customer=customer, timestamp__gte=start, timestamp__lt=end)
+
+        while True:
+            started_at = time.time()
+            segment = self.write_segment(customer, start, events)
+            if segment is None:
+                return
+
+            yield segment, time.time() - started_at
+            if segment.events_count < self.segment_size:
+                return
+
+    def write_segment(self, customer, month, events):
+        ''' Archives the `segment_size` newest of `events` (all of them from the same month) into a new segment. '''
+        segment = EventArchiveSegment(customer=customer, events_count=0)
+        ids, counts = [], Counter()
+
+        with tempfile.TemporaryFile() as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as archive:
+                newest = itertools.islice(iterate_by_position(events, self.chunk_size), self.segment_size)
+                for chunk in chunked(newest, self.chunk_size):
+                    archive.write(''.join(encode_event(x) + '\n' for x in chunk).encode('utf-8'))
+                    ids.extend(x.id for x in chunk)
+                    counts.update(EventRollup.objects.get_counts(chunk))
+
+                    segment.end_timestamp = segment.end_timestamp or chunk[0].timestamp
+                    segment.start_timestamp = chunk[-1].timestamp
+
+            if not ids:
+                return None
+
+            segment.events_count = len(ids)
+            segment.size = f.tell()
+            f.seek(0)
+            name = os.path.join(
+                str(customer.pk), '{:04d}-{:02d}'.format(month.year, month.month), '{}.ndjson.gz'.format(segment.id)
+            )
+            segment.path = self.storage.save(name, File(f, name=name))
+
+        try:
+            with transaction.atomic():
+                segment.save()
+                # No signals for every single event: rollups and versions are updated once per segment.
+                for chunk in chunked(ids, self.chunk_size):
+                    Event.objects.filter(id__in=chunk).delete_without_signals()
+                EventRollup.objects.remove_counts(counts)
+        except Exception:
+            self.storage.delete(segment.path)
+            raise
+
+        bump_events_version(customer.pk)
+        return segment
+
+
+class EventArchive(object):
+    '''
+    Archived events of a customer, read back (newest first) straight from the segments - nothing is imported back.
+    `filters` are the ones of events list (see `EventAPI.get_used_filters`); `None` means they are invalid and
+    nothing is found. Only the segments overlapping the requested time range are opened, and only when the reading
+    gets to them.
+    '''
+
+    def __init__(self, customer, filters=None, storage=None):
+        self.customer = customer
+        self.filters = filters
+        self.storage = storage or EventArchiveSegment.get_storage()
+        self.search_terms = (filters or {}).get('search', '').replace(',', ' ').lower().split()
+        self.search = get_event_search(connection)
+
+    def get_segments(self, newer_than=None, older_than=None):
+        ''' Segments that may hold matching events, newest first. '''
+        if self.filters is None:
+            return []
+
+        segments = self.customer.archive_segments.order_by('-end_timestamp', '-start_timestamp')
+        if 'timestamp__gte' in self.filters:
+            segments = segments.filter(end_timestamp__gte=self.filters['timestamp__gte'])
+        if 'timestamp__lt' in self.filters:
+            segments = segments.filter(start_timestamp__lt=self.filters['timestamp__lt'])
+        if newer_than is not None:
+            segments = segments.filter(end_timestamp__gte=newer_than)
+        if older_than is not None:
+            segments = segments.filter(start_timestamp__lte=older_than)
+        return list(segments)
+
+    def read_segment(self, segment):
+        with self.storage.open(segment.path, 'rb') as f:
+            with gzip.GzipFile(fileobj=f, mode='rb') as archive:
+                for line in archive:
+                    yield decode_event(line.decode('utf-8'))
+
+    def matches(self, event):
+        for name in EXACT_FILTERS:
+            if name in self.filters and getattr(event, name) != self.filters[name]:
+                return False
+
+        if 'timestamp__gte' in self.filters and event.timestamp < self.filters['timestamp__gte']:
+            return False
+        if 'timestamp__lt' in self.filters and event.timestamp >= self.filters['timestamp__lt']:
+            return False
+        if 'metadata' in self.filters and not matches_metadata(event.metadata, self.filters['metadata']):
+            return False
+
+        if not self.search_terms:
+            return True
+        if self.search:  # Same rules of events list: word prefixes, as on the full-text index.
+            return self.search.matches(event, self.search_terms)
+
+        # Same rules of DRF's SearchFilter (the fallback of events list): every term must be found on some field.
+        values = [getattr(event, x).lower() for x in SEARCH_FIELDS]
+        return all(any(term in value for value in values) for term in self.search_terms)
+
+    def iterate(self, segments=None):
+        ''' Matching events of `segments` (all of them by default), newest first. '''
+        if segments is None:
+            segments = self.get_segments()
+
+        # Segments overlapping each other are merged, the others are simply read one after another.
+        groups, oldest = [], None
+        for segment in segments:
+            if oldest is None or segment.end_timestamp < oldest:
+                groups.append([])
+                oldest = segment.start_timestamp
+            groups[-1].append(segment)
+            oldest = min(oldest, segment.start_timestamp)
+
+        for group in groups:
+            for event in merge_events(*[self.read_segment(x) for x in group]):
+                if self.matches(event):
+                    yield event
+
+    def fetch(self, position, reverse, count):
+        '''
+        Up to `count` matching events after the (timestamp, id) `position` on `(-timestamp, -id)` ordering
+        (or the closest ones before it - on `(timestamp, id)` ordering - if `reverse`). Works just like cursor
+        pagination does on the database.
+        '''
+        if position is None:
+            return [] if reverse else list(itertools.islice(self.iterate(), count))
+
+        key = get_descending_key(*position)
+        if reverse:
+            newer = itertools.takewhile(lambda x: get_event_key(x) < key, self.iterate(self.get_segments(
+                newer_than=position[0]
+            )))
+            return list(reversed(deque(newer, maxlen=count)))
+
+        older = itertools.dropwhile(lambda x: get_event_key(x) <= key, self.iterate(self.get_segments(
+            older_than=position[0]
+        )))
+        return list(itertools.islice(older, count))
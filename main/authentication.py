@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+
+def get_token_cache_key(key):
+    return '{}:{}'.format(settings.CACHE_PREFIX['AUTH_TOKEN'], key)
+
+
+def invalidate_cached_tokens(*keys):
+    cache.delete_many([get_token_cache_key(x) for x in keys])
+
+
+def get_credentials_cache_key(email, password):
+    ''' Keyed HMAC of the credentials: neither the email nor the password show up on cache keys. '''
+    value = '{}\x00{}'.format(email.lower(), password)
+    digest = salted_hmac('main.authentication.CachedBasicAuthentication', value).hexdigest()
+    return '{}:{}'.format(settings.CACHE_PREFIX['AUTH_BASIC'], digest)
+
+
+def get_password_fingerprint(user):
+    ''' Keyed HMAC of `user` password hash - it changes along with the password. '''
+    return salted_hmac('main.authentication.get_password_fingerprint', user.password).hexdigest()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    TokenAuthentication keeping the token -> customer id resolution in cache, so most requests look the customer up by
+    id instead of joining tokens table. The customer itself is not cached - its changes show up right away. Entries
+    are dropped whenever the token changes or goes away (see signals on `main.models`).
+    '''
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+
+        user_pk = cache.get(cache_key)
+        if user_pk is not None:
+            user = get_user_model().objects.filter(pk=user_pk).first()
+            if user is not None and user.is_active:
+                return (user, Token(key=key, user=user))
+
+        user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+        cache.set(cache_key, user.pk, settings.AUTH_TOKEN_CACHE_TIME_TO_LIVE_IN_SECONDS)
+        return (user, token)
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    '''
+    BasicAuthentication remembering successful credential checks for AUTH_BASIC_CACHE_TIME_TO_LIVE_IN_SECONDS, so the
+    (deliberately slow) password hasher does not run on every request.
+    Entries are keyed by an HMAC of the credentials and hold the customer id plus a fingerprint of its password hash
+    only. The customer is loaded by id on every request, and entries stop matching as soon as its email or password
+    change - no invalidation needed.
+    '''
+
+    def authenticate_credentials(self, userid, password):
+        cache_key = get_credentials_cache_key(userid, password)
+
+        cached = cache.get(cache_key)
+        if cached is not None:
+            user_pk, fingerprint = cached
+            user = get_user_model().objects.filter(pk=user_pk).first()
+            if (
+                user is not None and user.is_active and user.email.lower() == userid.lower() and
+                constant_time_compare(get_password_fingerprint(user), fingerprint)
+            ):
+                return (user, None)
+
+        user, auth = super(CachedBasicAuthentication, self).authenticate_credentials(userid, password)
+        cached = (user.pk, get_password_fingerprint(user))
+        cache.set(cache_key, cached, settings.AUTH_BASIC_CACHE_TIME_TO_LIVE_IN_SECONDS)
+        return (user, auth)
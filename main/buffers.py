@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from contextlib import closing
+import json
+import logging
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from main.models import Customer, Event
+
+logger = logging.getLogger(__name__)
+
+
+def encode_event(event):
+    return json.dumps({
+        x.attname: None if x.value_from_object(event) is None else x.value_to_string(event)
+        for x in Event._meta.concrete_fields
+    })
+
+
+def decode_event(payload):
+    values = json.loads(payload)
+    return Event(**{
+        x.attname: None if values[x.attname] is None else (x.target_field if x.is_relation else x).to_python(
+            values[x.attname]
+        )
+        for x in Event._meta.concrete_fields
+    })
+
+
+class BaseEventBuffer(object):
+    '''
+    Durable FIFO of events accepted on write-behind mode, waiting to be inserted (see `flush_event_buffer`
+    management command). Events leave the buffer only after they are committed, and flushing skips the ones
+    inserted already - a crashed flusher loses nothing and duplicates nothing. There must be a single flusher.
+    Events failing to be inserted EVENTS_BUFFER_MAX_ATTEMPTS times in a row are moved to dead letters, so they don't
+    hold the others back - put them back with `requeue_dead_letters` once the cause is fixed.
+    '''
+    is_local = False  # Whether only processes of the same host see the buffer.
+
+    def push(self, payloads):
+        raise NotImplementedError
+
+    def peek(self, count):
+        ''' The `count` oldest payloads (without removing them). '''
+        raise NotImplementedError
+
+    def ack(self, count):
+        ''' Removes the `count` oldest payloads. '''
+        raise NotImplementedError
+
+    def depth(self):
+        raise NotImplementedError
+
+    def move_to_dead_letters(self, count):
+        ''' Moves the `count` oldest payloads to dead letters. '''
+        raise NotImplementedError
+
+    def requeue_dead_letters(self):
+        ''' Moves every dead letter back to the buffer (as the newest payloads). Returns how many. '''
+        raise NotImplementedError
+
+    def dead_letters_depth(self):
+        raise NotImplementedError
+
+    def is_full(self):
+        return self.depth() >= settings.EVENTS_BUFFER_MAX_SIZE
+
+    def append(self, events):
+        self.push([encode_event(x) for x in events])
+
+    def flush(self, batch_size):
+        '''
+        Inserts up to `batch_size` of the oldest events with a single query. Returns how many were inserted.
+        A batch failing to be inserted is retried one event at a time, so only the failing event is held back.
+        '''
+        payloads = self.peek(batch_size)
+        if not payloads:
+            return 0
+
+        started_at = time.time()
+        try:
+            inserted = self.insert(payloads)
+        except Exception:
+            if len(payloads) > 1:
+                return sum(self.flush(1) for _ in payloads)
+
+            attempts = self.get_flush_stats().get('failed_attempts', 0) + 1
+            if attempts < settings.EVENTS_BUFFER_MAX_ATTEMPTS:
+                self.update_flush_stats(failed_attempts=attempts)
+                raise
+
+            logger.exception('[Events buffer] Event moved to dead letters after {} attempts'.format(attempts))
+            self.move_to_dead_letters(1)
+            self.update_flush_stats(failed_attempts=0)
+            return 0
+
+        self.ack(len(payloads))
+        self.record_flush(inserted, time.time() - started_at)
+        return inserted
+
+    def insert(self, payloads):
+        events = [decode_event(x) for x in payloads]
+
+        # Events of customers deleted meanwhile are dropped, as well as the ones a crashed flush inserted already.
+        customer_ids = set(Customer.objects.filter(
+            id__in=set(x.customer_id for x in events)
+        ).values_list('id', flat=True))
+        inserted_ids = set(Event.objects.filter(id__in=[x.id for x in events]).values_list('id', flat=True))
+        events = [x for x in events if x.customer_id in customer_ids and x.id not in inserted_ids]
+
+        with transaction.atomic():
+            Event.objects.bulk_create(events)
+        return len(events)
+
+    def record_flush(self, count, seconds):
+        self.update_flush_stats(
+            last_flush_at=timezone.now().isoformat(),
+            last_flush_events=count,
+            last_flush_seconds=round(seconds, 6),
+            flushed_events=self.get_flush_stats().get('flushed_events', 0) + count,
+            failed_attempts=0,
+        )
+        logger.info('[Events buffer] {} event(s) flushed in {:.3f}s'.format(count, seconds))
+
+    def get_flush_stats(self):
+        return cache.get(settings.CACHE_PREFIX['EVENTS_BUFFER_STATS']) or {}
+
+    def update_flush_stats(self, **kwargs):
+        stats = self.get_flush_stats()
+        stats.update(kwargs)
+        cache.set(settings.CACHE_PREFIX['EVENTS_BUFFER_STATS'], stats, timeout=None)
+
+    def get_stats(self):
+        '''
+        Buffer (and dead letters) depth plus the stats of the last flush (and how many events were flushed so far).
+        '''
+        stats = self.get_flush_stats()
+        stats['depth'] = self.depth()
+        stats['dead_letters'] = self.dead_letters_depth()
+        return stats
+
+
+class RedisEventBuffer(BaseEventBuffer):
+    ''' A Redis list (on the cache server). '''
+
+    def __init__(self):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+        self.key = settings.EVENTS_BUFFER_REDIS_KEY
+        self.dead_letters_key = '{}:dead-letters'.format(self.key)
+
+    def push(self, payloads):
+        if payloads:
+            self.redis.rpush(self.key, *payloads)
+
+    def peek(self, count):
+        return [x.decode('utf-8') for x in self.redis.lrange(self.key, 0, count - 1)]
+
+    def ack(self, count):
+        self.redis.ltrim(self.key, count, -1)
+
+    def depth(self):
+        return self.redis.llen(self.key)
+
+    def move(self, source, target, count):
+        payloads = self.redis.lrange(source, 0, count - 1)
+        if payloads:
+            pipeline = self.redis.pipeline()  # MULTI/EXEC: moved all at once.
+            pipeline.rpush(target, *payloads)
+            pipeline.ltrim(source, len(payloads), -1)
+            pipeline.execute()
+        return len(payloads)
+
+    def move_to_dead_letters(self, count):
+        self.move(self.key, self.dead_letters_key, count)
+
+    def requeue_dead_letters(self):
+        return self.move(self.dead_letters_key, self.key, self.dead_letters_depth())
+
+    def dead_letters_depth(self):
+        return self.redis.llen(self.dead_letters_key)
+
+
+class SQLiteEventBuffer(BaseEventBuffer):
+    ''' An append-only spool on a local SQLite file - for local runs and single-box deployments. '''
+    is_local = True
+
+    def __init__(self, path=None):
+        self.path = path or settings.EVENTS_BUFFER_SQLITE_PATH
+        sql = 'CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)'
+        self.execute_all([(sql.format(x), ()) for x in ('events', 'dead_letters')])
+
+    def execute(self, sql, params=(), many=False):
+        return self.execute_all([(sql, params)], many=many)[-1]
+
+    def execute_all(self, statements, many=False):
+        ''' Runs every (sql, params) of `statements` on a single transaction. Returns the rows each one fetched. '''
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            with connection:  # Commits (or rolls back) on the way out.
+                results = []
+                for sql, params in statements:
+                    cursor = connection.executemany(sql, params) if many else connection.execute(sql, params)
+                    results.append(cursor.fetchall())
+                return results
+
+    def push(self, payloads):
+        self.execute('INSERT INTO events (payload) VALUES (?)', [(x, ) for x in payloads], many=True)
+
+    def peek(self, count):
+        return [x[0] for x in self.execute('SELECT payload FROM events ORDER BY id LIMIT ?', (count, ))]
+
+    def ack(self, count):
+        self.execute('DELETE FROM events WHERE id IN (SELECT id FROM events ORDER BY id LIMIT ?)', (count, ))
+
+    def depth(self):
+        return self.execute('SELECT count(*) FROM events')[0][0]
+
+    def move(self, source, target, count):
+        oldest = 'SELECT {{}} FROM {} ORDER BY id LIMIT ?'.format(source)
+        self.execute_all([
+            ('INSERT INTO {} (payload) {}'.format(target, oldest.format('payload')), (count, )),
+            ('DELETE FROM {} WHERE id IN ({})'.format(source, oldest.format('id')), (count, )),
+        ])
+
+    def move_to_dead_letters(self, count):
+        self.move('events', 'dead_letters', count)
+
+    def requeue_dead_letters(self):
+        count = self.dead_letters_depth()
+        self.move('dead_letters', 'events', count)
+        return count
+
+    def dead_letters_depth(self):
+        return self.execute('SELECT count(*) FROM dead_letters')[0][0]
+
+
+def get_event_buffer():
+    backend = import_string(settings.EVENTS_BUFFER_BACKEND)
+    if backend.is_local and settings.EVENTS_BUFFER_FLUSHED_ELSEWHERE:
+        raise ImproperlyConfigured(
+            '{} is only seen by processes of its own host, but events are flushed elsewhere '
+            '(EVENTS_BUFFER_FLUSHED_ELSEWHERE) - use main.buffers.RedisEventBuffer.'.format(backend.__name__)
+        )
+    return backend()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def get_events_version_cache_key(customer_id):
+    return '{}:{}'.format(settings.CACHE_PREFIX['EVENTS_VERSION'], customer_id)
+
+
+def get_events_version(customer_id):
+    '''
+    Opaque token changing whenever any event of the customer changes.
+    Versions are random (rather than a counter) so an evicted entry never comes back as a version seen before.
+    '''
+    key = get_events_version_cache_key(customer_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_events_version(*customer_ids):
+    def bump():
+        cache.set_many({get_events_version_cache_key(x): uuid.uuid4().hex for x in customer_ids}, timeout=None)
+
+    # Bumped right away and once again after commit: a request that read the version before the commit (and so
+    # didn't see the change yet) must not have its ETag matching afterwards.
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_events_etag(request):
+    ''' ETag of the events representation for `request`: changes along with the events, the URL and the format. '''
+    value = '{}\x00{}\x00{}'.format(
+        get_events_version(request.user.pk), request.get_full_path(), request.accepted_renderer.media_type
+    )
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
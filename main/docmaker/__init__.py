@@ -131,6 +131,8 @@ class DocMaker(APITestCase):
 
         context = {
             'updated_at': now,
+            'throttle_burst': settings.EVENTS_THROTTLE_BURST,
+            'throttle_rate': '{:g}'.format(settings.EVENTS_THROTTLE_RATE),
         }
 
         # Auth
@@ -149,6 +151,9 @@ class DocMaker(APITestCase):
         # Events
         context.update({'get_events_list': self.adapt_response('get', reverse('events-list'))})
 
+        data = {'interval': '1h', 'group_by': 'object_type'}
+        context.update({'get_events_histogram': self.adapt_response('get', reverse('events-histogram'), data)})
+
         context.update({'get_events_detail': self.adapt_response('get', event_details_url)})
 
         data = {
@@ -157,11 +162,37 @@ class DocMaker(APITestCase):
         }
         context.update({'post_events_list': self.adapt_response('post', reverse('events-list'), data)})
 
+        data = [
+            {
+                'message': 'User got mad', 'timestamp': fake_now,
+                'object_type': 'users.models.User', 'object_id': '1234', 'human_identifier': 'Mr Anderson',
+            },
+            {
+                'message': 'User calmed down', 'timestamp': fake_now,
+                'object_type': 'users.models.User', 'object_id': '1234', 'human_identifier': '',
+            },
+        ]
+        context.update({'post_events_bulk': self.adapt_response('post', reverse('events-bulk'), data, format='json')})
+
         data = {'message': 'Fixed message'}
         context.update({'patch_events_detail': self.adapt_response('patch', event_details_url, data)})
 
         context.update({'delete_events_detail': self.adapt_response('delete', event_details_url)})
 
+        # Retention policies
+        data = {'object_type': 'users.models.User', 'days': 365}
+        context.update({
+            'post_retention_policies_list': self.adapt_response('post', reverse('retention-policies-list'), data)
+        })
+        policy_details_url = reverse('retention-policies-detail', kwargs={'pk': self.user.retention_policies.get().pk})
+
+        context.update({'get_retention_policies_list': self.adapt_response('get', reverse('retention-policies-list'))})
+
+        data = {'days': 90}
+        context.update({'patch_retention_policies_detail': self.adapt_response('patch', policy_details_url, data)})
+
+        context.update({'delete_retention_policies_detail': self.adapt_response('delete', policy_details_url)})
+
         # Customers
         context.update({'get_customers_detail': self.adapt_response('get', customer_details_url)})
 
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import csv
+import json
+
+import six
+from rest_framework.utils.encoders import JSONEncoder
+
+from main.parsers import NDJSONParser
+
+
+class BaseExporter(object):
+    ''' Turns serialized rows into lines of an export file (to be streamed). '''
+    content_type = None
+    extension = None
+
+    def __init__(self, field_names):
+        self.field_names = field_names
+
+    def iter_lines(self, rows):
+        raise NotImplementedError
+
+
+class NDJSONExporter(BaseExporter):
+    content_type = NDJSONParser.media_type
+    extension = 'ndjson'
+
+    def iter_lines(self, rows):
+        encoder = JSONEncoder(ensure_ascii=False)
+        for row in rows:
+            yield encoder.encode(row) + '\n'
+
+
+class Echo(object):
+    ''' File-like object that just hands back what is written to it (so `csv.writer` output can be streamed). '''
+
+    def write(self, value):
+        return value
+
+
+class CSVExporter(BaseExporter):
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def encode(self, value):
+        if value is None:
+            value = ''
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+
+        value = six.text_type(value)
+        return value.encode('utf-8') if six.PY2 else value  # Python 2 `csv` module does not handle unicode.
+
+    def iter_lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow([self.encode(x) for x in self.field_names])
+
+        for row in rows:
+            yield writer.writerow([self.encode(row[x]) for x in self.field_names])
+
+
+EXPORTERS = {
+    'ndjson': NDJSONExporter,
+    'csv': CSVExporter,
+}
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+
+from django.db import connection
+
+from main.metadata import get_event_metadata_index, get_metadata_filters
+from main.search import get_event_search
+
+
+class EventSearchFilter(SearchFilter):
+    '''
+    `?search=` served by the events full-text index (see `main.search`) rather than `ILIKE` over `search_fields`.
+    Falls back to DRF's SearchFilter on databases with no full-text backend.
+    '''
+
+    def filter_queryset(self, request, queryset, view):
+        search = get_event_search(connection)
+        if not search:
+            return super(EventSearchFilter, self).filter_queryset(request, queryset, view)
+
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        return search.filter(queryset, terms)
+
+
+class EventMetadataFilter(BaseFilterBackend):
+    ''' `?metadata__<key>=<value>` and `?metadata__has_key=<key>` filters (see `main.metadata`). '''
+
+    def filter_queryset(self, request, queryset, view):
+        filters = get_metadata_filters(request.query_params)
+        if not filters:
+            return queryset
+
+        index = get_event_metadata_index(connection)
+        if not index:
+            raise ValidationError({'metadata': ['Metadata filters are not supported on this database.']})
+
+        return index.filter(queryset, filters)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import hashlib
+import json
+import time
+
+import six
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from django.conf import settings
+from django.core.cache import cache
+
+IDEMPOTENCY_KEY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_FIELD = 'idempotency_key'  # Per-item key, on bulk requests.
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyKeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this idempotency key is still being processed. Try again later.'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This idempotency key was already used with a different payload.'
+
+
+class IdempotencyKeysExhausted(APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_detail = 'Too many idempotency keys in use. Try again later, or send requests with no idempotency key.'
+
+
+def get_fingerprint(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def pop_idempotency_key(item):
+    ''' `(key, item without the key)` for a bulk item. '''
+    if not isinstance(item, dict) or IDEMPOTENCY_KEY_FIELD not in item:
+        return None, item
+
+    item = dict(item)
+    return item.pop(IDEMPOTENCY_KEY_FIELD), item
+
+
+class IdempotencyStore(object):
+    '''
+    Results of the requests sent with an idempotency key, remembered (per customer) for
+    EVENTS_IDEMPOTENCY_TTL_IN_SECONDS, so retries get the original result back instead of creating events again.
+
+    A key is claimed (atomically, with `cache.add`) before the request is processed: a concurrent retry finds it in
+    progress instead of going on. Claims expire after EVENTS_IDEMPOTENCY_PENDING_TTL_IN_SECONDS, should the request
+    die midway. The store is bounded: every customer may claim up to EVENTS_IDEMPOTENCY_MAX_KEYS keys per
+    EVENTS_IDEMPOTENCY_TTL_IN_SECONDS.
+    '''
+
+    def __init__(self, customer_id):
+        self.customer_id = customer_id
+
+    def get_cache_key(self, key):
+        return '{}:{}:{}'.format(settings.CACHE_PREFIX['IDEMPOTENCY'], self.customer_id, key)
+
+    def get_counter_cache_key(self):
+        window = int(time.time()) // settings.EVENTS_IDEMPOTENCY_TTL_IN_SECONDS
+        return '{}:{}:count:{}'.format(settings.CACHE_PREFIX['IDEMPOTENCY'], self.customer_id, window)
+
+    def validate_key(self, key):
+        # Keys of bulk items come from JSON bodies: they may be of any type.
+        if not isinstance(key, six.string_types) or not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValidationError({IDEMPOTENCY_KEY_FIELD: [
+                'Idempotency keys must have from 1 to {} characters.'.format(IDEMPOTENCY_KEY_MAX_LENGTH)
+            ]})
+
+    def count_claim(self):
+        counter_key = self.get_counter_cache_key()
+        cache.add(counter_key, 0, settings.EVENTS_IDEMPOTENCY_TTL_IN_SECONDS)
+        try:
+            return cache.incr(counter_key)
+        except ValueError:  # Expired meanwhile.
+            cache.set(counter_key, 1, settings.EVENTS_IDEMPOTENCY_TTL_IN_SECONDS)
+            return 1
+
+    def claim(self, key, data):
+        '''
+        Returns None if `key` was claimed now (go on processing the request, then `save` or `release` it) or the
+        result saved for it. Raises if it is still in progress or if it was used with some other `data`.
+        '''
+        self.validate_key(key)
+        cache_key = self.get_cache_key(key)
+        fingerprint = get_fingerprint(data)
+
+        entry = {'fingerprint': fingerprint, 'result': None}
+        if cache.add(cache_key, entry, settings.EVENTS_IDEMPOTENCY_PENDING_TTL_IN_SECONDS):
+            if self.count_claim() > settings.EVENTS_IDEMPOTENCY_MAX_KEYS:
+                cache.delete(cache_key)
+                raise IdempotencyKeysExhausted()
+            return None
+
+        entry = cache.get(cache_key)
+        if entry is None:  # Expired meanwhile.
+            return self.claim(key, data)
+        if entry['fingerprint'] != fingerprint:
+            raise IdempotencyKeyReused()
+        if entry['result'] is None:
+            raise IdempotencyKeyInProgress()
+        return entry['result']
+
+    def save(self, key, data, result):
+        entry = {'fingerprint': get_fingerprint(data), 'result': result}
+        cache.set(self.get_cache_key(key), entry, settings.EVENTS_IDEMPOTENCY_TTL_IN_SECONDS)
+
+    def release(self, *keys):
+        cache.delete_many([self.get_cache_key(x) for x in keys])
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.archives import EventArchiver
+from main.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Moves old events out of events table, into compressed per customer/month segments (see `main.archives`).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.EVENTS_ARCHIVE_AFTER_DAYS,
+            help='Events older than this number of days are archived.'
+        )
+        parser.add_argument(
+            '--customer', action='append', dest='customers', metavar='EMAIL',
+            help='Archives the events of this customer only (can be repeated).'
+        )
+        parser.add_argument(
+            '--segment-size', type=int, default=settings.EVENTS_ARCHIVE_SEGMENT_MAX_EVENTS,
+            help='Maximum number of events per segment.'
+        )
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.order_by('email')
+        if options['customers']:
+            customers = customers.filter(email__in=options['customers'])
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        archiver = EventArchiver(segment_size=options['segment_size'])
+        archived = 0
+
+        for segment, seconds in archiver.archive(cutoff, customers):
+            archived += segment.events_count
+            self.stdout.write('{} event(s) of {} archived into {} in {:.3f}s.'.format(
+                segment.events_count, segment.customer.email, segment.path, seconds
+            ))
+
+        self.stdout.write('{} event(s) archived.'.format(archived))
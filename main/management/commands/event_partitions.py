@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime
+
+import pytz
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.models import Event
+from main.partitions import EventPartitions, add_months
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates monthly partitions for events ahead of time (PostgreSQL 13+ only). '
+        'Use --convert once to turn events table into a partitioned one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=settings.EVENTS_PARTITIONS_MONTHS_AHEAD,
+            help='How many months (after the current one) must have partitions already.'
+        )
+        parser.add_argument(
+            '--convert', action='store_true', default=False,
+            help='Converts the regular events table into a partitioned one. Locks the table while it runs!'
+        )
+
+    def handle(self, *args, **options):
+        partitions = EventPartitions(connection)
+        if not partitions.is_supported():
+            raise CommandError('Partitioned events storage requires PostgreSQL 13+.')
+
+        if options['convert']:
+            if partitions.is_partitioned():
+                raise CommandError('Events table is partitioned already.')
+
+            with connection.schema_editor() as schema_editor:
+                partitions.convert(schema_editor, Event, options['months_ahead'])
+            self.stdout.write('Events table converted into a partitioned one.')
+
+        elif not partitions.is_partitioned():
+            raise CommandError('Events table is not partitioned. Run this command with --convert first.')
+
+        now = datetime.now(pytz.utc)
+        created = partitions.create_partitions(now, add_months(now, options['months_ahead']))
+        self.stdout.write('{} partition(s) created: {}'.format(len(created), ', '.join(created) or '-'))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.buffers import get_event_buffer
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Inserts the events accepted on write-behind mode (in batches, a single query per batch).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.EVENTS_BUFFER_FLUSH_BATCH_SIZE,
+            help='How many events are inserted per query.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help='Keeps running, polling the buffer every EVENTS_BUFFER_POLL_INTERVAL_IN_SECONDS seconds.'
+        )
+        parser.add_argument(
+            '--stats', action='store_true', default=False,
+            help='Only prints (as JSON) the buffer depth and the stats of the last flush.'
+        )
+        parser.add_argument(
+            '--requeue-dead-letters', action='store_true', default=False,
+            help='Only moves the events that failed to be inserted (dead letters) back to the buffer.'
+        )
+
+    def handle(self, *args, **options):
+        buffer = get_event_buffer()
+        if options['stats']:
+            self.stdout.write(json.dumps(buffer.get_stats(), sort_keys=True))
+            return
+        if options['requeue_dead_letters']:
+            self.stdout.write('{} event(s) requeued.'.format(buffer.requeue_dead_letters()))
+            return
+
+        while True:
+            try:
+                flushed = self.drain(buffer, options['batch_size'])
+            except Exception:
+                if not options['loop']:
+                    raise
+                logger.exception('[Events buffer] Flush failed')  # Retried on next poll.
+                flushed = 0
+
+            if flushed:
+                self.stdout.write('{} event(s) flushed.'.format(flushed))
+
+            if not options['loop']:
+                return
+            time.sleep(settings.EVENTS_BUFFER_POLL_INTERVAL_IN_SECONDS)
+
+    def drain(self, buffer, batch_size):
+        flushed = 0
+        while buffer.depth():
+            flushed += buffer.flush(batch_size)
+        return flushed
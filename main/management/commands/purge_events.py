@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.models import RetentionPolicy
+
+
+class Command(BaseCommand):
+    help = 'Deletes the events older than their retention policies allow (in small chunks, pausing between them).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.EVENTS_PURGE_CHUNK_SIZE,
+            help='How many events are deleted per transaction.'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=settings.EVENTS_PURGE_PAUSE_IN_SECONDS,
+            help='Seconds to wait between chunks.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help='Keeps running, purging every EVENTS_PURGE_INTERVAL_IN_SECONDS seconds.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            purged = self.purge(options['chunk_size'], options['pause'])
+            self.stdout.write('{} event(s) purged.'.format(purged))
+
+            if not options['loop']:
+                return
+            time.sleep(settings.EVENTS_PURGE_INTERVAL_IN_SECONDS)
+
+    def purge(self, chunk_size, pause):
+        now = timezone.now()
+        purged = 0
+
+        for policy in RetentionPolicy.objects.select_related('customer').order_by('customer', 'object_type'):
+            for deleted, seconds in policy.purge(chunk_size, pause_in_seconds=pause, now=now):
+                purged += deleted
+                self.stdout.write('{} event(s) of {} purged ({}) in {:.3f}s.'.format(
+                    deleted, policy.customer.email, policy, seconds
+                ))
+
+        return purged
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import Customer, EventRollup
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts events rollups from events table. '
+        'Run it after backfills or any write that skips the ORM (e.g. raw SQL, QuerySet.update()).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--customer', action='append', dest='customers', metavar='EMAIL',
+            help='Only rebuilds the rollups of this customer (may be given more than once).'
+        )
+
+    def handle(self, *args, **options):
+        customers = None
+        if options['customers']:
+            emails = set(x.lower() for x in options['customers'])
+            customers = list(Customer.objects.filter(email__in=emails))
+            missing = emails - set(x.email for x in customers)
+            if missing:
+                raise CommandError('Customer(s) not found: {}.'.format(', '.join(sorted(missing))))
+
+        created = EventRollup.objects.rebuild(customers=customers)
+        self.stdout.write('{} event rollup(s) rebuilt.'.format(created))
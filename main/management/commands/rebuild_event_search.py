@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.search import get_event_search
+
+
+class Command(BaseCommand):
+    help = (
+        'Reinstalls events full-text search triggers and reindexes all the events. '
+        'Run it after changing EVENTS_SEARCH_INCLUDE_METADATA.'
+    )
+
+    def handle(self, *args, **options):
+        search = get_event_search(connection)
+        if not search:
+            raise CommandError('There is no full-text search backend for "{}" databases.'.format(connection.vendor))
+
+        search.install_triggers()
+        search.rebuild()
+        self.stdout.write('Events search index rebuilt (metadata included: {}).'.format(search.include_metadata))
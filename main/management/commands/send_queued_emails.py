@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = 'Sends the emails waiting on the outbox (in batches, one backend connection per batch).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+            help='How many emails are sent through each backend connection.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help='Keeps running, polling the outbox every EMAIL_OUTBOX_POLL_INTERVAL_IN_SECONDS seconds.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.drain(options['batch_size'])
+            if sent or failed:
+                self.stdout.write('{} email(s) sent, {} failed.'.format(sent, failed))
+
+            if not options['loop']:
+                return
+            time.sleep(settings.EMAIL_OUTBOX_POLL_INTERVAL_IN_SECONDS)
+
+    def drain(self, batch_size):
+        sent, failed = 0, 0
+        while True:
+            emails = OutgoingEmail.objects.send_queued(batch_size=batch_size)
+            if not emails:
+                return sent, failed
+
+            for email in emails:
+                if email.status == OutgoingEmail.STATUS_SENT:
+                    sent += 1
+                else:
+                    failed += 1
@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
+from collections import Counter
+from datetime import timedelta
 import logging
 
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import BaseUserManager
 from django.core.cache import cache
+from django.core.mail import get_connection
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from main.conditional import bump_events_version
+from main.utils import chunked
 
 logger = logging.getLogger(__name__)
 
@@ -35,3 +47,260 @@ class CustomerManager(BaseUserManager):
             return
 
         return self.model.objects.filter(pk=user_pk).first()  # Possibly None.
+
+
+class EventQuerySet(models.QuerySet):
+    def bulk_create(self, objs, batch_size=None):
+        ''' Same as Django's, plus counting the new events on the rollups (no signals are sent for bulk inserts). '''
+        with transaction.atomic(using=self.db):
+            objs = super(EventQuerySet, self).bulk_create(objs, batch_size=batch_size)
+            apps.get_model('main', 'EventRollup').objects.add(objs)
+            bump_events_version(*set(x.customer_id for x in objs))
+        return objs
+
+    def delete(self):
+        '''
+        Same as Django's, plus counting the deleted events out of the rollups - counted by the database, so events are
+        deleted with a single query (no rows are loaded and no signals are sent per event).
+        '''
+        assert self.query.can_filter(), "Cannot use 'limit' or 'offset' with delete."
+        rollups = apps.get_model('main', 'EventRollup').objects
+
+        with transaction.atomic(using=self.db):
+            counts = rollups.get_queryset_counts(self)
+            deleted = self.delete_without_signals()
+            rollups.remove_counts(counts)
+
+        customer_ids = set(x[0] for x in counts)
+        if customer_ids:
+            bump_events_version(*customer_ids)
+
+        self._result_cache = None
+        return deleted, {self.model._meta.label: deleted}
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def delete_without_signals(self):
+        '''
+        Deletes the events with a single query and nothing else: rollups and events versions are left for the caller
+        to update (e.g. once per chunk, from counts it already has). Returns how many were deleted.
+        '''
+        assert self.query.can_filter(), "Cannot use 'limit' or 'offset' with delete."
+        return self._raw_delete(self.db)
+    delete_without_signals.alters_data = True
+    delete_without_signals.queryset_only = True
+
+
+class EventRollupManager(models.Manager):
+    '''
+    Rollups are changed by increments (`add`) and decrements (`remove`) - concurrent writers never overwrite each
+    other's counts. Writes that skip the ORM signals (e.g. `QuerySet.update()`, raw SQL) leave them stale: run
+    `rebuild_event_rollups` management command after those.
+    '''
+    rebuild_chunk_size = 1000
+
+    def get_periods(self, timestamp):
+        ''' {period: start of the UTC period `timestamp` belongs to}. '''
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp, timezone.get_default_timezone())
+
+        hour = timestamp.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return {self.model.PERIOD_HOUR: hour, self.model.PERIOD_DAY: hour.replace(hour=0)}
+
+    def get_counts(self, events):
+        ''' {(customer id, period, period start, object type): number of `events` on it}. '''
+        counts = Counter()
+        for event in events:
+            for period, period_start in self.get_periods(event.timestamp).items():
+                counts[(event.customer_id, period, period_start, event.object_type)] += 1
+        return counts
+
+    def get_queryset_counts(self, events):
+        ''' Same as `get_counts`, for a queryset of events - counted by the database, no events are loaded. '''
+        counts = Counter()
+        for period, _ in self.model.PERIOD_CHOICES:
+            rows = events.annotate(period_start=Trunc('timestamp', period, tzinfo=timezone.utc)).order_by()
+            rows = rows.values_list('customer_id', 'period_start', 'object_type').annotate(total=Count('id'))
+            for customer_id, period_start, object_type, total in rows:
+                counts[(customer_id, period, period_start, object_type)] += total
+        return counts
+
+    def execute_many(self, sql, field_names, rows):
+        ''' Runs `sql` once per row. Values are prepared for the database by the fields named on `field_names`. '''
+        connection = connections[self.db]
+        fields = [self.model._meta.get_field(x) for x in field_names]
+        sql = sql.format(
+            table=connection.ops.quote_name(self.model._meta.db_table),
+            columns=', '.join(connection.ops.quote_name(x.column) for x in fields),
+            placeholders=', '.join(['%s'] * len(fields)),
+        )
+        params = [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)] for row in rows]
+
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    def can_upsert(self):
+        ''' Whether the database takes `INSERT ... ON CONFLICT` (PostgreSQL 9.5+, SQLite 3.24+). '''
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            return connection.pg_version >= 90500
+        if connection.vendor == 'sqlite':
+            return connection.Database.sqlite_version_info >= (3, 24, 0)
+        return False
+
+    def add(self, events):
+        ''' Counts `events` in: one upsert per rollup, or an update (plus an insert, for new rollups) elsewhere. '''
+        counts = self.get_counts(events)
+        if not counts:
+            return
+
+        if self.can_upsert():
+            self.upsert_counts(counts)
+        else:
+            self.increment_counts(counts)
+
+    def upsert_counts(self, counts):
+        ''' Same as `add`, taking what `get_counts` returns - requires `can_upsert`. '''
+        now = timezone.now()
+        self.execute_many(
+            'INSERT INTO {table} ({columns}) VALUES ({placeholders}) '
+            'ON CONFLICT (customer_id, period, period_start, object_type) '
+            'DO UPDATE SET total = {table}.total + excluded.total, modified = excluded.modified',
+            ('id', 'created', 'modified', 'customer', 'period', 'period_start', 'object_type', 'total'),
+            [
+                (self.model._meta.pk.get_default(), now, now) + key + (total, )
+                for key, total in counts.items()
+            ]
+        )
+
+    def increment_counts(self, counts):
+        '''
+        Same as `upsert_counts`, on any database: rollups are incremented, and the ones missing are created. A rollup
+        created meanwhile by a concurrent writer makes the insert fail (on its own savepoint), and is incremented then.
+        '''
+        now = timezone.now()
+        for (customer_id, period, period_start, object_type), total in counts.items():
+            rollups = self.filter(
+                customer_id=customer_id, period=period, period_start=period_start, object_type=object_type
+            )
+            if rollups.update(total=F('total') + total, modified=now):
+                continue
+
+            rollup = self.model(
+                customer_id=customer_id, period=period, period_start=period_start, object_type=object_type, total=total
+            )
+            rollup.mark_clean()  # The unique constraint is what tells concurrent writers apart.
+            try:
+                with transaction.atomic(using=self.db):
+                    rollup.save(force_insert=True, using=self.db)
+            except IntegrityError:
+                rollups.update(total=F('total') + total, modified=now)
+
+    def remove(self, events):
+        ''' Counts `events` out. Rollups dropping to zero are deleted. '''
+        self.remove_counts(self.get_counts(events))
+
+    def remove_counts(self, counts):
+        ''' Same as `remove`, taking what `get_counts` returns (so it can be summed up while events are streamed). '''
+        if not counts:
+            return
+
+        now = timezone.now()
+        self.execute_many(
+            'UPDATE {table} SET total = total - %s, modified = %s '
+            'WHERE customer_id = %s AND period = %s AND period_start = %s AND object_type = %s',
+            ('total', 'modified', 'customer', 'period', 'period_start', 'object_type'),
+            [(total, now) + key for key, total in counts.items()]
+        )
+        self.filter(customer_id__in=set(x[0] for x in counts), total__lte=0).delete()
+
+    def rebuild(self, customers=None):
+        ''' Recounts the rollups (of every customer, or of `customers` only) from events table. Returns how many. '''
+        events = apps.get_model('main', 'Event').objects.all()
+        rollups = self.all()
+        if customers is not None:
+            events = events.filter(customer__in=customers)
+            rollups = rollups.filter(customer__in=customers)
+
+        created = 0
+        with transaction.atomic(using=self.db):
+            rollups.delete()
+
+            for period, _ in self.model.PERIOD_CHOICES:
+                counts = events.annotate(period_start=Trunc('timestamp', period, tzinfo=timezone.utc)).order_by()
+                counts = counts.values_list('customer_id', 'period_start', 'object_type').annotate(total=Count('id'))
+
+                for chunk in chunked(counts.iterator(), self.rebuild_chunk_size):
+                    self.bulk_create([
+                        self.model(
+                            customer_id=customer_id, period=period, period_start=period_start,
+                            object_type=object_type, total=total,
+                        )
+                        for customer_id, period_start, object_type, total in chunk
+                    ])
+                    created += len(chunk)
+
+        return created
+
+
+class OutgoingEmailManager(models.Manager):
+    def enqueue(self, subject, body_txt, to, body_html='', from_email=None):
+        return self.create(
+            subject=subject, body_txt=body_txt, body_html=body_html, to=to,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        )
+
+    def claim_pending(self, batch_size):
+        '''
+        Marks up to `batch_size` due emails as being sent (by this worker only) and returns them.
+        A claim is a lease: emails still being sent EMAIL_OUTBOX_CLAIM_TIMEOUT_IN_SECONDS after being claimed are
+        taken as abandoned (their worker crashed or was restarted) and get claimed again - so they may be sent twice,
+        but never stay stuck.
+        '''
+        now = timezone.now()
+        expired_at = now - timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT_IN_SECONDS)
+        due = (
+            Q(status=self.model.STATUS_PENDING, send_after__lte=now) |
+            Q(status=self.model.STATUS_SENDING, claimed_at__lt=expired_at) |
+            Q(status=self.model.STATUS_SENDING, claimed_at__isnull=True)  # Claimed before leases existed.
+        )
+        ids = self.filter(due).order_by('send_after').values_list('id', flat=True)[:batch_size]
+
+        claimed = [x for x in ids if self.filter(due, id=x).update(status=self.model.STATUS_SENDING, claimed_at=now)]
+        return list(self.filter(id__in=claimed))
+
+    def send_queued(self, batch_size=None):
+        '''
+        Sends a batch of due emails through a single backend connection.
+        Failures are retried later (with exponential backoff) up to EMAIL_OUTBOX_MAX_ATTEMPTS times.
+        Returns the emails of the batch (with their new status).
+        '''
+        emails = self.claim_pending(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+        if not emails:
+            return emails
+
+        connection = get_connection()
+        connection.open()
+
+        try:
+            for email in emails:
+                email.attempts += 1
+                try:
+                    email.to_message(connection=connection).send()
+                except Exception as e:
+                    logger.exception('[Outbox] Failed to send email "{}"'.format(email.pk))
+                    email.last_error = '{}'.format(e)
+                    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                        email.status = self.model.STATUS_FAILED
+                    else:
+                        email.status = self.model.STATUS_PENDING
+                        delay = settings.EMAIL_OUTBOX_RETRY_DELAY_IN_SECONDS * 2 ** (email.attempts - 1)
+                        email.send_after = timezone.now() + timedelta(seconds=delay)
+                else:
+                    email.status = self.model.STATUS_SENT
+
+                email.save()
+        finally:
+            connection.close()
+
+        return emails
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import json
+import re
+
+import six
+from rest_framework.exceptions import ValidationError
+
+from main.search import EVENT_TABLE
+
+METADATA_FILTER_PREFIX = 'metadata__'
+HAS_KEY_LOOKUP = 'has_key'
+METADATA_KEY_RE = re.compile(r'^[\w.-]+$', re.UNICODE)
+
+
+def parse_metadata_value(value):
+    '''
+    Values that could be meant as a JSON number/boolean/null (`3`, `true`, `null`) are matched both that way and as
+    a string - query strings carry no types.
+    '''
+    values = [value]
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return values
+
+    if not isinstance(parsed, (six.string_types, dict, list)):
+        values.append(parsed)
+    return values
+
+
+def validate_metadata_keys(keys):
+    # Keys end up on JSON paths (see `SQLiteEventMetadataIndex.get_json_path`): only plain ones are accepted.
+    for key in keys:
+        if not METADATA_KEY_RE.match(key):
+            raise ValidationError({'metadata': [
+                'Invalid key: "{}". Keys may hold letters, digits, "_", "." and "-" only.'.format(key)
+            ]})
+    return keys
+
+
+def get_metadata_filters(query_params):
+    '''
+    Metadata filters on querystring, as {'exact': [(path, values)], 'has_key': [keys]} (or `{}` if there are none).
+    `?metadata__order__status=paid` matches events whose metadata is like `{"order": {"status": "paid"}}`,
+    `?metadata__has_key=order` the ones holding an `order` key (on the top level). Raises `ValidationError` on
+    invalid keys.
+    '''
+    filters = {}
+    for name in sorted(query_params):
+        if not name.startswith(METADATA_FILTER_PREFIX) or len(name) == len(METADATA_FILTER_PREFIX):
+            continue
+
+        path = tuple(name[len(METADATA_FILTER_PREFIX):].split('__'))
+        if path == (HAS_KEY_LOOKUP, ):
+            filters.setdefault(HAS_KEY_LOOKUP, []).extend(validate_metadata_keys(query_params.getlist(name)))
+        else:
+            validate_metadata_keys(path)
+            filters.setdefault('exact', []).extend((path, parse_metadata_value(x)) for x in query_params.getlist(name))
+
+    return filters
+
+
+def is_same_value(a, b):
+    # `True == 1` for Python, not for JSON.
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+def matches_metadata(metadata, filters):
+    ''' Whether `metadata` (already decoded) matches `filters` (see `get_metadata_filters`) - done in Python. '''
+    for key in filters.get(HAS_KEY_LOOKUP, []):
+        if not isinstance(metadata, dict) or key not in metadata:
+            return False
+
+    for path, values in filters.get('exact', []):
+        value = metadata
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                return False
+            value = value[key]
+
+        if not any(is_same_value(value, x) for x in values):
+            return False
+
+    return True
+
+
+class BaseEventMetadataIndex(object):
+    '''
+    Filtering of events by metadata on the database. `install`/`uninstall` are meant to be run from migrations.
+    '''
+    column = 'metadata'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def fetchall(self, sql, params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def get_column_sql(self):
+        return '{}.{}'.format(EVENT_TABLE, self.connection.ops.quote_name(self.column))
+
+    def install(self):
+        pass
+
+    def uninstall(self):
+        pass
+
+    def get_exact_sql(self, path, values):
+        ''' (SQL condition, params) for metadata at `path` being any of `values`. '''
+        raise NotImplementedError
+
+    def get_has_key_sql(self, key):
+        raise NotImplementedError
+
+    def filter(self, queryset, filters):
+        where, params = [], []
+        conditions = [self.get_has_key_sql(x) for x in filters.get(HAS_KEY_LOOKUP, [])]
+        conditions += [self.get_exact_sql(path, values) for path, values in filters.get('exact', [])]
+
+        for sql, sql_params in conditions:
+            where.append(sql)
+            params.extend(sql_params)
+
+        if not where:
+            return queryset
+        return queryset.extra(where=where, params=params)
+
+
+class PostgresEventMetadataIndex(BaseEventMetadataIndex):
+    '''
+    Metadata on a `jsonb` column with a GIN index over it: both containment (`@>`, used by exact filters - nested
+    keys included) and key existence (`?`) are answered by the index.
+    '''
+    index_name = '{}_metadata'.format(EVENT_TABLE)
+
+    def get_column_type(self):
+        rows = self.fetchall(
+            'SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s',
+            [EVENT_TABLE, self.column]
+        )
+        return rows[0][0]
+
+    def convert_column(self):
+        '''
+        Databases created before PostgreSQL 9.4 (or before `jsonfield` used `jsonb`) have got a text (or `json`)
+        column. Converting it rewrites events table - do it on a maintenance window.
+        '''
+        if self.get_column_type() == 'jsonb':
+            return
+        # `json` has no `=` operator: cast to text first.
+        self.execute('ALTER TABLE {0} ALTER COLUMN {1} TYPE jsonb USING NULLIF({1}::text, \'\')::jsonb'.format(
+            EVENT_TABLE, self.column
+        ))
+
+    def install(self):
+        from main.partitions import EventPartitions
+
+        self.convert_column()
+
+        # PostgreSQL can't build an index concurrently on a partitioned table (see `main.partitions`): there, it is
+        # built on the parent (so on every partition) blocking writes meanwhile.
+        self.execute(self.get_create_index_sql(concurrently=not EventPartitions(self.connection).is_partitioned()))
+
+    def uninstall(self):
+        self.execute('DROP INDEX IF EXISTS {}'.format(self.index_name))
+
+    def get_create_index_sql(self, concurrently=False):
+        return 'CREATE INDEX {}IF NOT EXISTS {} ON {} USING GIN ({})'.format(
+            'CONCURRENTLY ' if concurrently else '', self.index_name, EVENT_TABLE, self.column
+        )
+
+    def get_exact_sql(self, path, values):
+        documents = []
+        for value in values:
+            for key in reversed(path):
+                value = {key: value}
+            documents.append(json.dumps(value))
+
+        sql = ' OR '.join('{} @> %s::jsonb'.format(self.get_column_sql()) for x in documents)
+        return '({})'.format(sql), documents
+
+    def get_has_key_sql(self, key):
+        return '{} ? %s'.format(self.get_column_sql()), [key]
+
+
+class SQLiteEventMetadataIndex(BaseEventMetadataIndex):
+    '''
+    JSON1 functions over the text column, for local/test runs. SQLite can't index arbitrary keys - these filters
+    scan customer's events.
+    '''
+    def get_json_path(self, path):
+        return '$' + ''.join('."{}"'.format(x) for x in path)
+
+    def get_exact_sql(self, path, values):
+        column, json_path = self.get_column_sql(), self.get_json_path(path)
+        conditions, params = [], []
+
+        for value in values:
+            if value is True or value is False:  # `true`/`false` are JSON types of their own.
+                conditions.append('json_type({}, %s) = %s'.format(column))
+                params.extend([json_path, 'true' if value else 'false'])
+            elif value is None:
+                conditions.append("json_type({}, %s) = 'null'".format(column))
+                params.append(json_path)
+            elif isinstance(value, six.string_types):
+                conditions.append("(json_type({0}, %s) = 'text' AND json_extract({0}, %s) = %s)".format(column))
+                params.extend([json_path, json_path, value])
+            else:
+                conditions.append("(json_type({0}, %s) IN ('integer', 'real') AND json_extract({0}, %s) = %s)".format(
+                    column
+                ))
+                params.extend([json_path, json_path, value])
+
+        return '({})'.format(' OR '.join(conditions)), params
+
+    def get_has_key_sql(self, key):
+        return 'json_type({}, %s) IS NOT NULL'.format(self.get_column_sql()), [self.get_json_path([key])]
+
+
+EVENT_METADATA_INDEX_BACKENDS = {
+    'postgresql': PostgresEventMetadataIndex,
+    'sqlite': SQLiteEventMetadataIndex,
+}
+
+
+def get_event_metadata_index(connection):
+    backend = EVENT_METADATA_INDEX_BACKENDS.get(connection.vendor)
+    if not backend:
+        return None
+    return backend(connection)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import main.operations
+
+
+class Migration(migrations.Migration):
+    atomic = False  # Indexes are built concurrently on PostgreSQL.
+
+    dependencies = [
+        ('main', '0008_event_ordering'),
+    ]
+
+    operations = [
+        main.operations.AlterIndexesConcurrently([
+            migrations.AlterIndexTogether(
+                name='event',
+                index_together=set([
+                    ('customer', 'timestamp'),
+                    ('customer', 'object_type', 'object_id', 'timestamp'),
+                    ('customer', 'human_identifier', 'timestamp'),
+                ]),
+            ),
+            migrations.AlterField(
+                model_name='event',
+                name='customer',
+                field=models.ForeignKey(
+                    db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='events',
+                    to='main.Customer'
+                ),
+            ),
+            migrations.AlterField(
+                model_name='event',
+                name='human_identifier',
+                field=models.CharField(max_length=255),
+            ),
+            migrations.AlterField(
+                model_name='event',
+                name='object_id',
+                field=models.CharField(max_length=255),
+            ),
+            migrations.AlterField(
+                model_name='event',
+                name='object_type',
+                field=models.CharField(max_length=255),
+            ),
+            migrations.AlterField(
+                model_name='event',
+                name='timestamp',
+                field=models.DateTimeField(),
+            ),
+        ]),
+    ]
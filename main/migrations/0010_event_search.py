@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from main.search import get_event_search
+
+
+def install(apps, schema_editor):
+    search = get_event_search(schema_editor.connection)
+    if search:
+        search.install()
+
+
+def uninstall(apps, schema_editor):
+    search = get_event_search(schema_editor.connection)
+    if search:
+        search.uninstall()
+
+
+class Migration(migrations.Migration):
+    atomic = False  # GIN index is built concurrently on PostgreSQL.
+
+    dependencies = [
+        ('main', '0009_event_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 07:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import django_extensions.db.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_event_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('to', models.EmailField(max_length=254)),
+                ('from_email', models.CharField(max_length=255)),
+                ('subject', models.TextField()),
+                ('body_txt', models.TextField()),
+                ('body_html', models.TextField(blank=True)),
+                ('status', models.CharField(
+                    choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')],
+                    default='pending', max_length=15
+                )),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('send_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outgoingemail',
+            index_together=set([('status', 'send_after')]),
+        ),
+    ]
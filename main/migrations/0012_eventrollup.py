@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 07:44
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.utils import timezone
+import django.db.models.deletion
+import django_extensions.db.fields
+import uuid
+
+from main.utils import chunked
+
+
+def count_events(apps, schema_editor):
+    ''' Rollups for the events that already exist (`rebuild_event_rollups` does the same, with current models). '''
+    Event = apps.get_model('main', 'Event')
+    EventRollup = apps.get_model('main', 'EventRollup')
+    db = schema_editor.connection.alias
+
+    for period in ('hour', 'day'):
+        counts = Event.objects.using(db).annotate(period_start=Trunc('timestamp', period, tzinfo=timezone.utc))
+        counts = counts.order_by().values_list('customer_id', 'period_start', 'object_type').annotate(total=Count('id'))
+
+        for chunk in chunked(counts.iterator(), 1000):
+            EventRollup.objects.using(db).bulk_create([
+                EventRollup(
+                    customer_id=customer_id, period=period, period_start=period_start, object_type=object_type,
+                    total=total,
+                )
+                for customer_id, period_start, object_type, total in chunk
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventRollup',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('object_type', models.CharField(max_length=255)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=15)),
+                ('period_start', models.DateTimeField()),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('period_start',),
+            },
+        ),
+        migrations.AddField(
+            model_name='eventrollup',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='event_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventrollup',
+            unique_together=set([('customer', 'period', 'period_start', 'object_type')]),
+        ),
+        migrations.RunPython(count_events, migrations.RunPython.noop),
+    ]
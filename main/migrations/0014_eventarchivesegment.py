@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 08:10
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_retentionpolicy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventArchiveSegment',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('start_timestamp', models.DateTimeField()),
+                ('end_timestamp', models.DateTimeField()),
+                ('events_count', models.PositiveIntegerField()),
+                ('path', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+            ],
+            options={
+                'ordering': ('-end_timestamp',),
+            },
+        ),
+        migrations.AddField(
+            model_name='eventarchivesegment',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterIndexTogether(
+            name='eventarchivesegment',
+            index_together=set([('customer', 'end_timestamp')]),
+        ),
+    ]
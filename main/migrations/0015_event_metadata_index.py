@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from main.metadata import get_event_metadata_index
+
+
+def install(apps, schema_editor):
+    index = get_event_metadata_index(schema_editor.connection)
+    if index:
+        index.install()
+
+
+def uninstall(apps, schema_editor):
+    index = get_event_metadata_index(schema_editor.connection)
+    if index:
+        index.uninstall()
+
+
+class Migration(migrations.Migration):
+    atomic = False  # GIN index is built concurrently on PostgreSQL.
+
+    dependencies = [
+        ('main', '0014_eventarchivesegment'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
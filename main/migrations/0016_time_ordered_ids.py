@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 08:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import main.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_event_metadata_index'),
+    ]
+
+    # Defaults are set on Python side only: there is nothing to change on the database.
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='customer',
+                name='id',
+                field=models.UUIDField(default=main.utils.generate_id, editable=False, primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name='event',
+                name='id',
+                field=models.UUIDField(default=main.utils.generate_id, editable=False, primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name='eventarchivesegment',
+                name='id',
+                field=models.UUIDField(default=main.utils.generate_id, editable=False, primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name='eventrollup',
+                name='id',
+                field=models.UUIDField(default=main.utils.generate_id, editable=False, primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name='outgoingemail',
+                name='id',
+                field=models.UUIDField(default=main.utils.generate_id, editable=False, primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name='retentionpolicy',
+                name='id',
+                field=models.UUIDField(default=main.utils.generate_id, editable=False, primary_key=True, serialize=False),
+            ),
+        ]),
+    ]
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
+from datetime import timedelta
 import logging
 import random
 import six.moves.urllib.parse
-import uuid
+import time
 
 from django_extensions.db.models import TimeStampedModel
 import jsonfield
@@ -14,25 +15,90 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.contrib.auth.tokens import default_token_generator
 from django.core.cache import cache
-from django.db import models
-from django.db.models.signals import post_save, pre_save
+from django.core.files.storage import get_storage_class
+from django.core.mail import EmailMultiAlternatives
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 
-from main.managers import CustomerManager
-from main.utils import send_email_plus
+from main.authentication import invalidate_cached_tokens
+from main.conditional import bump_events_version
+from main.managers import CustomerManager, EventQuerySet, EventRollupManager, OutgoingEmailManager
+from main.pagination import filter_after_position
+from main.utils import generate_id, send_email_plus
 
 logger = logging.getLogger(__name__)
 TIMEZONE_CHOICES = [[x, x] for x in pytz.common_timezones]
 
 
 class ModelBase(TimeStampedModel, models.Model):
-    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    id = models.UUIDField(primary_key=True, editable=False, default=generate_id)
 
     class Meta:
         abstract = True
         ordering = ('-created', )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ModelBase, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # Only what is reloaded gets a new snapshot - e.g. loading a deferred field must not take unsaved changes of
+        # other fields as the loaded values.
+        if fields is None:
+            deferred = self.get_deferred_fields()
+            refreshed = [x.attname for x in self._meta.concrete_fields if x.attname not in deferred]
+        else:
+            refreshed = [self._meta.get_field(x).attname for x in fields]
+
+        super(ModelBase, self).refresh_from_db(using=using, fields=fields, **kwargs)
+        self._loaded_values = dict(getattr(self, '_loaded_values', {}))
+        self._loaded_values.update((x, getattr(self, x)) for x in refreshed)
+
+    def save(self, *args, **kwargs):
+        result = super(ModelBase, self).save(*args, **kwargs)
+        self._take_snapshot()
+        return result
+
+    def _take_snapshot(self):
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            x.attname: getattr(self, x.attname) for x in self._meta.concrete_fields if x.attname not in deferred
+        }
+
+    def get_loaded_value(self, field_name):
+        ''' Value of `field_name` as it was loaded from (or last saved to) the database. None for new instances. '''
+        return getattr(self, '_loaded_values', {}).get(self._meta.get_field(field_name).attname)
+
+    def has_changed(self, field_name):
+        '''
+        Whether `field_name` differs from what was loaded from (or last saved to) the database - no queries involved.
+        Every field of a new instance counts as changed. Note that in-place changes on mutable values (e.g. a dict
+        on a JSONField) are not noticed - assign a new value instead.
+        '''
+        if self._state.adding:
+            return True
+
+        attname = self._meta.get_field(field_name).attname
+        loaded_values = getattr(self, '_loaded_values', {})
+        if attname not in loaded_values:
+            return attname not in self.get_deferred_fields()  # Deferred and never touched: unchanged.
+
+        return getattr(self, attname) != loaded_values[attname]
+
+    @property
+    def changed_fields(self):
+        return [x.name for x in self._meta.concrete_fields if self.has_changed(x.name)]
+
+    def mark_clean(self):
+        ''' Flags the instance as validated already (e.g. by a serializer): its next save skips `full_clean`. '''
+        self._is_clean = True
+
     def get_old_instance(self):
         qs = getattr(self.__class__.objects, 'all_with_deleted', self.__class__.objects.all)()
         instance = qs.filter(id=self.id).first()
@@ -116,34 +182,264 @@ class Customer(ModelBase, AbstractBaseUser, PermissionsMixin):
         return super(Customer, self).clean()
 
     def save(self, *args, **kwargs):
-        old_instance = self.get_old_instance()
-
-        if old_instance.email != self.email:
+        email_changed, just_joined = self.has_changed('email'), self._state.adding
+        if email_changed:
             self.email_verified = False
-            self.send_activation_link_by_email(just_joined=not(old_instance.exists))
 
-        return super(Customer, self).save(*args, **kwargs)
+        # Activation email is queued along with the customer: it's not sent if saving fails (or is rolled back).
+        with transaction.atomic():
+            result = super(Customer, self).save(*args, **kwargs)
+            if email_changed:
+                self.send_activation_link_by_email(just_joined=just_joined)
+        return result
 
 
 @python_2_unicode_compatible
 class Event(ModelBase):
-    customer = models.ForeignKey(Customer, related_name='events')
+    # Events are always queried by customer, so indexes are composite ones (see Meta.index_together).
+    customer = models.ForeignKey(Customer, related_name='events', db_index=False)
 
-    object_id = models.CharField(max_length=255, db_index=True)
-    object_type = models.CharField(max_length=255, db_index=True)
-    human_identifier = models.CharField(max_length=255, db_index=True)
+    object_id = models.CharField(max_length=255)
+    object_type = models.CharField(max_length=255)
+    human_identifier = models.CharField(max_length=255)
 
-    timestamp = models.DateTimeField(db_index=True)
+    timestamp = models.DateTimeField()
     message = models.CharField(max_length=255, db_index=True)
 
     metadata = jsonfield.JSONField(blank=True, null=True)
 
+    objects = EventQuerySet.as_manager()
+
     class Meta(object):
-        ordering = ('-timestamp',)
+        ordering = ('-timestamp', '-id')
+        index_together = (
+            ('customer', 'timestamp'),
+            ('customer', 'object_type', 'object_id', 'timestamp'),
+            ('customer', 'human_identifier', 'timestamp'),
+        )
 
     def __str__(self):
         return '{}/{} at {}: {}'.format(self.object_type, self.object_id, self.timestamp, self.message)
 
+    def delete(self, *args, **kwargs):
+        # Rollups are updated here rather than on `post_delete`: a receiver would disable Django's fast delete for
+        # every events queryset (and customer cascade). See `EventQuerySet.delete` for the bulk counterpart.
+        with transaction.atomic():
+            EventRollup.objects.remove([self])
+            result = super(Event, self).delete(*args, **kwargs)
+        bump_events_version(self.customer_id)
+        return result
+
+
+@python_2_unicode_compatible
+class EventRollup(ModelBase):
+    '''
+    Count of events per customer, object type and UTC hour/day - kept up to date as events are written (see
+    `EventRollupManager`), so histograms don't need to scan events table.
+    '''
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIOD_CHOICES = (
+        (PERIOD_HOUR, 'Hour'),
+        (PERIOD_DAY, 'Day'),
+    )
+
+    customer = models.ForeignKey(Customer, related_name='event_rollups', db_index=False)  # Unique index covers it.
+    object_type = models.CharField(max_length=255)
+    period = models.CharField(max_length=15, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    total = models.IntegerField(default=0)
+
+    objects = EventRollupManager()
+
+    class Meta(object):
+        ordering = ('period_start', )
+        unique_together = (
+            ('customer', 'period', 'period_start', 'object_type'),
+        )
+
+    def __str__(self):
+        return '{} events of type {} on {} starting at {}'.format(
+            self.total, self.object_type, self.period, self.period_start
+        )
+
+
+@python_2_unicode_compatible
+class RetentionPolicy(ModelBase):
+    '''
+    Events older than `days` are purged (see `purge_events` management command).
+    A policy with no `object_type` is the customer's default one: it covers every object type with no policy of its own.
+    '''
+    customer = models.ForeignKey(Customer, related_name='retention_policies', db_index=False)  # Unique index covers it.
+    object_type = models.CharField(max_length=255, blank=True)
+    days = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+
+    class Meta(object):
+        ordering = ('object_type', )
+        unique_together = (
+            ('customer', 'object_type'),
+        )
+
+    def __str__(self):
+        return '{}: {} days'.format(self.object_type or 'Default', self.days)
+
+    def get_expired_events(self, now=None):
+        events = Event.objects.filter(
+            customer_id=self.customer_id, timestamp__lt=(now or timezone.now()) - timedelta(days=self.days)
+        )
+        if self.object_type:
+            return events.filter(object_type=self.object_type)
+
+        other_object_types = RetentionPolicy.objects.filter(customer_id=self.customer_id).exclude(object_type='')
+        return events.exclude(object_type__in=list(other_object_types.values_list('object_type', flat=True)))
+
+    def purge(self, chunk_size, pause_in_seconds=0, now=None):
+        '''
+        Deletes the expired events in chunks, each one on a short transaction of its own and followed by a pause - so
+        the purge never holds locks for long. Yields (events deleted, seconds) per chunk.
+        Chunks are paged on (timestamp, id), oldest first: each one starts where the previous ended on customer's
+        timestamp index, so the time per chunk does not grow with the backlog.
+        '''
+        expired = self.get_expired_events(now).order_by('timestamp', 'id')
+        expired = expired.only('id', 'customer', 'object_type', 'timestamp')
+        position = None
+
+        while True:
+            started_at = time.time()
+            chunk = expired if position is None else filter_after_position(expired, *position, reverse=True)
+            events = list(chunk[:chunk_size])
+            if not events:
+                return
+
+            with transaction.atomic():
+                # No signals for every single event: rollups and versions are updated once per chunk.
+                deleted = Event.objects.filter(id__in=[x.id for x in events]).delete_without_signals()
+                EventRollup.objects.remove(events)
+            bump_events_version(self.customer_id)
+
+            yield deleted, time.time() - started_at
+
+            if len(events) < chunk_size:
+                return
+            position = (events[-1].timestamp, events[-1].id)
+            time.sleep(pause_in_seconds)
+
+
+@python_2_unicode_compatible
+class EventArchiveSegment(ModelBase):
+    '''
+    Index of a compressed file holding archived events of a customer (see `main.archives` and `archive_events`
+    management command). `start_timestamp`/`end_timestamp` are the oldest/newest event timestamps in the file, so
+    reading a time range back only opens the files overlapping it.
+    '''
+    customer = models.ForeignKey(Customer, related_name='archive_segments', db_index=False)  # Index below covers it.
+    start_timestamp = models.DateTimeField()
+    end_timestamp = models.DateTimeField()
+    events_count = models.PositiveIntegerField()
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+
+    class Meta(object):
+        ordering = ('-end_timestamp', )
+        index_together = (
+            ('customer', 'end_timestamp'),
+        )
+
+    def __str__(self):
+        return '{} ({} events from {} to {})'.format(
+            self.path, self.events_count, self.start_timestamp.isoformat(), self.end_timestamp.isoformat()
+        )
+
+    @staticmethod
+    def get_storage():
+        return get_storage_class(settings.EVENTS_ARCHIVE_STORAGE)(**settings.EVENTS_ARCHIVE_STORAGE_OPTIONS)
+
+
+@python_2_unicode_compatible
+class OutgoingEmail(ModelBase):
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    to = models.EmailField()
+    from_email = models.CharField(max_length=255)
+    subject = models.TextField()
+    body_txt = models.TextField()
+    body_html = models.TextField(blank=True)
+
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)  # When a worker took it for sending, last time.
+    last_error = models.TextField(blank=True)
+
+    objects = OutgoingEmailManager()
+
+    class Meta(object):
+        ordering = ('created', )
+        index_together = (
+            ('status', 'send_after'),
+        )
+
+    def __str__(self):
+        return '{} to {} ({})'.format(self.subject, self.to, self.status)
+
+    def to_message(self, connection=None):
+        message = EmailMultiAlternatives(
+            self.subject, self.body_txt, self.from_email, [self.to, ], connection=connection
+        )
+        if self.body_html:
+            message.attach_alternative(self.body_html, 'text/html')
+        return message
+
+
+EVENT_COUNTED_FIELDS = ('customer_id', 'object_type', 'timestamp')  # The ones rollups depend on.
+
+
+@receiver(pre_save, sender=Event)
+def event_pre_save(sender, instance=None, **kwargs):
+    ''' Keeps the counted values the event has on the database, for `event_post_save` to count it out of rollups. '''
+    instance._old_counted_values = None
+    if instance._state.adding or not any(instance.has_changed(x) for x in EVENT_COUNTED_FIELDS):
+        return
+
+    old_values = {x: instance.get_loaded_value(x) for x in EVENT_COUNTED_FIELDS}
+    if None in old_values.values():
+        # Deferred or never loaded: read them before the update overwrites them.
+        old_values = Event.objects.filter(pk=instance.pk).values(*EVENT_COUNTED_FIELDS).first()
+    instance._old_counted_values = old_values
+
+
+@receiver(post_save, sender=Event)
+def event_post_save(sender, instance=None, created=False, **kwargs):
+    old_values = getattr(instance, '_old_counted_values', None)
+    bump_events_version(instance.customer_id)
+
+    if created:
+        EventRollup.objects.add([instance])
+        return
+
+    # No old values: either nothing counted has changed or they are unknown (the event was not on the database) - in
+    # which case counting the event in only would count it twice.
+    if old_values is None or old_values == {x: getattr(instance, x) for x in EVENT_COUNTED_FIELDS}:
+        return
+
+    EventRollup.objects.remove([Event(**old_values)])
+    bump_events_version(old_values['customer_id'])
+    EventRollup.objects.add([instance])
+
+
+@receiver(post_delete, sender=EventArchiveSegment)
+def event_archive_segment_post_delete(sender, instance=None, **kwargs):
+    EventArchiveSegment.get_storage().delete(instance.path)
+
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def customer_post_save(sender, instance=None, created=False, **kwargs):
@@ -151,11 +447,21 @@ def customer_post_save(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_post_change(sender, instance=None, **kwargs):
+    invalidate_cached_tokens(instance.key)
+
+
 @receiver(pre_save)
 def regular_pre_save(instance, *args, **kwargs):
     app = instance.__class__.__module__.split('.')[0]
     if app not in settings.INTERNAL_APPS:
         return  # Don't mess with someone else's sanity.
 
+    if getattr(instance, '_is_clean', False):
+        instance._is_clean = False  # Trusted for a single save only.
+        return
+
     exclude = getattr(instance, 'FIELDS_TO_EXCLUDE_ON_FULL_CLEAN', [])
     instance.full_clean(exclude=exclude)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.db.migrations.operations.base import Operation
+
+
+def get_model_indexes(model):
+    ''' Returns {columns: fields} for every non-unique index Django would create for `model`. '''
+    indexes = {}
+
+    for field in model._meta.local_fields:
+        if field.db_index and not field.unique:
+            indexes[(field.column, )] = [field]
+
+    for field_names in model._meta.index_together:
+        fields = [model._meta.get_field(x) for x in field_names]
+        indexes[tuple(x.column for x in fields)] = fields
+
+    return indexes
+
+
+class AlterIndexesConcurrently(Operation):
+    '''
+    Migration operation wrapping index-only operations (`AlterIndexTogether` and `AlterField`s toggling `db_index`).
+    On PostgreSQL the indexes are created/dropped CONCURRENTLY, so the table is not locked against writes while
+    they are built. Other databases simply run the wrapped operations.
+    Migrations using it must be flagged with `atomic = False` (PostgreSQL refuses to do this inside a transaction).
+    '''
+    reversible = True
+    reduces_to_sql = False
+
+    def __init__(self, operations):
+        self.operations = operations
+
+    def deconstruct(self):
+        return (self.__class__.__name__, [self.operations], {})
+
+    def describe(self):
+        return 'Concurrently: {}'.format('; '.join(x.describe() for x in self.operations))
+
+    def state_forwards(self, app_label, state):
+        for operation in self.operations:
+            operation.state_forwards(app_label, state)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return self.sync_indexes(app_label, schema_editor, from_state, to_state)
+
+        for operation in self.operations:
+            to_state = from_state.clone()
+            operation.state_forwards(app_label, to_state)
+            operation.database_forwards(app_label, schema_editor, from_state, to_state)
+            from_state = to_state
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return self.sync_indexes(app_label, schema_editor, from_state, to_state)
+
+        to_states = {}
+        for operation in self.operations:
+            to_states[operation] = to_state
+            to_state = to_state.clone()
+            operation.state_forwards(app_label, to_state)
+
+        for operation in reversed(self.operations):
+            from_state = to_state
+            to_state = to_states[operation]
+            operation.database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def sync_indexes(self, app_label, schema_editor, from_state, to_state):
+        model_names = set((getattr(x, 'model_name', None) or x.name).lower() for x in self.operations)
+
+        for model_name in model_names:
+            old_model = from_state.apps.get_model(app_label, model_name)
+            new_model = to_state.apps.get_model(app_label, model_name)
+            old_indexes = get_model_indexes(old_model)
+            new_indexes = get_model_indexes(new_model)
+
+            for columns in set(old_indexes) - set(new_indexes):
+                names = schema_editor._constraint_names(old_model, columns, index=True, unique=False, primary_key=False)
+                for name in names:
+                    schema_editor.execute('DROP INDEX CONCURRENTLY {}'.format(schema_editor.quote_name(name)))
+
+            for columns in set(new_indexes) - set(old_indexes):
+                fields = new_indexes[columns]
+                if len(fields) == 1:
+                    statements = [
+                        schema_editor._create_index_sql(new_model, fields),
+                        schema_editor._create_like_index_sql(new_model, fields[0]),
+                    ]
+                else:
+                    statements = [schema_editor._create_index_sql(new_model, fields, suffix='_idx')]
+
+                for statement in statements:
+                    if statement:
+                        schema_editor.execute(statement.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import uuid
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import remove_query_param
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def filter_after_position(queryset, timestamp, pk, reverse=False):
+    ''' Events after the (timestamp, id) position, on `(-timestamp, -id)` ordering (or before it, if `reverse`). '''
+    lookup = 'gt' if reverse else 'lt'
+    return queryset.filter(
+        Q(**{'timestamp__{}'.format(lookup): timestamp}) |
+        Q(**{'timestamp': timestamp, 'id__{}'.format(lookup): pk})
+    )
+
+
+def iterate_by_position(queryset, chunk_size):
+    '''
+    Yields every event of `queryset` on `(-timestamp, -id)` ordering, fetching `chunk_size` of them at a time.
+    Each chunk starts where the previous one ended (no OFFSET), so memory usage and time per chunk are constant.
+    '''
+    queryset = queryset.order_by('-timestamp', '-id')
+    chunk = list(queryset[:chunk_size])
+
+    while chunk:
+        for instance in chunk:
+            yield instance
+
+        if len(chunk) < chunk_size:
+            return
+
+        last = chunk[-1]
+        chunk = list(filter_after_position(queryset, last.timestamp, last.id)[:chunk_size])
+
+
+class EventCursorPagination(CursorPagination):
+    '''
+    Keyset pagination on `(timestamp, id)`.
+    DRF's CursorPagination positions the cursor on the first ordering field only (using an offset to break ties).
+    Here the position carries both fields, so every page is a plain range scan no matter how deep it is - and no
+    `COUNT(*)` is run at all.
+    '''
+    ordering = ('-timestamp', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            reverse, position = False, None
+        else:
+            reverse, position = self.cursor.reverse, self.decode_position(self.cursor.position)
+
+        results = self.fetch(queryset, position, reverse, self.page_size + 1)
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        return self.page
+
+    def fetch(self, queryset, position, reverse, count):
+        ''' Up to `count` events after `position` (or the closest ones before it, oldest first, if `reverse`). '''
+        if reverse:
+            queryset = queryset.order_by('timestamp', 'id')
+        else:
+            queryset = queryset.order_by('-timestamp', '-id')
+
+        if position is not None:
+            timestamp, pk = position
+            queryset = filter_after_position(queryset, timestamp, pk, reverse=reverse)
+
+        return list(queryset[:count])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        if not self.page:
+            # Going backwards and nothing was found: there's nothing newer than the cursor, so start over.
+            return remove_query_param(self.base_url, self.cursor_query_param)
+
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        if not self.page:
+            return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.cursor.position))
+
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0])))
+
+    def encode_position(self, instance):
+        return '{}|{}'.format(instance.timestamp.isoformat(), instance.id)
+
+    def decode_position(self, position):
+        try:
+            timestamp, pk = position.split('|', 1)
+            timestamp = parse_datetime(timestamp)
+            pk = uuid.UUID(pk)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return timestamp, pk
+
+
+class ArchivedEventCursorPagination(EventCursorPagination):
+    ''' Same as `EventCursorPagination`, over events table and the view's `EventArchive` (`?include_archived=1`). '''
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.archive = view.get_event_archive()
+        return super(ArchivedEventCursorPagination, self).paginate_queryset(queryset, request, view=view)
+
+    def fetch(self, queryset, position, reverse, count):
+        results = super(ArchivedEventCursorPagination, self).fetch(queryset, position, reverse, count)
+        results += self.archive.fetch(position, reverse, count)
+        return sorted(results, key=lambda x: (x.timestamp, x.id), reverse=not reverse)[:count]
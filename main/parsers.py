@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from django.conf import settings
+
+
+class NDJSONParser(BaseParser):
+    '''
+    Parses newline-delimited JSON (one JSON document per line) lazily.
+    Instead of loading the whole body in memory this returns a generator which reads the request stream line by
+    line, yielding `(line_number, document)` pairs. Blank lines are skipped. Lines which are not valid JSON are
+    yielded as `ParseError` instances, so the caller is able to report them without aborting the whole upload.
+    '''
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return self.iter_lines(stream, encoding)
+
+    def iter_lines(self, stream, encoding):
+        for line_number, line in enumerate(stream, 1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, ParseError('JSON parse error - {}'.format(e))
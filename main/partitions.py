@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime
+
+import pytz
+
+from django.db import transaction
+
+from main.metadata import get_event_metadata_index
+from main.operations import get_model_indexes
+from main.search import EVENT_TABLE, get_event_search
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def month_range(start, end):
+    ''' First day (midnight, UTC) of every month from `start` up to `end` (both included). '''
+    month = datetime(start.year, start.month, 1, tzinfo=pytz.utc)
+    while month <= end:
+        yield month
+        month = add_months(month, 1)
+
+
+class EventPartitions(object):
+    '''
+    Optional storage mode where events table is range-partitioned by month on `timestamp` (PostgreSQL 13+: the
+    full-text search triggers it keeps need BEFORE ROW triggers on partitioned tables). Queries bounded by timestamp
+    only touch the partitions they need.
+
+    Partitions must exist before events for that month arrive - run `event_partitions` management command
+    periodically to create them ahead of time. Events out of every range go to a default partition.
+    Note that partitioned tables can only enforce a primary key including the partition key: on this mode the
+    primary key is `(id, timestamp)`.
+    '''
+    default_partition = '{}_default'.format(EVENT_TABLE)
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def fetchall(self, sql, params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def is_supported(self):
+        return self.connection.vendor == 'postgresql' and self.connection.pg_version >= 130000
+
+    def is_partitioned(self):
+        return bool(self.fetchall(
+            'SELECT 1 FROM pg_partitioned_table JOIN pg_class ON pg_class.oid = partrelid WHERE relname = %s',
+            [EVENT_TABLE]
+        ))
+
+    def get_partition_name(self, month):
+        return '{}_y{:04d}m{:02d}'.format(EVENT_TABLE, month.year, month.month)
+
+    def get_partitions(self):
+        rows = self.fetchall(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = inhparent JOIN pg_class child ON child.oid = inhrelid '
+            'WHERE parent.relname = %s ORDER BY child.relname',
+            [EVENT_TABLE]
+        )
+        return [x[0] for x in rows]
+
+    def create_partitions(self, start, end):
+        ''' Creates the missing monthly partitions from `start` up to `end`. Returns the names of the created ones. '''
+        existing = set(self.get_partitions())
+        created = []
+
+        for month in month_range(start, end):
+            name = self.get_partition_name(month)
+            if name in existing:
+                continue
+
+            if self.default_partition in existing:
+                self.create_partition_moving_default(name, month)
+            else:
+                self.create_partition(name, month)
+            created.append(name)
+
+        return created
+
+    def create_partition(self, name, month):
+        self.execute(
+            'CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(name, EVENT_TABLE),
+            [month, add_months(month, 1)]
+        )
+
+    def create_partition_moving_default(self, name, month):
+        '''
+        PostgreSQL refuses to create a partition while the default one holds rows of its range - and it does as soon
+        as events of that month arrive early. So the default partition is detached, the partition is created, rows of
+        its range are moved over and the default partition is attached back (all of it on a single transaction).
+        Events table is locked meanwhile - the shorter the default partition, the faster.
+        '''
+        with transaction.atomic(using=self.connection.alias):
+            self.execute('ALTER TABLE {} DETACH PARTITION {}'.format(EVENT_TABLE, self.default_partition))
+            self.create_partition(name, month)
+            self.execute(
+                'WITH moved AS (DELETE FROM {} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+                'INSERT INTO {} SELECT * FROM moved'.format(self.default_partition, EVENT_TABLE),
+                [month, add_months(month, 1)]
+            )
+            self.execute('ALTER TABLE {} ATTACH PARTITION {} DEFAULT'.format(EVENT_TABLE, self.default_partition))
+
+    def convert(self, schema_editor, model, months_ahead):
+        '''
+        Turns the regular events table into a partitioned one, copying all the events.
+        This locks events table while it runs - do it on a maintenance window.
+        '''
+        old_table = '{}_unpartitioned'.format(EVENT_TABLE)
+        customer_table = model._meta.get_field('customer').related_model._meta.db_table
+
+        with transaction.atomic(using=self.connection.alias):
+            self.execute('ALTER TABLE {} RENAME TO {}'.format(EVENT_TABLE, old_table))
+            self.execute(
+                'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")'.format(
+                    EVENT_TABLE, old_table
+                )
+            )
+            self.execute('ALTER TABLE {} ADD PRIMARY KEY (id, "timestamp")'.format(EVENT_TABLE))
+            self.execute(
+                'ALTER TABLE {} ADD FOREIGN KEY (customer_id) REFERENCES {} (id) DEFERRABLE INITIALLY DEFERRED'.format(
+                    EVENT_TABLE, customer_table
+                )
+            )
+
+            first, last = self.fetchall('SELECT min("timestamp"), max("timestamp") FROM {}'.format(old_table))[0]
+            now = datetime.now(pytz.utc)
+            self.create_partitions(min(first or now, now), add_months(max(last or now, now), months_ahead))
+            self.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(self.default_partition, EVENT_TABLE))
+
+            self.execute('INSERT INTO {} SELECT * FROM {}'.format(EVENT_TABLE, old_table))
+            self.execute('DROP TABLE {}'.format(old_table))
+
+            # Indexes on a partitioned table are created on every partition (current and future ones).
+            for fields in get_model_indexes(model).values():
+                suffix = '' if len(fields) == 1 else '_idx'
+                self.execute(schema_editor._create_index_sql(model, fields, suffix=suffix))
+
+            self.execute(get_event_metadata_index(self.connection).get_create_index_sql())
+            search = get_event_search(self.connection)
+            self.execute('CREATE INDEX {0}_search_vector ON {0} USING GIN (search_vector)'.format(EVENT_TABLE))
+            search.install_triggers()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import json
+import re
+
+from django.conf import settings
+
+EVENT_TABLE = 'main_event'
+WORD_RE = re.compile(r'[^\W_]+', re.UNICODE)  # Underscores split words, as on both backends.
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower())
+
+
+def matches_terms(document, terms):
+    '''
+    Whether `document` (a string) matches every one of `terms` the way the full-text index does: as a word prefix.
+    A term made of a few words (e.g. `users.User`) must match as many words in a row - the last one as a prefix.
+    '''
+    words = tokenize(document)
+    for term in terms:
+        term_words = tokenize(term)
+        if not term_words:
+            continue
+
+        size = len(term_words)
+        if not any(
+            words[x:x + size - 1] == term_words[:-1] and words[x + size - 1].startswith(term_words[-1])
+            for x in range(len(words) - size + 1)
+        ):
+            return False
+    return True
+
+
+class BaseEventSearch(object):
+    '''
+    Full-text index over events, kept up to date by database triggers (so bulk inserts are covered as well).
+    `install`/`uninstall` are meant to be run from migrations. `install_triggers` + `rebuild` are meant to be run when
+    EVENTS_SEARCH_INCLUDE_METADATA changes (see `rebuild_event_search` management command).
+    '''
+    fields = ('message', 'object_type', 'object_id', 'human_identifier')
+    rebuild_chunk_size = 10000
+
+    def __init__(self, connection, include_metadata=None):
+        self.connection = connection
+        if include_metadata is None:
+            include_metadata = settings.EVENTS_SEARCH_INCLUDE_METADATA
+        self.include_metadata = include_metadata
+
+    def execute(self, sql, params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def get_document_sql(self, row):
+        ''' SQL expression with the searchable text of `row` (`NEW`, `OLD` or a table name). '''
+        fields = self.fields + (('metadata', ) if self.include_metadata else ())
+        columns = ['{}.{}'.format(row, self.connection.ops.quote_name(x)) for x in fields]
+        return " || ' ' || ".join("coalesce({}, '')".format(self.cast_to_text(x)) for x in columns)
+
+    def cast_to_text(self, column):
+        return column
+
+    def get_document(self, event):
+        ''' Searchable text of `event` - same as `get_document_sql`, for events out of events table (e.g. archived). '''
+        values = [getattr(event, x) for x in self.fields]
+        if self.include_metadata and event.metadata is not None:
+            values.append(json.dumps(event.metadata))
+        return ' '.join(x or '' for x in values)
+
+    def matches(self, event, terms):
+        ''' Whether `filter(queryset, terms)` would find `event`. '''
+        return matches_terms(self.get_document(event), terms)
+
+    def install(self):
+        raise NotImplementedError
+
+    def uninstall(self):
+        raise NotImplementedError
+
+    def install_triggers(self):
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def filter(self, queryset, terms):
+        raise NotImplementedError
+
+
+class PostgresEventSearch(BaseEventSearch):
+    ''' A `tsvector` column on events table (maintained by a trigger) with a GIN index over it. '''
+    config = 'simple'  # Events are written in any language and carry identifiers - no stemming, please.
+
+    def cast_to_text(self, column):
+        return '{}::text'.format(column)
+
+    def install(self):
+        self.execute('ALTER TABLE {} ADD COLUMN search_vector tsvector'.format(EVENT_TABLE))
+        self.install_triggers()
+        self.rebuild()
+        self.execute('CREATE INDEX CONCURRENTLY {0}_search_vector ON {0} USING GIN (search_vector)'.format(EVENT_TABLE))
+
+    def uninstall(self):
+        self.execute('DROP TRIGGER IF EXISTS {0}_search_vector ON {0}'.format(EVENT_TABLE))
+        self.execute('DROP FUNCTION IF EXISTS {}_search_vector()'.format(EVENT_TABLE))
+        self.execute('ALTER TABLE {} DROP COLUMN IF EXISTS search_vector'.format(EVENT_TABLE))
+
+    def install_triggers(self):
+        self.execute('''
+            CREATE OR REPLACE FUNCTION {table}_search_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('{config}', {document});
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        '''.format(table=EVENT_TABLE, config=self.config, document=self.get_document_sql('NEW')))
+        self.execute('DROP TRIGGER IF EXISTS {0}_search_vector ON {0}'.format(EVENT_TABLE))
+        self.execute('''
+            CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector()
+        '''.format(table=EVENT_TABLE))
+
+    def rebuild(self):
+        # Touching the rows fires the trigger. Done in chunks so there is no huge transaction/long lock.
+        last_id = '00000000-0000-0000-0000-000000000000'
+        while True:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT id FROM {} WHERE id > %s ORDER BY id LIMIT %s'.format(EVENT_TABLE),
+                    [last_id, self.rebuild_chunk_size]
+                )
+                ids = [x[0] for x in cursor.fetchall()]
+                if not ids:
+                    return
+
+                cursor.execute('UPDATE {} SET message = message WHERE id = ANY(%s)'.format(EVENT_TABLE), [ids])
+                last_id = ids[-1]
+
+    def filter(self, queryset, terms):
+        # Every term must be found (as a prefix), just like DRF's SearchFilter requires every term to be found.
+        query = ' & '.join("'{}':*".format(x.replace('\\', '\\\\').replace("'", "''")) for x in terms)
+        return queryset.extra(
+            where=['{}.search_vector @@ to_tsquery(%s, %s)'.format(EVENT_TABLE)],
+            params=[self.config, query],
+        )
+
+
+class SQLiteEventSearch(BaseEventSearch):
+    '''
+    A FTS5 table (maintained by triggers) for local/test runs.
+    Note that SQLite drops the triggers whenever a migration rebuilds events table - run `install_triggers` again
+    after those.
+    '''
+    search_table = '{}_search'.format(EVENT_TABLE)
+    triggers = {
+        'insert': 'AFTER INSERT ON {table} BEGIN {insert}; END',
+        'update': 'AFTER UPDATE ON {table} BEGIN {delete}; {insert}; END',
+        'delete': 'AFTER DELETE ON {table} BEGIN {delete}; END',
+    }
+
+    def install(self):
+        self.execute('CREATE VIRTUAL TABLE {} USING fts5(event_id UNINDEXED, document)'.format(self.search_table))
+        self.install_triggers()
+        self.rebuild()
+
+    def uninstall(self):
+        for name in self.triggers:
+            self.execute('DROP TRIGGER IF EXISTS {}_{}'.format(self.search_table, name))
+        self.execute('DROP TABLE IF EXISTS {}'.format(self.search_table))
+
+    def install_triggers(self):
+        context = {
+            'table': EVENT_TABLE,
+            'insert': 'INSERT INTO {} (event_id, document) VALUES (NEW.id, {})'.format(
+                self.search_table, self.get_document_sql('NEW')
+            ),
+            'delete': 'DELETE FROM {} WHERE event_id = OLD.id'.format(self.search_table),
+        }
+
+        for name, sql in self.triggers.items():
+            self.execute('DROP TRIGGER IF EXISTS {}_{}'.format(self.search_table, name))
+            self.execute('CREATE TRIGGER {}_{} {}'.format(self.search_table, name, sql.format(**context)))
+
+    def rebuild(self):
+        self.execute('DELETE FROM {}'.format(self.search_table))
+        self.execute('INSERT INTO {} (event_id, document) SELECT id, {} FROM {}'.format(
+            self.search_table, self.get_document_sql(EVENT_TABLE), EVENT_TABLE
+        ))
+
+    def filter(self, queryset, terms):
+        query = ' AND '.join('"{}"*'.format(x.replace('"', '""')) for x in terms)
+        return queryset.extra(
+            where=['{}.id IN (SELECT event_id FROM {} WHERE {} MATCH %s)'.format(
+                EVENT_TABLE, self.search_table, self.search_table
+            )],
+            params=[query],
+        )
+
+
+EVENT_SEARCH_BACKENDS = {
+    'postgresql': PostgresEventSearch,
+    'sqlite': SQLiteEventSearch,
+}
+
+
+def get_event_search(connection, include_metadata=None):
+    backend = EVENT_SEARCH_BACKENDS.get(connection.vendor)
+    if not backend:
+        return None
+    return backend(connection, include_metadata=include_metadata)
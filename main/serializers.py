@@ -1,13 +1,29 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
+from collections import OrderedDict
+import operator
 
-from rest_framework import serializers, exceptions
+import six
+from rest_framework import ISO_8601, serializers, exceptions
+from rest_framework.settings import api_settings
 
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.contrib.auth import authenticate
 
-from main.models import Event, Customer
+from main.aggregations import GROUP_BY_FIELDS, INTERVALS
+from main.models import Event, Customer, RetentionPolicy
+
+
+def get_requested_fields(request):
+    ''' Returns the (`fields`, `exclude`) sets asked for on the query string. '''
+    fields = set([x for x in request.query_params.get('fields', '').split(',') if x.strip()])
+    exclude = set([x for x in request.query_params.get('exclude', '').split(',') if x.strip()])
+
+    if fields and exclude:
+        raise serializers.ValidationError('Provide "fields" or "exclude" - not both.')
+
+    return fields, exclude
 
 
 class DynamicFieldsMixin(object):
@@ -22,14 +38,10 @@ class DynamicFieldsMixin(object):
         if not self.context:
             return  # During initialization this may happen
 
-        fields = set([x for x in self.context['request'].query_params.get('fields', '').split(',') if x.strip()])
-        exclude = set([x for x in self.context['request'].query_params.get('exclude', '').split(',') if x.strip()])
+        fields, exclude = get_requested_fields(self.context['request'])
         initial_fields = set(self.fields.keys())
 
-        if fields and exclude:
-            raise serializers.ValidationError('Provide "fields" or "exclude" - not both.')
-
-        elif fields:
+        if fields:
             for field_name in initial_fields - fields:
                 self.fields.pop(field_name)
 
@@ -57,15 +69,113 @@ class ModelSanityMixin(object):
                     raise exceptions.ValidationError(e.message_dict)
                 raise exceptions.ValidationError(e.message)
 
+            for key in list(data.keys()):
+                data[key] = getattr(instance, key)  # Keeping whatever `clean` normalized.
+
         return super(ModelSanityMixin, self).validate(data)
 
+    # Data was validated above already (fields given to `.save()` come from the server, so they're trusted): no need
+    # to run `full_clean` (and its queries) once again on save.
+    def create(self, validated_data):
+        serializers.raise_errors_on_nested_writes('create', self, validated_data)
+        instance = self.Meta.model(**validated_data)
+        instance.mark_clean()
+        instance.save(force_insert=True)
+        return instance
+
+    def update(self, instance, validated_data):
+        instance.mark_clean()
+        return super(ModelSanityMixin, self).update(instance, validated_data)
+
 
 class BaseSerializerMixin(ModelSanityMixin, DynamicFieldsMixin):
     pass
 
 
+def encode_datetime_iso_8601(value):
+    # Same as `DateTimeField.to_representation` when the output format is ISO 8601.
+    if isinstance(value, six.string_types):
+        return value
+
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class CompiledSerializer(object):
+    '''
+    Read-only representation of a serializer (with a given set of fields), for list responses.
+    Fields are looked at once and turned into flat (name, getter, encoder) triples: common fields (text, UUIDs, ISO
+    datetimes) are encoded directly, others fall back to their own `to_representation`. Output is the same as the
+    serializer's. Instances are memoized per serializer class and fields - use `for_request` to get them.
+    '''
+    _compiled = {}
+    _readable_fields = {}
+
+    def __init__(self, serializer_class, field_names):
+        serializer = serializer_class()
+        model_fields = set(x.name for x in serializer.Meta.model._meta.concrete_fields)
+        self.field_names = tuple(field_names)
+        self.encoders = [self.get_encoder(serializer.fields[x], model_fields) for x in field_names]
+
+        # Model fields the representation reads from (None if that's not known - e.g. a method is involved).
+        sources = [serializer.fields[x].source for x in field_names]
+        self.model_field_names = tuple(sources) if all(x in model_fields for x in sources) else None
+
+    @classmethod
+    def for_request(cls, serializer_class, request, default_exclude=()):
+        ''' `default_exclude` fields are left out unless explicitly asked for (on `fields`). '''
+        fields, exclude = get_requested_fields(request)
+        exclude = exclude | set(default_exclude)
+
+        if serializer_class not in cls._readable_fields:
+            cls._readable_fields[serializer_class] = [
+                name for name, field in serializer_class().fields.items() if not field.write_only
+            ]
+
+        field_names = cls._readable_fields[serializer_class]
+        if fields:
+            field_names = [x for x in field_names if x in fields]
+        else:
+            field_names = [x for x in field_names if x not in exclude]
+
+        key = (serializer_class, tuple(field_names))
+        if key not in cls._compiled:
+            cls._compiled[key] = cls(serializer_class, field_names)
+        return cls._compiled[key]
+
+    def get_encoder(self, field, model_fields):
+        simple_source = field.source in model_fields  # A plain attribute (rather than a method, a relation...)
+        getter = operator.attrgetter(field.source) if simple_source else field.get_attribute
+        field_class = type(field)
+
+        if simple_source and field_class is serializers.CharField:
+            return (field.field_name, getter, six.text_type)
+
+        if simple_source and field_class is serializers.UUIDField and field.uuid_format == 'hex_verbose':
+            return (field.field_name, getter, str)
+
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if simple_source and field_class is serializers.DateTimeField and output_format:
+            if output_format.lower() == ISO_8601:
+                return (field.field_name, getter, encode_datetime_iso_8601)
+
+        return (field.field_name, field.get_attribute, field.to_representation)
+
+    def to_representation(self, instance):
+        ret = OrderedDict()
+        for field_name, getter, encoder in self.encoders:
+            value = getter(instance)
+            ret[field_name] = None if value is None else encoder(value)
+        return ret
+
+    def to_representation_many(self, instances):
+        return [self.to_representation(x) for x in instances]
+
+
 class EventSerializer(BaseSerializerMixin, serializers.ModelSerializer):
-    FULL_CLEAN_EXCLUDE = ['customer', ]
+    FULL_CLEAN_EXCLUDE = ['customer', 'id']  # Both are set by the server (so there's no point on checking them).
 
     class Meta:
         model = Event
@@ -73,6 +183,33 @@ class EventSerializer(BaseSerializerMixin, serializers.ModelSerializer):
         read_only_fields = ('id', 'created', 'modified')
 
 
+class RetentionPolicySerializer(BaseSerializerMixin, serializers.ModelSerializer):
+    FULL_CLEAN_EXCLUDE = ['customer', 'id']
+
+    class Meta:
+        model = RetentionPolicy
+        exclude = ('customer', )
+        read_only_fields = ('id', 'created', 'modified')
+
+    def validate(self, attrs):
+        # Done here (not on `validate_object_type`) so the default policy (empty object type) is checked when omitted.
+        object_type = attrs.get('object_type', self.instance.object_type if self.instance else '')
+        policies = RetentionPolicy.objects.filter(customer=self.context['request'].user, object_type=object_type)
+        if self.instance:
+            policies = policies.exclude(pk=self.instance.pk)
+
+        if policies.exists():
+            raise serializers.ValidationError({
+                'object_type': ['There is a retention policy for this object type already.'],
+            })
+        return super(RetentionPolicySerializer, self).validate(attrs)
+
+
+class EventHistogramSerializer(serializers.Serializer):
+    interval = serializers.ChoiceField(choices=list(INTERVALS), default='1d')
+    group_by = serializers.ChoiceField(choices=GROUP_BY_FIELDS, required=False)
+
+
 class CustomerSerializer(BaseSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(required=True, write_only=True, min_length=8)
 
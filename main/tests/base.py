@@ -44,6 +44,20 @@ class BaseTestMixin(object):
     pass
 
 
+class EventDataMixin(object):
+    def get_data(self, **kwargs):
+        ''' Payload of an event to be created through the API, with `kwargs` overriding its fields. '''
+        data = {
+            'object_id': 'abcdefgh',
+            'object_type': 'users.models.User',
+            'human_identifier': 'Filipe Waitman',
+            'message': 'User signed up',
+            'timestamp': '2016-01-01T12:13:14',
+        }
+        data.update(kwargs)
+        return data
+
+
 class TestCase(BaseTestMixin, DjangoTestCase):
     pass
 
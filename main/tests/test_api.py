@@ -1,14 +1,29 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
 
+import csv
+import io
+import json
+import re
+
 import arrow
+import six
 
 from django.conf import settings
 from django.core import mail
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
-from main.models import Customer, Event
-from main.tests.base import APITestCase, CustomerFactory, EventFactory
+from main.archives import EventArchiver
+from main.models import Customer, Event, OutgoingEmail, RetentionPolicy
+from main.buffers import get_event_buffer
+from main.pagination import ArchivedEventCursorPagination
+from main.parsers import NDJSONParser
+from main.tests.base import APITestCase, CustomerFactory, EventDataMixin, EventFactory
+from main.tests.test_archives import EventArchiveTestMixin
+from main.tests.test_buffers import EventBufferTestMixin
 
 
 class CustomerAPITestCase(APITestCase):
@@ -44,6 +59,7 @@ class CustomerAPITestCase(APITestCase):
     def test_create(self):
         self.client.logout()
         mail.outbox = []
+        OutgoingEmail.objects.all().delete()
 
         data = {
             'name': 'Filipe Waitman',
@@ -63,6 +79,7 @@ class CustomerAPITestCase(APITestCase):
         self.assertTrue(user.check_password('supersikret'))
         self.assertFalse(user.email_verified)
 
+        OutgoingEmail.objects.send_queued()
         self.assertEquals(len(mail.outbox), 1)
         self.assertEquals(mail.outbox[0].subject, u'[Dlogr] Account activation')
 
@@ -209,6 +226,7 @@ class CustomerAPITestCase(APITestCase):
         self.user.email_verified = True
         self.user.save()
         mail.outbox = []
+        OutgoingEmail.objects.all().delete()
 
         data = {
             'email': 'new@email.com'
@@ -222,6 +240,7 @@ class CustomerAPITestCase(APITestCase):
         self.assertEquals(self.user.email, 'new@email.com')
         self.assertFalse(self.user.email_verified)
 
+        OutgoingEmail.objects.send_queued()
         self.assertEquals(len(mail.outbox), 1)
         self.assertEquals(mail.outbox[0].subject, u'[Dlogr] Please verify your email')
 
@@ -241,6 +260,14 @@ class CustomerAPITestCase(APITestCase):
         response = self.client.delete(reverse('customers-detail', kwargs={'pk': self.user.pk}))
         self.assertEquals(response.status_code, 401)
 
+    def test_update_normalizes_data(self):
+        response = self.client.patch(
+            reverse('customers-detail', kwargs={'pk': self.user.pk}), {'email': 'NEW@Example.com'}
+        )
+        self.assertEquals(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEquals(self.user.email, 'new@example.com')
+
 
 class EventAPITestCase(APITestCase):
     def setUp(self):
@@ -250,7 +277,9 @@ class EventAPITestCase(APITestCase):
     def test_list(self):
         response = self.client.get(reverse('events-list'))
         self.assertEquals(response.status_code, 200)
-        self.assertEquals(response.data['count'], 1)
+        self.assertEquals(len(response.data['results']), 1)
+        self.assertEquals(response.data['next'], None)
+        self.assertEquals(response.data['previous'], None)
         self.assertEquals(response.data['results'][0]['id'], str(self.event.id))
         self.assertEquals(response.data['results'][0]['object_id'], self.event.object_id)
         self.assertEquals(response.data['results'][0]['object_type'], self.event.object_type)
@@ -260,6 +289,84 @@ class EventAPITestCase(APITestCase):
         self.assertEquals(arrow.get(response.data['results'][0]['created']), self.event.created)
         self.assertEquals(arrow.get(response.data['results'][0]['modified']), self.event.modified)
 
+    def test_list_limit_offset(self):
+        response = self.client.get(reverse('events-list'), {'limit': 10, 'offset': 0})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['count'], 1)
+        self.assertEquals(response.data['results'][0]['id'], str(self.event.id))
+
+    def test_list_search(self):
+        event = EventFactory.create(customer=self.user, message='User got mad', human_identifier='Bart Simpson')
+        EventFactory.create(message='User got mad')  # Someone else's.
+
+        response = self.client.get(reverse('events-list'), {'search': 'mad bart'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([x['id'] for x in response.data['results']], [str(event.id)])
+
+        response = self.client.get(reverse('events-list'), {'search': 'mad homer'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['results'], [])
+
+    def test_list_timestamp_range(self):
+        old = EventFactory.create(customer=self.user, timestamp=arrow.get('2016-01-01T12:00:00').datetime)
+        middle = EventFactory.create(customer=self.user, timestamp=arrow.get('2016-02-01T12:00:00').datetime)
+        EventFactory.create(customer=self.user, timestamp=arrow.get('2016-03-01T12:00:00').datetime)
+
+        data = {'timestamp__gte': '2016-01-01T12:00:00Z', 'timestamp__lt': '2016-03-01T12:00:00Z'}
+        response = self.client.get(reverse('events-list'), data)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([x['id'] for x in response.data['results']], [str(middle.id), str(old.id)])
+
+        response = self.client.get(reverse('events-list'), {'timestamp__gte': 'invalid'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['results'], [])
+
+    def get_list_select(self, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('events-list'), data)
+        self.assertEquals(response.status_code, 200)
+
+        selects = [x['sql'] for x in context.captured_queries if 'FROM "main_event"' in x['sql']]
+        self.assertEquals(len(selects), 1)
+        return response, selects[0].split(' FROM ')[0]
+
+    def test_list_fields_projection(self):
+        self.event.metadata = {'a': 1}
+        self.event.save()
+
+        response, select = self.get_list_select({'fields': 'message'})
+        self.assertEquals(response.data['results'], [{'message': self.event.message}])
+        self.assertIn('"main_event"."message"', select)
+        self.assertNotIn('"main_event"."metadata"', select)
+        self.assertNotIn('"main_event"."object_type"', select)
+
+        response, select = self.get_list_select({'exclude': 'metadata'})
+        self.assertNotIn('metadata', response.data['results'][0])
+        self.assertNotIn('"main_event"."metadata"', select)
+        self.assertIn('"main_event"."object_type"', select)
+
+        response, select = self.get_list_select({})
+        self.assertEquals(response.data['results'][0]['metadata'], {'a': 1})
+        self.assertIn('"main_event"."metadata"', select)
+
+    @override_settings(EVENTS_LIST_DEFER_METADATA=True)
+    def test_list_defer_metadata(self):
+        self.event.metadata = {'a': 1}
+        self.event.save()
+
+        response, select = self.get_list_select({})
+        self.assertNotIn('metadata', response.data['results'][0])
+        self.assertIn('message', response.data['results'][0])
+        self.assertNotIn('"main_event"."metadata"', select)
+
+        response, select = self.get_list_select({'fields': 'id,metadata'})
+        self.assertEquals(response.data['results'], [{'id': str(self.event.id), 'metadata': {'a': 1}}])
+        self.assertIn('"main_event"."metadata"', select)
+
+        # Retrieving a single event is not affected.
+        response = self.client.get(reverse('events-detail', kwargs={'pk': self.event.pk}))
+        self.assertEquals(response.data['metadata'], {'a': 1})
+
     def test_list_logged_out(self):
         self.client.logout()
         response = self.client.get(reverse('events-list'))
@@ -313,6 +420,33 @@ class EventAPITestCase(APITestCase):
         self.assertEquals(event.message, data['message'])
         self.assertEquals(event.timestamp, arrow.get(data['timestamp']))
 
+    def test_create_queries(self):
+        data = {
+            'object_id': 'abcdefgh',
+            'object_type': 'users.models.User',
+            'human_identifier': 'Filipe Waitman',
+            'message': 'User signed up',
+            'timestamp': '2016-01-01T12:13:14',
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('events-list'), data)
+        self.assertEquals(response.status_code, 201)
+
+        queries = [x['sql'] for x in context.captured_queries]
+        writes = []
+        for sql in queries:
+            # `executemany` is logged once, as "<N> times: <sql>".
+            times, sql = re.match(r'^(?:(\d+) times: )?(.*)$', sql, re.S).groups()
+            if sql.split()[0].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+                writes.extend([sql] * int(times or 1))
+
+        # Token lookup, the event insert and the upsert of its hour and day rollups - no unique/FK checks.
+        self.assertEquals(len(queries), 3)
+        self.assertEquals(len(writes), 3)
+        self.assertTrue(writes[0].startswith('INSERT INTO "main_event"'))
+        self.assertTrue(all(x.startswith('INSERT INTO "main_eventrollup"') for x in writes[1:]))
+        self.assertEquals([x for x in queries if 'FROM "main_event"' in x], [])
+
     def test_create_logged_out(self):
         self.client.logout()
 
@@ -492,6 +626,440 @@ class EventAPITestCase(APITestCase):
         self.assertEquals(response.status_code, 401)
 
 
+class EventExportAPITestCase(APITestCase):
+    def setUp(self):
+        super(EventExportAPITestCase, self).setUp()
+        timestamp = arrow.get('2016-01-01T12:00:00').datetime
+        self.events = [
+            EventFactory.create(customer=self.user, timestamp=timestamp, object_type='users.User', metadata={'a': 1}),
+            EventFactory.create(customer=self.user, timestamp=timestamp, object_type='users.User', message='Olá'),
+            EventFactory.create(customer=self.user, timestamp=arrow.get('2016-02-01T12:00:00').datetime),
+        ]
+        self.events.sort(key=lambda x: (x.timestamp, x.id), reverse=True)
+        EventFactory.create()  # Someone else's.
+
+    def export(self, data=None):
+        response = self.client.get(reverse('events-export'), data or {})
+        self.assertEquals(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson(self):
+        response, content = self.export()
+        self.assertEquals(response['Content-Type'], 'application/x-ndjson')
+        self.assertEquals(response['Content-Disposition'], 'attachment; filename="events.ndjson"')
+
+        rows = [json.loads(x) for x in content.splitlines()]
+        self.assertEquals([x['id'] for x in rows], [str(x.id) for x in self.events])
+        self.assertEquals(rows[0]['object_type'], self.events[0].object_type)
+        self.assertEquals(arrow.get(rows[0]['timestamp']), self.events[0].timestamp)
+        self.assertEquals([x['metadata'] for x in rows if x['metadata']], [{'a': 1}])
+        self.assertIn('Olá', [x['message'] for x in rows])
+
+    def test_csv(self):
+        response, content = self.export({'output': 'csv', 'fields': 'id,message,metadata'})
+        self.assertEquals(response['Content-Type'], 'text/csv')
+        self.assertEquals(response['Content-Disposition'], 'attachment; filename="events.csv"')
+
+        if six.PY2:
+            rows = list(csv.reader(io.BytesIO(content.encode('utf-8'))))
+            rows = [[x.decode('utf-8') for x in row] for row in rows]
+        else:
+            rows = list(csv.reader(io.StringIO(content)))
+
+        self.assertEquals(rows[0], ['id', 'message', 'metadata'])
+        self.assertEquals([x[0] for x in rows[1:]], [str(x.id) for x in self.events])
+        self.assertEquals(rows[1:], [
+            [str(x.id), x.message, json.dumps(x.metadata) if x.metadata else ''] for x in self.events
+        ])
+
+    def test_filters(self):
+        _, content = self.export({'object_type': 'users.User', 'fields': 'id'})
+        expected = [str(x.id) for x in self.events if x.object_type == 'users.User']
+        self.assertEquals([json.loads(x)['id'] for x in content.splitlines()], expected)
+
+        _, content = self.export({'search': 'Olá', 'fields': 'id'})
+        self.assertEquals([json.loads(x)['id'] for x in content.splitlines()], [
+            str(x.id) for x in self.events if x.message == 'Olá'
+        ])
+
+    @override_settings(EVENTS_EXPORT_CHUNK_SIZE=2)
+    def test_chunks(self):
+        # Chunks split events sharing the same timestamp: nothing must be lost or repeated.
+        with CaptureQueriesContext(connection) as context:
+            _, content = self.export({'fields': 'id'})
+
+        self.assertEquals([json.loads(x)['id'] for x in content.splitlines()], [str(x.id) for x in self.events])
+        selects = [x['sql'] for x in context.captured_queries if 'FROM "main_event"' in x['sql']]
+        self.assertEquals(len(selects), 2)
+        self.assertTrue(all('OFFSET' not in x for x in selects))
+
+    def test_empty(self):
+        Event.objects.all().delete()
+        _, content = self.export()
+        self.assertEquals(content, '')
+
+        _, content = self.export({'output': 'csv', 'fields': 'id,message'})
+        self.assertEquals(content, 'id,message\r\n')
+
+    def test_invalid_output(self):
+        response = self.client.get(reverse('events-export'), {'output': 'xml'})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.data['output'], ['Choose one of: csv, ndjson.'])
+
+    def test_logged_out(self):
+        self.client.logout()
+        response = self.client.get(reverse('events-export'))
+        self.assertEquals(response.status_code, 401)
+
+
+class EventHistogramAPITestCase(APITestCase):
+    def setUp(self):
+        super(EventHistogramAPITestCase, self).setUp()
+        for timestamp, object_type in [
+            ('2016-01-01T01:30:00Z', 'users.User'),
+            ('2016-01-01T01:45:00Z', 'users.User'),
+            ('2016-01-01T01:50:00Z', 'orders.Order'),
+            ('2016-01-01T03:10:00Z', 'users.User'),
+            ('2016-01-02T12:00:00Z', 'orders.Order'),
+        ]:
+            EventFactory.create(customer=self.user, timestamp=arrow.get(timestamp).datetime, object_type=object_type)
+        EventFactory.create(timestamp=arrow.get('2016-01-01T01:00:00Z').datetime)  # Someone else's.
+
+    def get_histogram(self, data=None):
+        response = self.client.get(reverse('events-histogram'), data or {})
+        self.assertEquals(response.status_code, 200)
+        return response.data
+
+    def test_hourly(self):
+        data = self.get_histogram({'interval': '1h'})
+        self.assertEquals(data['interval'], '1h')
+        self.assertEquals(data['timezone'], 'UTC')
+        self.assertEquals(data['results'], [
+            {'bucket': '2016-01-01T01:00:00Z', 'count': 3},
+            {'bucket': '2016-01-01T03:00:00Z', 'count': 1},
+            {'bucket': '2016-01-02T12:00:00Z', 'count': 1},
+        ])
+
+    def test_default_interval(self):
+        data = self.get_histogram()
+        self.assertEquals(data['interval'], '1d')
+        self.assertEquals(data['results'], [
+            {'bucket': '2016-01-01T00:00:00Z', 'count': 4},
+            {'bucket': '2016-01-02T00:00:00Z', 'count': 1},
+        ])
+
+    def test_group_by(self):
+        data = self.get_histogram({'interval': '1M', 'group_by': 'object_type'})
+        self.assertEquals(data['results'], [
+            {'bucket': '2016-01-01T00:00:00Z', 'object_type': 'orders.Order', 'count': 2},
+            {'bucket': '2016-01-01T00:00:00Z', 'object_type': 'users.User', 'count': 3},
+        ])
+
+    def test_customer_timezone(self):
+        self.user.timezone = 'America/Sao_Paulo'  # UTC-2 on January 2016.
+        self.user.save()
+
+        data = self.get_histogram({'interval': '1d'})
+        self.assertEquals(data['timezone'], 'America/Sao_Paulo')
+        self.assertEquals(data['results'], [
+            {'bucket': '2015-12-31T00:00:00-02:00', 'count': 3},
+            {'bucket': '2016-01-01T00:00:00-02:00', 'count': 1},
+            {'bucket': '2016-01-02T00:00:00-02:00', 'count': 1},
+        ])
+
+    def test_dst_changes(self):
+        self.user.timezone = 'America/Sao_Paulo'
+        self.user.save()
+        for timestamp in [
+            '2016-10-16T12:00:00Z',  # Clocks moved forward at midnight: 2016-10-16 starts at 01:00.
+            '2017-02-19T01:30:00Z',  # Clocks moved back at midnight: 23:00-00:00 happened twice on 2017-02-18.
+            '2017-02-19T02:30:00Z',
+        ]:
+            EventFactory.create(customer=self.user, timestamp=arrow.get(timestamp).datetime)
+
+        for use_rollups in (True, False):
+            with override_settings(EVENTS_HISTOGRAM_USE_ROLLUPS=use_rollups):
+                data = self.get_histogram({'interval': '1d', 'timestamp__gte': '2016-10-01T00:00:00Z'})
+                self.assertEquals(data['results'], [
+                    {'bucket': '2016-10-16T01:00:00-02:00', 'count': 1},
+                    {'bucket': '2017-02-18T00:00:00-02:00', 'count': 2},
+                ])
+
+                data = self.get_histogram({'interval': '1h', 'timestamp__gte': '2017-02-01T00:00:00Z'})
+                self.assertEquals(data['results'], [
+                    {'bucket': '2017-02-18T23:00:00-03:00', 'count': 2},
+                ])
+
+    def test_filters(self):
+        data = self.get_histogram({'interval': '1d', 'object_type': 'orders.Order', 'ordering': 'message'})
+        self.assertEquals(data['results'], [
+            {'bucket': '2016-01-01T00:00:00Z', 'count': 1},
+            {'bucket': '2016-01-02T00:00:00Z', 'count': 1},
+        ])
+
+        data = self.get_histogram({'interval': '1d', 'timestamp__gte': '2016-01-01T02:00:00Z'})
+        self.assertEquals(data['results'], [
+            {'bucket': '2016-01-01T00:00:00Z', 'count': 1},
+            {'bucket': '2016-01-02T00:00:00Z', 'count': 1},
+        ])
+
+    def get_histogram_tables(self, data):
+        with CaptureQueriesContext(connection) as context:
+            self.get_histogram(data)
+        return set(x for x in ('main_event', 'main_eventrollup') if any(
+            '"{}"'.format(x) in y['sql'] and 'main_customer' not in y['sql'] for y in context.captured_queries
+        ))
+
+    def test_rollups(self):
+        EventFactory.create(
+            customer=self.user, timestamp=arrow.get('2016-01-01T01:15:00Z').datetime, object_type='users.User',
+            object_id='42'
+        ).delete()
+        self.user.timezone = 'America/Sao_Paulo'
+        self.user.save()
+
+        for data in [
+            {'interval': '1h'},
+            {'interval': '1d', 'group_by': 'object_type'},
+            {'interval': '1M', 'object_type': 'users.User', 'ordering': 'message'},
+            {'interval': '1d', 'timestamp__gte': '2016-01-01T02:00:00Z', 'timestamp__lt': '2016-01-02T12:00:00Z'},
+        ]:
+            self.assertEquals(self.get_histogram_tables(data), set(['main_eventrollup']))
+            with override_settings(EVENTS_HISTOGRAM_USE_ROLLUPS=False):
+                self.assertEquals(self.get_histogram_tables(data), set(['main_event']))
+                expected = self.get_histogram(data)
+            self.assertEquals(self.get_histogram(data), expected)
+
+    def test_rollups_fallback(self):
+        for data in [
+            {'interval': '1m'},
+            {'interval': '1h', 'group_by': 'object_id'},
+            {'interval': '1h', 'search': 'users'},
+            {'interval': '1h', 'human_identifier': 'Sloth'},
+            {'interval': '1h', 'timestamp__gte': '2016-01-01T01:30:00Z'},
+        ]:
+            self.assertEquals(self.get_histogram_tables(data), set(['main_event']))
+
+        self.user.timezone = 'Asia/Kolkata'  # UTC+05:30: its hours are not UTC hours.
+        self.user.save()
+        self.assertEquals(self.get_histogram_tables({'interval': '1d'}), set(['main_event']))
+        self.assertEquals(self.get_histogram({'interval': '1d'})['results'], [
+            {'bucket': '2016-01-01T00:00:00+05:30', 'count': 4},
+            {'bucket': '2016-01-02T00:00:00+05:30', 'count': 1},
+        ])
+
+    @override_settings(EVENTS_HISTOGRAM_MAX_RESULTS=2)
+    def test_too_many_results(self):
+        response = self.client.get(reverse('events-histogram'), {'interval': '1h'})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.data['interval'], [
+            'Too many results (more than 2). Use a bigger interval or a shorter timestamp range.'
+        ])
+
+    def test_invalid_params(self):
+        response = self.client.get(reverse('events-histogram'), {'interval': '2h', 'group_by': 'message'})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.data['interval'], ['"2h" is not a valid choice.'])
+        self.assertEquals(response.data['group_by'], ['"message" is not a valid choice.'])
+
+    def test_logged_out(self):
+        self.client.logout()
+        response = self.client.get(reverse('events-histogram'))
+        self.assertEquals(response.status_code, 401)
+
+
+class EventConditionalAPITestCase(APITestCase):
+    def setUp(self):
+        super(EventConditionalAPITestCase, self).setUp()
+        self.event = EventFactory.create(customer=self.user, object_type='users.User')
+        self.list_url = reverse('events-list')
+        self.detail_url = reverse('events-detail', kwargs={'pk': self.event.pk})
+
+    def get(self, url, data=None, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data or {}, **headers)
+        response.events_queried = any('"main_event"' in x['sql'] for x in context.captured_queries)
+        return response
+
+    def test_not_modified(self):
+        for url in (self.list_url, self.detail_url):
+            response = self.get(url)
+            self.assertEquals(response.status_code, 200)
+            etag = response['ETag']
+
+            response = self.get(url, etag=etag)
+            self.assertEquals(response.status_code, 304)
+            self.assertEquals(response['ETag'], etag)
+            self.assertEquals(response.content, b'')
+            self.assertFalse(response.events_queried)
+
+            response = self.get(url, etag='"something-else", {}'.format(etag))
+            self.assertEquals(response.status_code, 304)
+
+    def test_modified(self):
+        etag = self.get(self.list_url)['ETag']
+        self.assertEquals(self.get(self.list_url, {'object_type': 'users.User'}, etag=etag).status_code, 200)
+        self.assertEquals(self.get(self.list_url, {'format': 'json'}, etag=etag).status_code, 200)
+
+        EventFactory.create()  # Someone else's.
+        self.assertEquals(self.get(self.list_url, etag=etag).status_code, 304)
+
+        for change in [
+            lambda: EventFactory.create(customer=self.user),
+            lambda: Event.objects.bulk_create([EventFactory.build(customer=self.user)]),
+            lambda: self.client.patch(self.detail_url, {'message': 'Changed'}),
+            lambda: self.event.delete(),
+        ]:
+            change()
+            response = self.get(self.list_url, etag=etag)
+            self.assertEquals(response.status_code, 200)
+            self.assertTrue(response.events_queried)
+            self.assertNotEquals(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_not_found(self):
+        self.event.delete()
+        response = self.get(self.detail_url)
+        self.assertEquals(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class EventBulkAPITestCase(EventDataMixin, APITestCase):
+    def test_common(self):
+        data = [self.get_data(message='First'), self.get_data(message='Second')]
+        response = self.client.post(reverse('events-bulk'), data, format='json')
+
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(len(response.data['results']), 2)
+        self.assertEquals(response.data['results'][0]['status'], 201)
+        self.assertEquals(response.data['results'][0]['data']['message'], 'First')
+        self.assertEquals(response.data['results'][1]['status'], 201)
+        self.assertEquals(response.data['results'][1]['data']['message'], 'Second')
+
+        events = Event.objects.filter(customer=self.user)
+        self.assertEquals(events.count(), 2)
+        self.assertEquals(
+            set(str(x) for x in events.values_list('id', flat=True)),
+            set(x['data']['id'] for x in response.data['results'])
+        )
+
+    def test_single_insert_query(self):
+        data = [self.get_data(message='Event {}'.format(x)) for x in range(10)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('events-bulk'), data, format='json')
+
+        self.assertEquals(response.status_code, 201)
+        inserts = [x for x in queries.captured_queries if x['sql'].startswith('INSERT')]
+        self.assertEquals(len(inserts), 1)
+
+    def test_partial_errors(self):
+        data = [self.get_data(message='First'), self.get_data(object_id=''), 'invalid']
+        response = self.client.post(reverse('events-bulk'), data, format='json')
+
+        self.assertEquals(response.status_code, 207)
+        self.assertEquals(response.data['results'][0]['status'], 201)
+        self.assertEquals(response.data['results'][1]['status'], 400)
+        self.assertEquals(response.data['results'][1]['errors']['object_id'], [u'This field may not be blank.'])
+        self.assertEquals(response.data['results'][2]['status'], 400)
+        self.assertTrue('non_field_errors' in response.data['results'][2]['errors'])
+
+        self.assertEquals(Event.objects.filter(customer=self.user).count(), 1)
+
+    def test_not_a_list(self):
+        response = self.client.post(reverse('events-bulk'), self.get_data(), format='json')
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.data, [u'Expected a list of events.'])
+
+    @override_settings(EVENTS_BULK_MAX_SIZE=2)
+    def test_too_many(self):
+        data = [self.get_data(), self.get_data(), self.get_data()]
+        response = self.client.post(reverse('events-bulk'), data, format='json')
+
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.data, [u'Up to 2 events are allowed per request.'])
+        self.assertFalse(Event.objects.exists())
+
+    def test_logged_out(self):
+        self.client.logout()
+        response = self.client.post(reverse('events-bulk'), [self.get_data()], format='json')
+        self.assertEquals(response.status_code, 401)
+
+
+class EventBulkNDJSONAPITestCase(APITestCase):
+    def get_line(self, **kwargs):
+        data = {
+            'object_id': 'abcdefgh',
+            'object_type': 'users.models.User',
+            'human_identifier': 'Filipe Waitman',
+            'message': 'User signed up',
+            'timestamp': '2016-01-01T12:13:14',
+        }
+        data.update(kwargs)
+        return json.dumps(data)
+
+    def post(self, lines):
+        return self.client.post(reverse('events-bulk'), '\n'.join(lines), content_type='application/x-ndjson')
+
+    def test_common(self):
+        response = self.post([self.get_line(message='First'), '', self.get_line(message='Second')])
+
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data, {'accepted': 2, 'rejected': 0, 'errors': []})
+        self.assertEquals(
+            set(Event.objects.filter(customer=self.user).values_list('message', flat=True)),
+            {'First', 'Second'}
+        )
+
+    def test_rejected_lines(self):
+        response = self.post([self.get_line(), '{invalid json', self.get_line(object_id='')])
+
+        self.assertEquals(response.status_code, 207)
+        self.assertEquals(response.data['accepted'], 1)
+        self.assertEquals(response.data['rejected'], 2)
+        self.assertEquals(response.data['errors'][0]['line'], 2)
+        self.assertTrue(response.data['errors'][0]['errors']['non_field_errors'][0].startswith('JSON parse error'))
+        self.assertEquals(response.data['errors'][1]['line'], 3)
+        self.assertEquals(response.data['errors'][1]['errors']['object_id'], [u'This field may not be blank.'])
+        self.assertEquals(Event.objects.filter(customer=self.user).count(), 1)
+
+    @override_settings(EVENTS_NDJSON_CHUNK_SIZE=2, EVENTS_NDJSON_MAX_REPORTED_ERRORS=1)
+    def test_chunks(self):
+        lines = [self.get_line() for _ in range(5)] + ['nope', 'nope']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(lines)
+
+        self.assertEquals(response.status_code, 207)
+        self.assertEquals(response.data['accepted'], 5)
+        self.assertEquals(response.data['rejected'], 2)
+        self.assertEquals(len(response.data['errors']), 1)
+        self.assertEquals(Event.objects.filter(customer=self.user).count(), 5)
+
+        inserts = [x for x in queries.captured_queries if x['sql'].startswith('INSERT')]
+        self.assertEquals(len(inserts), 3)
+
+    def test_no_content_length(self):
+        response = self.client.post(
+            reverse('events-bulk'), self.get_line(), content_type='application/x-ndjson',
+            CONTENT_LENGTH='', HTTP_TRANSFER_ENCODING='chunked',
+        )
+        self.assertEquals(response.status_code, 411)
+        self.assertFalse(Event.objects.filter(customer=self.user).exists())
+
+    def test_empty(self):
+        response = self.post([])
+        self.assertEquals(response.status_code, 400)
+
+    def test_parser_is_lazy(self):
+        stream = iter([self.get_line().encode('utf-8'), b'nope'])
+        parsed = NDJSONParser().parse(stream)
+
+        line_number, document = next(parsed)
+        self.assertEquals(line_number, 1)
+        self.assertEquals(document['object_id'], 'abcdefgh')
+        self.assertEquals(next(stream), b'nope')  # Second line was not consumed yet.
+
+
 class DynamicFieldsMixinTestCase(APITestCase):
     def test_fields(self):
         data = {
@@ -645,12 +1213,14 @@ class VerifyAccountAPITestCase(APITestCase):
 class ResetPasswordAPITestCase(APITestCase):
     def test_common(self):
         mail.outbox = []
+        OutgoingEmail.objects.all().delete()
 
         data = {
             'email': self.user.email,
         }
         response = self.client.post(reverse('users-reset-password'), data)
         self.assertEquals(response.status_code, 204)
+        OutgoingEmail.objects.send_queued()
         self.assertEquals(len(mail.outbox), 1)
         self.assertEquals(mail.outbox[0].subject, u'[Dlogr] Reset your password')
 
@@ -677,12 +1247,14 @@ class ResetPasswordAPITestCase(APITestCase):
 
     def test_unknown_email(self):
         mail.outbox = []
+        OutgoingEmail.objects.all().delete()
 
         data = {
             'email': 'unknown@email.com',
         }
         response = self.client.post(reverse('users-reset-password'), data)
         self.assertEquals(response.status_code, 204)
+        OutgoingEmail.objects.send_queued()
         self.assertEquals(len(mail.outbox), 0)
 
 
@@ -818,3 +1390,391 @@ class ChangePasswordAPITestCase(APITestCase):
 
         self.user.refresh_from_db()
         self.assertFalse(self.user.check_password('supersikret42'))
+
+
+class EventIdempotencyAPITestCase(EventDataMixin, APITestCase):
+    def test_create(self):
+        response = self.client.post(reverse('events-list'), self.get_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEquals(response.status_code, 201)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+
+        with CaptureQueriesContext(connection) as context:
+            retry = self.client.post(reverse('events-list'), self.get_data(), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEquals(retry.status_code, 201)
+        self.assertEquals(retry['Idempotent-Replayed'], 'true')
+        self.assertEquals(retry.data, response.data)
+        self.assertFalse(any('"main_event"' in x['sql'] for x in context.captured_queries))
+        self.assertEquals(Event.objects.count(), 1)
+
+        response = self.client.post(reverse('events-list'), self.get_data(), HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(Event.objects.count(), 2)
+
+    def test_create_payload_mismatch(self):
+        self.client.post(reverse('events-list'), self.get_data(), HTTP_IDEMPOTENCY_KEY='key')
+        response = self.client.post(reverse('events-list'), self.get_data(message='Hi'), HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEquals(response.status_code, 422)
+        self.assertEquals(Event.objects.count(), 1)
+
+    def test_create_invalid_is_not_remembered(self):
+        response = self.client.post(reverse('events-list'), self.get_data(message=''), HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEquals(response.status_code, 400)
+        response = self.client.post(reverse('events-list'), self.get_data(message=''), HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEquals(response.status_code, 400)
+
+    def test_bulk(self):
+        items = [
+            self.get_data(idempotency_key='key-1'),
+            self.get_data(idempotency_key='key-2', message=''),
+            self.get_data(idempotency_key='key-1'),
+            self.get_data(),
+        ]
+        response = self.client.post(reverse('events-bulk'), items, format='json')
+        self.assertEquals(response.status_code, 207)
+        results = response.data['results']
+        self.assertEquals([x['status'] for x in results], [201, 400, 409, 201])
+        self.assertNotIn('idempotency_key', results[0]['data'])
+
+        items[1]['message'] = 'Fixed'
+        response = self.client.post(reverse('events-bulk'), items[:2], format='json')
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data['results'][0], results[0])
+        self.assertEquals(Event.objects.count(), 3)
+
+    def test_bulk_invalid_key_types(self):
+        items = [self.get_data(idempotency_key=123), self.get_data(idempotency_key=['key']), self.get_data()]
+        response = self.client.post(reverse('events-bulk'), items, format='json')
+        self.assertEquals(response.status_code, 207)
+        results = response.data['results']
+        self.assertEquals([x['status'] for x in results], [400, 400, 201])
+        self.assertIn('idempotency_key', results[0]['errors'])
+
+        body = '\n'.join(json.dumps(self.get_data(idempotency_key=x)) for x in (42, {'a': 1}))
+        response = self.client.post(reverse('events-bulk'), body, content_type='application/x-ndjson')
+        self.assertEquals(response.status_code, 207)
+        self.assertEquals(response.data['rejected'], 2)
+
+    def test_bulk_ndjson(self):
+        body = '\n'.join(json.dumps(self.get_data(idempotency_key='key-{}'.format(x))) for x in range(3))
+        for _ in range(2):
+            response = self.client.post(reverse('events-bulk'), body, content_type='application/x-ndjson')
+            self.assertEquals(response.status_code, 201)
+            self.assertEquals(response.data, {'accepted': 3, 'rejected': 0, 'errors': []})
+        self.assertEquals(Event.objects.count(), 3)
+
+
+class EventWriteBehindAPITestCase(EventBufferTestMixin, EventDataMixin, APITestCase):
+    def setUp(self):
+        super(EventWriteBehindAPITestCase, self).setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=self.authorization, HTTP_PREFER='respond-async')
+        self.buffer = get_event_buffer()
+
+    def test_create(self):
+        response = self.client.post(reverse('events-list'), self.get_data())
+        self.assertEquals(response.status_code, 202)
+        self.assertEquals(response['Preference-Applied'], 'respond-async')
+        self.assertEquals(response.data['message'], 'User signed up')
+        self.assertFalse(Event.objects.exists())
+        self.assertEquals(self.buffer.depth(), 1)
+
+        self.buffer.flush(10)
+        event = Event.objects.get()
+        self.assertEquals(str(event.id), response.data['id'])
+        self.assertEquals(event.customer, self.user)
+        self.assertEquals(event.timestamp, arrow.get('2016-01-01T12:13:14Z').datetime)
+
+    def test_create_invalid(self):
+        response = self.client.post(reverse('events-list'), self.get_data(message=''))
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(self.buffer.depth(), 0)
+
+    def test_bulk(self):
+        response = self.client.post(reverse('events-bulk'), [self.get_data(), self.get_data()], format='json')
+        self.assertEquals(response.status_code, 202)
+        self.assertEquals([x['status'] for x in response.data['results']], [202, 202])
+
+        response = self.client.post(reverse('events-bulk'), [self.get_data(), self.get_data(message='')], format='json')
+        self.assertEquals(response.status_code, 207)
+        self.assertEquals([x['status'] for x in response.data['results']], [202, 400])
+
+        self.assertEquals(self.buffer.depth(), 3)
+        self.buffer.flush(10)
+        self.assertEquals(Event.objects.filter(customer=self.user).count(), 3)
+
+    def test_bulk_ndjson(self):
+        body = '\n'.join(json.dumps(self.get_data()) for _ in range(3))
+        response = self.client.post(reverse('events-bulk'), body, content_type='application/x-ndjson')
+        self.assertEquals(response.status_code, 202)
+        self.assertEquals(response.data, {'accepted': 3, 'rejected': 0, 'errors': []})
+        self.assertEquals(self.buffer.depth(), 3)
+
+    def test_buffer_full(self):
+        self.buffer.push(['1', '2'])
+        with self.settings(EVENTS_BUFFER_MAX_SIZE=2, EVENTS_BUFFER_RETRY_AFTER_IN_SECONDS=42):
+            response = self.client.post(reverse('events-list'), self.get_data())
+            self.assertEquals(response.status_code, 503)
+            self.assertEquals(response['Retry-After'], '42')
+
+            self.client.credentials(HTTP_AUTHORIZATION=self.authorization)  # Synchronous mode is not affected.
+            response = self.client.post(reverse('events-list'), self.get_data())
+            self.assertEquals(response.status_code, 201)
+
+        self.assertEquals(self.buffer.depth(), 2)
+
+    @override_settings(EVENTS_NDJSON_CHUNK_SIZE=2, EVENTS_BUFFER_MAX_SIZE=3, EVENTS_BUFFER_RETRY_AFTER_IN_SECONDS=42)
+    def test_buffer_full_ndjson(self):
+        body = '\n'.join(json.dumps(self.get_data(message='Event {}'.format(x))) for x in range(5))
+        response = self.client.post(reverse('events-bulk'), body, content_type='application/x-ndjson')
+
+        self.assertEquals(response.status_code, 503)
+        self.assertEquals(response['Retry-After'], '42')
+        self.assertEquals(response.data['accepted'], 4)  # The buffer was not full yet when the 2nd chunk came.
+        self.assertEquals(response.data['rejected'], 0)
+        self.assertEquals(self.buffer.depth(), 4)
+
+
+class RetentionPolicyAPITestCase(APITestCase):
+    def setUp(self):
+        super(RetentionPolicyAPITestCase, self).setUp()
+        self.policy = RetentionPolicy.objects.create(customer=self.user, days=365)
+        self.someone_else = RetentionPolicy.objects.create(customer=CustomerFactory.create(), days=30)
+
+    def test_list(self):
+        response = self.client.get(reverse('retention-policies-list'))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([x['id'] for x in response.data['results']], [str(self.policy.id)])
+        self.assertEquals(response.data['results'][0]['object_type'], '')
+        self.assertEquals(response.data['results'][0]['days'], 365)
+
+    def test_create(self):
+        response = self.client.post(reverse('retention-policies-list'), {'object_type': 'users.User', 'days': 30})
+        self.assertEquals(response.status_code, 201)
+
+        policy = RetentionPolicy.objects.get(id=response.data['id'])
+        self.assertEquals(policy.customer, self.user)
+        self.assertEquals(policy.object_type, 'users.User')
+        self.assertEquals(policy.days, 30)
+
+    def test_create_invalid(self):
+        response = self.client.post(reverse('retention-policies-list'), {'days': 30})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.data['object_type'], ['There is a retention policy for this object type already.'])
+
+        response = self.client.post(reverse('retention-policies-list'), {'object_type': 'users.User', 'days': 0})
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('days', response.data)
+
+    def test_update(self):
+        url = reverse('retention-policies-detail', kwargs={'pk': self.policy.pk})
+        response = self.client.patch(url, {'days': 90})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(RetentionPolicy.objects.get(id=self.policy.id).days, 90)
+
+        url = reverse('retention-policies-detail', kwargs={'pk': self.someone_else.pk})
+        self.assertEquals(self.client.patch(url, {'days': 90}).status_code, 404)
+
+    def test_delete(self):
+        url = reverse('retention-policies-detail', kwargs={'pk': self.policy.pk})
+        self.assertEquals(self.client.delete(url).status_code, 204)
+        self.assertFalse(RetentionPolicy.objects.filter(id=self.policy.id).exists())
+
+    def test_logged_out(self):
+        self.client.logout()
+        self.assertEquals(self.client.get(reverse('retention-policies-list')).status_code, 401)
+
+
+class EventArchiveAPITestCase(EventArchiveTestMixin, APITestCase):
+    def setUp(self):
+        super(EventArchiveAPITestCase, self).setUp()
+        self.events = [
+            EventFactory.create(
+                customer=self.user, timestamp=arrow.get('2016-01-01T12:00:00').replace(days=x * 10).datetime,
+                object_type='users.User' if x % 2 else 'orders.Order',
+            )
+            for x in range(8)
+        ]
+        self.events.reverse()  # Newest first.
+        list(EventArchiver(segment_size=2).archive(self.events[2].timestamp, [self.user, CustomerFactory.create()]))
+
+    def test_list(self):
+        response = self.client.get(reverse('events-list'))
+        self.assertEquals([x['id'] for x in response.data['results']], [str(x.id) for x in self.events[:3]])
+
+        ArchivedEventCursorPagination.page_size = 3
+        self.addCleanup(delattr, ArchivedEventCursorPagination, 'page_size')
+
+        ids, url, pages = [], reverse('events-list') + '?include_archived=1', 0
+        while url:
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            ids += [x['id'] for x in response.data['results']]
+            url, pages = response.data['next'], pages + 1
+        self.assertEquals(ids, [str(x.id) for x in self.events])
+        self.assertEquals(pages, 3)
+
+        # And back again.
+        response = self.client.get(response.data['previous'])
+        self.assertEquals([x['id'] for x in response.data['results']], [str(x.id) for x in self.events[3:6]])
+        response = self.client.get(response.data['previous'])
+        self.assertEquals([x['id'] for x in response.data['results']], [str(x.id) for x in self.events[:3]])
+        self.assertIsNone(response.data['previous'])
+
+    def test_list_filters(self):
+        response = self.client.get(reverse('events-list'), {
+            'include_archived': 'true', 'object_type': 'users.User', 'fields': 'id,object_type',
+        })
+        self.assertEquals(response.data['results'], [
+            {'id': str(x.id), 'object_type': 'users.User'} for x in self.events if x.object_type == 'users.User'
+        ])
+
+        response = self.client.get(reverse('events-list'), {
+            'include_archived': '1', 'timestamp__lt': self.events[2].timestamp.isoformat(),
+            'timestamp__gte': self.events[5].timestamp.isoformat(),
+        })
+        self.assertEquals([x['id'] for x in response.data['results']], [str(x.id) for x in self.events[3:6]])
+
+    def test_list_limit_offset(self):
+        response = self.client.get(reverse('events-list'), {'include_archived': '1', 'limit': 2})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.data, {'include_archived': ['Cannot be used along with limit, offset, ordering.']})
+
+    def test_export(self):
+        response = self.client.get(reverse('events-export'), {'include_archived': '1', 'object_type': 'orders.Order'})
+        rows = [json.loads(x) for x in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEquals([x['id'] for x in rows], [str(x.id) for x in self.events if x.object_type == 'orders.Order'])
+        self.assertEquals(arrow.get(rows[-1]['timestamp']), self.events[-1].timestamp)
+
+        response = self.client.get(reverse('events-export'))
+        self.assertEquals(len(b''.join(response.streaming_content).splitlines()), 3)
+
+    def test_archived_event_not_found(self):
+        response = self.client.get(reverse('events-detail', kwargs={'pk': self.events[-1].pk}))
+        self.assertEquals(response.status_code, 404)
+
+
+class EventMetadataFilterAPITestCase(EventArchiveTestMixin, APITestCase):
+    def setUp(self):
+        super(EventMetadataFilterAPITestCase, self).setUp()
+        timestamp = arrow.get('2016-01-01T12:00:00')
+        self.events = [
+            EventFactory.create(customer=self.user, metadata=metadata, timestamp=timestamp.replace(days=-x).datetime)
+            for x, metadata in enumerate([
+                {'order': {'status': 'paid'}, 'total': 10},
+                {'order': {'status': 'open'}, 'total': 10},
+                {'user': 'bart'},
+                None,
+            ])
+        ]
+        EventFactory.create(metadata={'order': {'status': 'paid'}})  # Someone else's.
+
+    def get_ids(self, data):
+        response = self.client.get(reverse('events-list'), data)
+        self.assertEquals(response.status_code, 200)
+        return [x['id'] for x in response.data['results']]
+
+    def test_list(self):
+        self.assertEquals(self.get_ids({'metadata__order__status': 'paid'}), [str(self.events[0].id)])
+        self.assertEquals(self.get_ids({'metadata__total': '10'}), [str(x.id) for x in self.events[:2]])
+        self.assertEquals(self.get_ids({'metadata__has_key': 'user'}), [str(self.events[2].id)])
+        self.assertEquals(self.get_ids({'metadata__has_key': 'user', 'metadata__total': '10'}), [])
+
+    def test_list_invalid_key(self):
+        for data in ({'metadata__or"der': 'paid'}, {'metadata__has_key': 'us\'er'}, {'metadata__order__': 'paid'}):
+            response = self.client.get(reverse('events-list'), data)
+            self.assertEquals(response.status_code, 400)
+            self.assertIn('metadata', response.data)
+
+    def test_list_archived(self):
+        list(EventArchiver().archive(self.events[0].timestamp, [self.user]))
+        self.assertEquals(Event.objects.filter(customer=self.user).count(), 1)
+
+        data = {'metadata__total': '10', 'include_archived': '1'}
+        self.assertEquals(self.get_ids(data), [str(x.id) for x in self.events[:2]])
+
+    def test_histogram(self):
+        response = self.client.get(reverse('events-histogram'), {'interval': '1d', 'metadata__total': '10'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([x['count'] for x in response.data['results']], [1, 1])
+
+
+@override_settings(EVENTS_THROTTLE_RATE=0.01, EVENTS_THROTTLE_BURST=3)
+class EventThrottlingAPITestCase(EventDataMixin, APITestCase):
+    def test_create(self):
+        for remaining in ('2', '1', '0'):
+            response = self.client.post(reverse('events-list'), self.get_data())
+            self.assertEquals(response.status_code, 201)
+            self.assertEquals(response['X-RateLimit-Limit'], '3')
+            self.assertEquals(response['X-RateLimit-Remaining'], remaining)
+
+        response = self.client.post(reverse('events-list'), self.get_data())
+        self.assertEquals(response.status_code, 429)
+        self.assertTrue(99 <= int(response['Retry-After']) <= 100)
+        self.assertEquals(response['X-RateLimit-Remaining'], '0')
+        self.assertEquals(Event.objects.count(), 3)
+
+    def test_create_invalid_is_free(self):
+        response = self.client.post(reverse('events-list'), self.get_data(message=''))
+        self.assertEquals(response.status_code, 400)
+        self.assertFalse(response.has_header('X-RateLimit-Limit'))
+
+    def test_create_idempotent_replay_is_free(self):
+        for _ in range(5):
+            response = self.client.post(reverse('events-list'), self.get_data(), HTTP_IDEMPOTENCY_KEY='key')
+            self.assertEquals(response.status_code, 201)
+        self.assertEquals(Event.objects.count(), 1)
+
+    def test_other_endpoints_are_not_throttled(self):
+        EventFactory.create_batch(5, customer=self.user)
+        for _ in range(5):
+            response = self.client.get(reverse('events-list'))
+            self.assertEquals(response.status_code, 200)
+            self.assertFalse(response.has_header('X-RateLimit-Limit'))
+
+    def test_bulk(self):
+        items = [self.get_data(), self.get_data(message=''), self.get_data()]
+        response = self.client.post(reverse('events-bulk'), items, format='json')
+        self.assertEquals(response.status_code, 207)
+        self.assertEquals(response['X-RateLimit-Remaining'], '1')  # Only valid items count.
+
+        response = self.client.post(reverse('events-bulk'), [self.get_data(), self.get_data()], format='json')
+        self.assertEquals(response.status_code, 429)
+        self.assertTrue(response.has_header('Retry-After'))
+        self.assertEquals(Event.objects.count(), 2)
+
+    def test_bulk_throttled_releases_idempotency_keys(self):
+        self.client.post(reverse('events-bulk'), [self.get_data()] * 3, format='json')
+        items = [self.get_data(idempotency_key='key')]
+        self.assertEquals(self.client.post(reverse('events-bulk'), items, format='json').status_code, 429)
+
+        with override_settings(EVENTS_THROTTLE_RATE=1000):
+            response = self.client.post(reverse('events-bulk'), items, format='json')
+        self.assertEquals(response.status_code, 201)
+
+    @override_settings(EVENTS_NDJSON_CHUNK_SIZE=2)
+    def test_bulk_ndjson(self):
+        body = '\n'.join(json.dumps(self.get_data(message='Event {}'.format(x))) for x in range(5))
+        response = self.client.post(reverse('events-bulk'), body, content_type='application/x-ndjson')
+
+        self.assertEquals(response.status_code, 429)
+        self.assertTrue(response.has_header('Retry-After'))
+        self.assertEquals(response.data['accepted'], 2)
+        self.assertEquals(response.data['rejected'], 0)
+        self.assertEquals(Event.objects.count(), 2)
+
+    @override_settings(EVENTS_THROTTLE_BURST=100, EVENTS_MONTHLY_QUOTA=3)
+    def test_quota(self):
+        response = self.client.post(reverse('events-bulk'), [self.get_data()] * 2, format='json')
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response['X-Quota-Limit'], '3')
+        self.assertEquals(response['X-Quota-Remaining'], '1')
+        self.assertTrue(response.has_header('X-Quota-Reset'))
+
+        response = self.client.post(reverse('events-bulk'), [self.get_data()] * 2, format='json')
+        self.assertEquals(response.status_code, 429)
+        self.assertEquals(response.data['detail'], 'Monthly events quota exceeded.')
+        self.assertEquals(response['X-Quota-Remaining'], '1')
+
+        response = self.client.post(reverse('events-list'), self.get_data())
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response['X-Quota-Remaining'], '0')
+        self.assertEquals(Event.objects.count(), 3)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime, timedelta
+import gzip
+import os
+import shutil
+import tempfile
+
+import pytz
+import six
+
+from django.core.management import call_command
+
+from main.archives import EventArchive, EventArchiver, merge_events
+from main.buffers import decode_event
+from main.conditional import get_events_version
+from main.managers import EventRollupManager
+from main.models import Event, EventArchiveSegment, EventRollup
+from main.tests.base import CustomerFactory, EventFactory, TestCase
+
+
+class EventArchiveTestMixin(object):
+    def setUp(self):
+        super(EventArchiveTestMixin, self).setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        settings_override = self.settings(EVENTS_ARCHIVE_STORAGE_OPTIONS={'location': path})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def read_segment(self, segment):
+        with EventArchiveSegment.get_storage().open(segment.path, 'rb') as f:
+            with gzip.GzipFile(fileobj=f, mode='rb') as archive:
+                return [decode_event(x.decode('utf-8')) for x in archive]
+
+
+class EventArchiverTestCase(EventArchiveTestMixin, TestCase):
+    def setUp(self):
+        super(EventArchiverTestCase, self).setUp()
+        self.customer = CustomerFactory.create()
+        self.events = [
+            EventFactory.create(customer=self.customer, timestamp=datetime(2016, month, day, tzinfo=pytz.utc))
+            for month, day in ((1, 10), (1, 20), (1, 30), (3, 5), (4, 1), (4, 15))
+        ]
+        self.someone_else = EventFactory.create(timestamp=datetime(2016, 1, 10, tzinfo=pytz.utc))
+        self.cutoff = datetime(2016, 4, 10, tzinfo=pytz.utc)
+
+    def test_archive(self):
+        version = get_events_version(self.customer.pk)
+        results = list(EventArchiver(segment_size=2).archive(self.cutoff, [self.customer]))
+
+        segments = [x[0] for x in results]
+        self.assertTrue(all(x[1] >= 0 for x in results))
+        self.assertEquals([x.events_count for x in segments], [2, 1, 1, 1])
+        self.assertEquals([x.path.split('/')[1] for x in segments], ['2016-01', '2016-01', '2016-03', '2016-04'])
+        self.assertTrue(all(x.path.startswith(str(self.customer.pk)) for x in segments))
+        self.assertTrue(all(x.path.endswith('.ndjson.gz') for x in segments))
+        self.assertEquals(set(EventArchiveSegment.objects.all()), set(segments))
+
+        first = segments[0]
+        self.assertEquals(first.start_timestamp, self.events[1].timestamp)
+        self.assertEquals(first.end_timestamp, self.events[2].timestamp)
+        self.assertEquals([x.id for x in self.read_segment(first)], [self.events[2].id, self.events[1].id])
+        self.assertEquals(self.read_segment(first)[0].message, self.events[2].message)
+
+        self.assertEquals(
+            set(Event.objects.values_list('id', flat=True)), set([self.events[-1].id, self.someone_else.id])
+        )
+        self.assertEquals(EventRollup.objects.filter(customer=self.customer, period='day').count(), 1)
+        self.assertNotEquals(get_events_version(self.customer.pk), version)
+
+    def test_archive_nothing(self):
+        self.assertEquals(list(EventArchiver().archive(datetime(2015, 1, 1, tzinfo=pytz.utc), [self.customer])), [])
+        self.assertEquals(Event.objects.count(), 7)
+
+    def test_archive_failure(self):
+        def remove_counts(manager, counts):
+            raise ValueError('Database is gone.')
+
+        self.addCleanup(setattr, EventRollupManager, 'remove_counts', EventRollupManager.__dict__['remove_counts'])
+        EventRollupManager.remove_counts = remove_counts
+
+        with self.assertRaises(ValueError):
+            list(EventArchiver().archive(self.cutoff, [self.customer]))
+
+        path = os.path.join(str(self.customer.pk), '2016-01')
+        self.assertEquals(EventArchiveSegment.get_storage().listdir(path), ([], []))  # File was removed.
+        self.assertEquals(EventArchiveSegment.objects.count(), 0)
+        self.assertEquals(Event.objects.count(), 7)
+
+    def test_delete(self):
+        segment = next(EventArchiver().archive(self.cutoff, [self.customer]))[0]
+        storage = EventArchiveSegment.get_storage()
+        self.assertTrue(storage.exists(segment.path))
+
+        self.customer.delete()
+        self.assertFalse(storage.exists(segment.path))
+        self.assertEquals(EventArchiveSegment.objects.count(), 0)
+
+    def test_command(self):
+        out = six.StringIO()
+        call_command('archive_events', days=1, customers=[self.customer.email], segment_size=2, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEquals(len(lines), 5)
+        self.assertIn('2 event(s) of {} archived into'.format(self.customer.email), lines[0])
+        self.assertEquals(lines[-1], '6 event(s) archived.')
+        self.assertEquals(list(Event.objects.all()), [self.someone_else])
+
+
+class EventArchiveTestCase(EventArchiveTestMixin, TestCase):
+    def setUp(self):
+        super(EventArchiveTestCase, self).setUp()
+        self.customer = CustomerFactory.create()
+        start = datetime(2016, 1, 1, tzinfo=pytz.utc)
+        self.events = [
+            EventFactory.create(
+                customer=self.customer, timestamp=start + timedelta(days=x * 10), object_type='users.User',
+                message='Event {}'.format(x),
+            )
+            for x in range(10)
+        ]
+        self.events.reverse()  # Newest first.
+
+        self.archiver = EventArchiver(segment_size=3)
+        list(self.archiver.archive(datetime(2017, 1, 1, tzinfo=pytz.utc), [self.customer]))
+
+    def test_iterate(self):
+        archive = EventArchive(self.customer, {})
+        self.assertEquals([x.id for x in archive.iterate()], [x.id for x in self.events])
+
+    def test_iterate_filters(self):
+        order = EventFactory.create(
+            customer=self.customer, timestamp=datetime(2016, 2, 1, tzinfo=pytz.utc), object_type='orders.Order',
+            message='Order paid',
+        )
+        list(self.archiver.archive(datetime(2017, 1, 1, tzinfo=pytz.utc), [self.customer]))
+
+        archive = EventArchive(self.customer, {'object_type': 'orders.Order'})
+        self.assertEquals(list(archive.iterate()), [order])
+
+        archive = EventArchive(self.customer, {'search': 'PAID, order'})
+        self.assertEquals(list(archive.iterate()), [order])
+
+        archive = EventArchive(self.customer, {'search': 'paid nothing'})
+        self.assertEquals(list(archive.iterate()), [])
+
+        archive = EventArchive(self.customer, {'search': 'aid'})  # Terms are word prefixes, as on events list.
+        self.assertEquals(list(archive.iterate()), [])
+
+        archive = EventArchive(self.customer, {
+            'timestamp__gte': self.events[5].timestamp, 'timestamp__lt': self.events[2].timestamp,
+        })
+        self.assertEquals(list(archive.iterate()), self.events[3:6])
+        self.assertEquals(len(archive.get_segments()), 2)
+
+        self.assertEquals(list(EventArchive(self.customer, None).iterate()), [])
+
+    def test_iterate_overlapping_segments(self):
+        late = EventFactory.create(customer=self.customer, timestamp=self.events[4].timestamp + timedelta(hours=1))
+        list(self.archiver.archive(datetime(2017, 1, 1, tzinfo=pytz.utc), [self.customer]))
+
+        archive = EventArchive(self.customer, {})
+        self.assertEquals(EventArchiveSegment.objects.count(), 6)
+        self.assertEquals(list(archive.iterate()), self.events[:4] + [late] + self.events[4:])
+
+    def test_fetch(self):
+        archive = EventArchive(self.customer, {})
+        position = (self.events[3].timestamp, self.events[3].id)
+
+        self.assertEquals(archive.fetch(None, False, 2), self.events[:2])
+        self.assertEquals(archive.fetch(None, True, 2), [])
+        self.assertEquals(archive.fetch(position, False, 4), self.events[4:8])
+        self.assertEquals(archive.fetch(position, False, 40), self.events[4:])
+        self.assertEquals(archive.fetch(position, True, 2), [self.events[1], self.events[2]][::-1])
+        self.assertEquals(archive.fetch(position, True, 20), self.events[:3][::-1])
+
+    def test_merge_events(self):
+        odd, even = self.events[1::2], self.events[::2]
+        self.assertEquals(list(merge_events(iter(odd), iter(even))), self.events)
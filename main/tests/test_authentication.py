@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import base64
+
+from rest_framework.authtoken.models import Token
+
+from django.contrib.auth.hashers import BasePasswordHasher
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from main.authentication import get_credentials_cache_key, get_password_fingerprint, get_token_cache_key
+from main.models import Customer
+from main.tests.base import APITestCase
+
+
+class CachedTokenAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        super(CachedTokenAuthenticationTestCase, self).setUp()
+        cache.clear()
+
+    def get_events(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('events-list'))
+        return response, [x['sql'] for x in context.captured_queries]
+
+    def test_cached(self):
+        response, queries = self.get_events()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(cache.get(get_token_cache_key(self.user.auth_token.key)), self.user.pk)
+        self.assertTrue(any('"authtoken_token"' in x for x in queries))
+
+        response, queries = self.get_events()
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse(any('"authtoken_token"' in x for x in queries))
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        response, _ = self.get_events()
+        self.assertEquals(response.status_code, 401)
+        self.assertIsNone(cache.get(get_token_cache_key('invalid')))
+
+    def test_token_deleted(self):
+        self.get_events()
+        self.user.auth_token.delete()
+
+        response, _ = self.get_events()
+        self.assertEquals(response.status_code, 401)
+
+    def test_token_rotated(self):
+        self.get_events()
+        self.user.auth_token.delete()
+        token = Token.objects.create(user=self.user)
+
+        response, _ = self.get_events()
+        self.assertEquals(response.status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(token.key))
+        response, _ = self.get_events()
+        self.assertEquals(response.status_code, 200)
+
+    def test_customer_changed(self):
+        self.get_events()
+        Customer.objects.filter(pk=self.user.pk).update(name='Sloth')  # No signals sent.
+
+        response = self.client.get(reverse('customers-detail', args=[self.user.pk]))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['name'], 'Sloth')
+
+    def test_customer_deleted(self):
+        self.get_events()
+        self.user.delete()
+
+        response, _ = self.get_events()
+        self.assertEquals(response.status_code, 401)
+
+
+class UnusableHasher(BasePasswordHasher):
+    algorithm = 'unusable'
+
+    def verify(self, password, encoded):
+        raise AssertionError('Password hasher must not be used.')
+
+
+class CachedBasicAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        super(CachedBasicAuthenticationTestCase, self).setUp()
+        cache.clear()
+        self.login(self.user.email, self.user_password)
+
+    def login(self, email, password):
+        credentials = base64.b64encode('{}:{}'.format(email, password).encode('utf-8')).decode('ascii')
+        self.client.credentials(HTTP_AUTHORIZATION='Basic {}'.format(credentials))
+
+    def get_events(self):
+        return self.client.get(reverse('events-list'))
+
+    def test_cached(self):
+        self.assertEquals(self.get_events().status_code, 200)
+
+        cache_key = get_credentials_cache_key(self.user.email, self.user_password)
+        self.assertNotIn(self.user.email, cache_key)
+        self.assertNotIn(self.user_password, cache_key)
+        self.assertEquals(cache.get(cache_key), (self.user.pk, get_password_fingerprint(self.user)))
+
+        with self.settings(PASSWORD_HASHERS=['main.tests.test_authentication.UnusableHasher']):
+            self.assertEquals(self.get_events().status_code, 200)
+
+    def test_wrong_password(self):
+        self.get_events()
+
+        self.login(self.user.email, 'wrong')
+        self.assertEquals(self.get_events().status_code, 401)
+
+        # Successful check is still there.
+        self.login(self.user.email, self.user_password)
+        self.assertEquals(self.get_events().status_code, 200)
+
+    def test_email_case(self):
+        self.get_events()
+
+        self.login(self.user.email.upper(), self.user_password)
+        self.assertEquals(self.get_events().status_code, 200)
+
+    def test_password_changed(self):
+        self.get_events()
+        self.user.set_password('new-sikret')
+        self.user.save()
+
+        self.assertEquals(self.get_events().status_code, 401)
+        self.login(self.user.email, 'new-sikret')
+        self.assertEquals(self.get_events().status_code, 200)
+
+    def test_password_changed_through_api(self):
+        self.get_events()
+        data = {
+            'email': self.user.email,
+            'password': self.user_password,
+            'new_password': 'new-sikret',
+        }
+        response = self.client.post(reverse('users-change-password'), data)
+        self.assertEquals(response.status_code, 200)
+
+        self.assertEquals(self.get_events().status_code, 401)
+
+    def test_email_changed(self):
+        self.get_events()
+        self.user.email = 'new@example.com'
+        self.user.save()
+
+        self.assertEquals(self.get_events().status_code, 401)
+        self.login('new@example.com', self.user_password)
+        self.assertEquals(self.get_events().status_code, 200)
+
+    def test_customer_changed(self):
+        self.get_events()
+        Customer.objects.filter(pk=self.user.pk).update(name='Sloth')  # No signals sent.
+
+        with self.settings(PASSWORD_HASHERS=['main.tests.test_authentication.UnusableHasher']):
+            response = self.client.get(reverse('customers-detail', args=[self.user.pk]))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['name'], 'Sloth')
+
+    def test_password_changed_without_signals(self):
+        self.get_events()
+        self.user.set_password('new-sikret')
+        Customer.objects.filter(pk=self.user.pk).update(password=self.user.password)
+
+        self.assertEquals(self.get_events().status_code, 401)
+
+    def test_customer_deleted(self):
+        self.get_events()
+        self.user.delete()
+
+        self.assertEquals(self.get_events().status_code, 401)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import json
+import os
+import tempfile
+
+import arrow
+import six
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import override_settings
+
+from main.buffers import SQLiteEventBuffer, decode_event, encode_event, get_event_buffer
+from main.models import Event
+from main.tests.base import CustomerFactory, EventFactory, TestCase
+
+
+class EventBufferTestMixin(object):
+    def setUp(self):
+        super(EventBufferTestMixin, self).setUp()
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        settings_override = self.settings(EVENTS_BUFFER_SQLITE_PATH=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.delete(settings.CACHE_PREFIX['EVENTS_BUFFER_STATS'])
+
+
+class EventCodecTestCase(TestCase):
+    def test_encode_decode(self):
+        for metadata in ({'order': {'status': 'paid'}, 'items': [1, 2]}, None):
+            event = EventFactory.build(
+                customer=CustomerFactory.create(), timestamp=arrow.get('2016-01-01T01:02:03.456789-03:00').datetime,
+                metadata=metadata,
+            )
+            decoded = decode_event(encode_event(event))
+
+            self.assertEquals(decoded.id, event.id)
+            self.assertEquals(decoded.customer_id, event.customer_id)
+            self.assertEquals(decoded.timestamp, event.timestamp)
+            self.assertEquals(decoded.timestamp.microsecond, 456789)
+            self.assertEquals(decoded.metadata, metadata)
+            self.assertEquals(decoded.message, event.message)
+            self.assertIsNone(decoded.created)
+
+
+class SQLiteEventBufferTestCase(EventBufferTestMixin, TestCase):
+    def setUp(self):
+        super(SQLiteEventBufferTestCase, self).setUp()
+        self.buffer = get_event_buffer()
+        self.customer = CustomerFactory.create()
+
+    def test_fifo(self):
+        self.assertIsInstance(self.buffer, SQLiteEventBuffer)
+        self.buffer.push(['1', '2'])
+        self.buffer.push(['3'])
+
+        self.assertEquals(self.buffer.depth(), 3)
+        self.assertEquals(self.buffer.peek(2), ['1', '2'])
+        self.buffer.ack(2)
+        self.assertEquals(self.buffer.peek(2), ['3'])
+        self.assertEquals(get_event_buffer().depth(), 1)  # Durable: seen by any other instance.
+
+    def test_is_full(self):
+        self.buffer.push(['1', '2'])
+        with self.settings(EVENTS_BUFFER_MAX_SIZE=3):
+            self.assertFalse(self.buffer.is_full())
+        with self.settings(EVENTS_BUFFER_MAX_SIZE=2):
+            self.assertTrue(self.buffer.is_full())
+
+    def test_flush(self):
+        events = [EventFactory.build(customer=self.customer) for _ in range(5)]
+        self.buffer.append(events)
+
+        self.assertEquals(self.buffer.flush(3), 3)
+        self.assertEquals(self.buffer.depth(), 2)
+        self.assertEquals(set(Event.objects.values_list('id', flat=True)), set(x.id for x in events[:3]))
+
+        self.assertEquals(self.buffer.flush(3), 2)
+        self.assertEquals(self.buffer.depth(), 0)
+        self.assertEquals(self.buffer.flush(3), 0)
+        self.assertEquals(Event.objects.count(), 5)
+
+        stats = self.buffer.get_stats()
+        self.assertEquals(stats['depth'], 0)
+        self.assertEquals(stats['last_flush_events'], 2)
+        self.assertEquals(stats['flushed_events'], 5)
+        self.assertGreaterEqual(stats['last_flush_seconds'], 0)
+
+    def test_flush_skips_inserted_and_orphans(self):
+        inserted = EventFactory.create(customer=self.customer)
+        orphan = EventFactory.build(customer=CustomerFactory.create())
+        event = EventFactory.build(customer=self.customer)
+        self.buffer.append([inserted, orphan, event])
+        orphan.customer.delete()
+
+        self.assertEquals(self.buffer.flush(10), 1)
+        self.assertEquals(self.buffer.depth(), 0)
+        self.assertEquals(set(Event.objects.values_list('id', flat=True)), set([inserted.id, event.id]))
+
+    @override_settings(EVENTS_BUFFER_MAX_ATTEMPTS=2)
+    def test_dead_letters(self):
+        events = [EventFactory.build(customer=self.customer) for _ in range(2)]
+        self.buffer.append(events[:1])
+        self.buffer.push(['{not an event'])
+        self.buffer.append(events[1:])
+
+        with self.assertRaises(ValueError):
+            self.buffer.flush(10)  # The first event makes it, the broken one is left on the buffer.
+        self.assertEquals(list(Event.objects.values_list('id', flat=True)), [events[0].id])
+        self.assertEquals(self.buffer.depth(), 2)
+
+        self.assertEquals(self.buffer.flush(10), 1)  # Second attempt: the broken one goes to dead letters.
+        self.assertEquals(Event.objects.count(), 2)
+        stats = self.buffer.get_stats()
+        self.assertEquals(stats['depth'], 0)
+        self.assertEquals(stats['dead_letters'], 1)
+
+        out = six.StringIO()
+        call_command('flush_event_buffer', requeue_dead_letters=True, stdout=out)
+        self.assertEquals(out.getvalue(), '1 event(s) requeued.\n')
+        self.assertEquals(self.buffer.peek(10), ['{not an event'])
+        self.assertEquals(self.buffer.dead_letters_depth(), 0)
+
+    def test_flushed_elsewhere(self):
+        with self.settings(EVENTS_BUFFER_FLUSHED_ELSEWHERE=True):
+            self.assertRaises(ImproperlyConfigured, get_event_buffer)
+
+    def test_command(self):
+        self.buffer.append([EventFactory.build(customer=self.customer) for _ in range(5)])
+
+        out = six.StringIO()
+        call_command('flush_event_buffer', batch_size=2, stdout=out)
+        self.assertEquals(out.getvalue(), '5 event(s) flushed.\n')
+        self.assertEquals(Event.objects.count(), 5)
+
+        out = six.StringIO()
+        call_command('flush_event_buffer', stats=True, stdout=out)
+        stats = json.loads(out.getvalue())
+        self.assertEquals(stats['depth'], 0)
+        self.assertEquals(stats['last_flush_events'], 1)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import uuid
+
+from rest_framework.exceptions import ValidationError
+
+from django.test import override_settings
+
+from main.idempotency import (
+    IdempotencyKeyInProgress, IdempotencyKeyReused, IdempotencyKeysExhausted, IdempotencyStore, pop_idempotency_key
+)
+from main.tests.base import TestCase
+
+
+class IdempotencyStoreTestCase(TestCase):
+    def setUp(self):
+        super(IdempotencyStoreTestCase, self).setUp()
+        self.store = IdempotencyStore(uuid.uuid4())
+        self.data = {'message': 'User signed up', 'metadata': {'a': 1, 'b': 2}}
+
+    def test_claim_save(self):
+        self.assertIsNone(self.store.claim('key', self.data))
+        with self.assertRaises(IdempotencyKeyInProgress):
+            self.store.claim('key', self.data)
+
+        self.store.save('key', self.data, {'status': 201, 'data': {'id': 42}})
+        self.assertEquals(self.store.claim('key', self.data), {'status': 201, 'data': {'id': 42}})
+        self.assertEquals(
+            self.store.claim('key', {'metadata': {'b': 2, 'a': 1}, 'message': 'User signed up'}),
+            {'status': 201, 'data': {'id': 42}}
+        )
+
+        with self.assertRaises(IdempotencyKeyReused):
+            self.store.claim('key', {'message': 'Something else'})
+
+    def test_per_customer(self):
+        self.store.save('key', self.data, {'status': 201, 'data': {'id': 42}})
+        self.assertIsNone(IdempotencyStore(uuid.uuid4()).claim('key', self.data))
+
+    def test_release(self):
+        self.assertIsNone(self.store.claim('key', self.data))
+        self.store.release('key')
+        self.assertIsNone(self.store.claim('key', self.data))
+
+    def test_invalid_key(self):
+        for key in ('', 'x' * 256, 123, ['key'], {'key': 1}, None, True):
+            with self.assertRaises(ValidationError):
+                self.store.claim(key, self.data)
+
+    @override_settings(EVENTS_IDEMPOTENCY_MAX_KEYS=2)
+    def test_bounded(self):
+        self.assertIsNone(self.store.claim('key-1', self.data))
+        self.assertIsNone(self.store.claim('key-2', self.data))
+        with self.assertRaises(IdempotencyKeysExhausted):
+            self.store.claim('key-3', self.data)
+
+        self.assertIsNone(IdempotencyStore(uuid.uuid4()).claim('key-3', self.data))
+        with self.assertRaises(IdempotencyKeysExhausted):
+            self.store.claim('key-3', self.data)  # Not remembered.
+
+    def test_pop_idempotency_key(self):
+        item = {'message': 'Hi', 'idempotency_key': 'key'}
+        self.assertEquals(pop_idempotency_key(item), ('key', {'message': 'Hi'}))
+        self.assertEquals(item, {'message': 'Hi', 'idempotency_key': 'key'})
+        self.assertEquals(pop_idempotency_key({'message': 'Hi'}), (None, {'message': 'Hi'}))
+        self.assertEquals(pop_idempotency_key('not a dict'), (None, 'not a dict'))
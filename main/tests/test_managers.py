@@ -1,8 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
+from datetime import timedelta
 
-from main.models import Customer
-from main.tests.base import TestCase
+import arrow
+import six
+
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.models import Customer, Event, EventRollup, OutgoingEmail
+from main.tests.base import CustomerFactory, EventFactory, TestCase
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise IOError('SMTP server is down')
 
 
 class CustomerManagerTestCase(TestCase):
@@ -27,3 +45,277 @@ class CustomerManagerTestCase(TestCase):
         self.assertTrue(user.check_password('supersikret42'))
         self.assertTrue(user.is_staff)
         self.assertTrue(user.is_superuser)
+
+
+class EventRollupManagerTestCase(TestCase):
+    def setUp(self):
+        super(EventRollupManagerTestCase, self).setUp()
+        self.customer = CustomerFactory.create()
+
+    def create_event(self, timestamp, object_type='users.User', **kwargs):
+        kwargs.setdefault('customer', self.customer)
+        return EventFactory.create(timestamp=arrow.get(timestamp).datetime, object_type=object_type, **kwargs)
+
+    def get_rollups(self, customer=None):
+        rollups = EventRollup.objects.filter(customer=customer or self.customer)
+        return {(x.period, arrow.get(x.period_start).isoformat(), x.object_type): x.total for x in rollups}
+
+    def test_create(self):
+        self.create_event('2016-01-01T01:30:00Z')
+        self.create_event('2016-01-01T01:45:00-03:00')
+        self.create_event('2016-01-01T01:50:00Z', object_type='orders.Order')
+
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-01T01:00:00+00:00', 'users.User'): 1,
+            ('hour', '2016-01-01T04:00:00+00:00', 'users.User'): 1,
+            ('hour', '2016-01-01T01:00:00+00:00', 'orders.Order'): 1,
+            ('day', '2016-01-01T00:00:00+00:00', 'users.User'): 2,
+            ('day', '2016-01-01T00:00:00+00:00', 'orders.Order'): 1,
+        })
+
+    def test_bulk_create(self):
+        Event.objects.bulk_create([
+            EventFactory.build(customer=self.customer, object_type='users.User', timestamp=arrow.get(x).datetime)
+            for x in ('2016-01-01T01:30:00Z', '2016-01-01T01:45:00Z', '2016-01-02T23:59:59Z')
+        ])
+
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-01T01:00:00+00:00', 'users.User'): 2,
+            ('hour', '2016-01-02T23:00:00+00:00', 'users.User'): 1,
+            ('day', '2016-01-01T00:00:00+00:00', 'users.User'): 2,
+            ('day', '2016-01-02T00:00:00+00:00', 'users.User'): 1,
+        })
+
+    def test_increment_counts(self):
+        self.create_event('2016-01-01T01:30:00Z')
+        counts = EventRollup.objects.get_counts([
+            EventFactory.build(customer=self.customer, object_type='users.User', timestamp=arrow.get(x).datetime)
+            for x in ('2016-01-01T01:45:00Z', '2016-01-01T02:15:00Z')
+        ])
+
+        with CaptureQueriesContext(connection) as context:
+            EventRollup.objects.increment_counts(counts)
+        writes = [x['sql'].split()[0] for x in context.captured_queries if 'SAVEPOINT' not in x['sql']]
+        self.assertEquals(sorted(writes), ['INSERT', 'UPDATE', 'UPDATE', 'UPDATE'])  # Only the 02:00 hour is new.
+
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-01T01:00:00+00:00', 'users.User'): 2,
+            ('hour', '2016-01-01T02:00:00+00:00', 'users.User'): 1,
+            ('day', '2016-01-01T00:00:00+00:00', 'users.User'): 3,
+        })
+
+    def test_update(self):
+        event = self.create_event('2016-01-01T01:30:00Z')
+        self.create_event('2016-01-01T01:45:00Z')
+
+        event.timestamp = arrow.get('2016-01-01T02:30:00Z').datetime
+        event.save()
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-01T01:00:00+00:00', 'users.User'): 1,
+            ('hour', '2016-01-01T02:00:00+00:00', 'users.User'): 1,
+            ('day', '2016-01-01T00:00:00+00:00', 'users.User'): 2,
+        })
+
+        event = Event.objects.get(id=event.id)
+        event.object_type = 'orders.Order'
+        event.save()
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-01T01:00:00+00:00', 'users.User'): 1,
+            ('hour', '2016-01-01T02:00:00+00:00', 'orders.Order'): 1,
+            ('day', '2016-01-01T00:00:00+00:00', 'users.User'): 1,
+            ('day', '2016-01-01T00:00:00+00:00', 'orders.Order'): 1,
+        })
+
+        event.message = 'Nothing counted has changed'
+        event.save()
+        self.assertEquals(len(self.get_rollups()), 4)
+
+    def test_delete(self):
+        event = self.create_event('2016-01-01T01:30:00Z')
+        self.create_event('2016-01-01T02:45:00Z')
+
+        event.delete()
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-01T02:00:00+00:00', 'users.User'): 1,
+            ('day', '2016-01-01T00:00:00+00:00', 'users.User'): 1,
+        })
+
+        Event.objects.filter(customer=self.customer).delete()
+        self.assertEquals(self.get_rollups(), {})
+
+    def test_update_deferred(self):
+        event = self.create_event('2016-01-01T01:30:00Z')
+
+        event = Event.objects.only('id', 'message').get(id=event.id)
+        event.timestamp = arrow.get('2016-01-02T02:30:00Z').datetime
+        event.save()
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-02T02:00:00+00:00', 'users.User'): 1,
+            ('day', '2016-01-02T00:00:00+00:00', 'users.User'): 1,
+        })
+
+        event = Event(id=event.id, customer=self.customer, object_type='orders.Order', timestamp=event.timestamp)
+        event._state.adding = False  # Never loaded from the database.
+        event.mark_clean()
+        event.save(update_fields=['object_type'])
+        self.assertEquals(self.get_rollups(), {
+            ('hour', '2016-01-02T02:00:00+00:00', 'orders.Order'): 1,
+            ('day', '2016-01-02T00:00:00+00:00', 'orders.Order'): 1,
+        })
+
+    def test_delete_in_bulk(self):
+        for x in range(5):
+            self.create_event('2016-01-01T0{}:30:00Z'.format(x))
+        self.create_event('2016-01-02T01:00:00Z', customer=CustomerFactory.create())
+
+        with CaptureQueriesContext(connection) as context:
+            deleted = Event.objects.filter(customer=self.customer).delete()
+        self.assertEquals(deleted, (5, {'main.Event': 5}))
+        self.assertEquals(self.get_rollups(), {})
+        self.assertEquals(Event.objects.count(), 1)
+
+        queries = [x['sql'] for x in context.captured_queries]
+        self.assertEquals(len([x for x in queries if x.startswith('DELETE FROM "main_event"')]), 1)
+        self.assertEquals([x for x in queries if x.startswith('SELECT "main_event"."id"')], [])  # Rows not loaded.
+
+    def test_customer_delete_is_fast(self):
+        for x in range(5):
+            self.create_event('2016-01-01T0{}:30:00Z'.format(x))
+
+        with CaptureQueriesContext(connection) as context:
+            self.customer.delete()
+        self.assertEquals(Event.objects.count(), 0)
+        self.assertEquals(EventRollup.objects.count(), 0)
+
+        queries = [x['sql'] for x in context.captured_queries]
+        self.assertEquals(len([x for x in queries if x.startswith('DELETE FROM "main_event"')]), 1)
+        self.assertEquals([x for x in queries if x.startswith('UPDATE "main_eventrollup"')], [])
+
+    def test_rebuild(self):
+        other = CustomerFactory.create()
+        self.create_event('2016-01-01T01:30:00Z')
+        self.create_event('2016-01-01T01:50:00Z', object_type='orders.Order')
+        self.create_event('2016-01-01T01:00:00Z', customer=other)
+        expected, expected_other = self.get_rollups(), self.get_rollups(other)
+
+        EventRollup.objects.update(total=42)
+        Event.objects.filter(object_type='orders.Order').update(timestamp=arrow.get('2016-01-03T10:00:00Z').datetime)
+        self.assertEquals(EventRollup.objects.rebuild(customers=[self.customer]), 4)
+
+        expected.pop(('hour', '2016-01-01T01:00:00+00:00', 'orders.Order'))
+        expected.pop(('day', '2016-01-01T00:00:00+00:00', 'orders.Order'))
+        expected[('hour', '2016-01-03T10:00:00+00:00', 'orders.Order')] = 1
+        expected[('day', '2016-01-03T00:00:00+00:00', 'orders.Order')] = 1
+        self.assertEquals(self.get_rollups(), expected)
+        self.assertEquals(self.get_rollups(other), {x: 42 for x in expected_other})
+
+        self.assertEquals(EventRollup.objects.rebuild(), 6)
+        self.assertEquals(self.get_rollups(other), expected_other)
+
+    def test_rebuild_command(self):
+        self.create_event('2016-01-01T01:30:00Z')
+        EventRollup.objects.all().delete()
+
+        out = six.StringIO()
+        call_command('rebuild_event_rollups', customers=[self.customer.email.upper()], stdout=out)
+        self.assertEquals(out.getvalue(), '2 event rollup(s) rebuilt.\n')
+        self.assertEquals(len(self.get_rollups()), 2)
+
+        with self.assertRaises(CommandError) as context:
+            call_command('rebuild_event_rollups', customers=['nobody@example.com'])
+        self.assertEquals(str(context.exception), 'Customer(s) not found: nobody@example.com.')
+
+
+class OutgoingEmailManagerTestCase(TestCase):
+    def setUp(self):
+        super(OutgoingEmailManagerTestCase, self).setUp()
+        OutgoingEmail.objects.all().delete()
+        mail.outbox = []
+
+    def test_enqueue(self):
+        email = OutgoingEmail.objects.enqueue('Hi', 'Hello there', 'sloth@example.com', body_html='<p>Hello there</p>')
+        self.assertEquals(email.status, OutgoingEmail.STATUS_PENDING)
+        self.assertEquals(email.attempts, 0)
+        self.assertEquals(len(mail.outbox), 0)
+
+    def test_send_queued(self):
+        OutgoingEmail.objects.enqueue('Hi', 'Hello there', 'sloth@example.com', body_html='<p>Hello there</p>')
+        OutgoingEmail.objects.enqueue('Hi again', 'Hello again', 'sloth@example.com')
+
+        emails = OutgoingEmail.objects.send_queued()
+        self.assertEquals(len(emails), 2)
+        self.assertEquals(len(mail.outbox), 2)
+        self.assertEquals(mail.outbox[0].subject, 'Hi')
+        self.assertEquals(mail.outbox[0].to, ['sloth@example.com'])
+        self.assertEquals(mail.outbox[0].alternatives, [('<p>Hello there</p>', 'text/html')])
+        self.assertEquals(mail.outbox[1].alternatives, [])
+        self.assertEquals(OutgoingEmail.objects.filter(status=OutgoingEmail.STATUS_SENT, attempts=1).count(), 2)
+
+        # Nothing left to be sent.
+        self.assertEquals(OutgoingEmail.objects.send_queued(), [])
+        self.assertEquals(len(mail.outbox), 2)
+
+    def test_send_queued_batch_size(self):
+        for i in range(3):
+            OutgoingEmail.objects.enqueue('Hi', 'Hello there', 'sloth@example.com')
+
+        self.assertEquals(len(OutgoingEmail.objects.send_queued(batch_size=2)), 2)
+        self.assertEquals(len(OutgoingEmail.objects.send_queued(batch_size=2)), 1)
+        self.assertEquals(len(mail.outbox), 3)
+
+    def test_send_queued_not_due(self):
+        email = OutgoingEmail.objects.enqueue('Hi', 'Hello there', 'sloth@example.com')
+        OutgoingEmail.objects.filter(id=email.id).update(send_after=timezone.now() + timedelta(minutes=1))
+
+        self.assertEquals(OutgoingEmail.objects.send_queued(), [])
+        self.assertEquals(len(mail.outbox), 0)
+
+    @override_settings(EMAIL_OUTBOX_CLAIM_TIMEOUT_IN_SECONDS=60)
+    def test_claim_pending_reclaims_abandoned(self):
+        email = OutgoingEmail.objects.enqueue('Hi', 'Hello there', 'sloth@example.com')
+        self.assertEquals(OutgoingEmail.objects.claim_pending(10), [email])
+        email.refresh_from_db()
+        self.assertEquals(email.status, OutgoingEmail.STATUS_SENDING)
+        self.assertIsNotNone(email.claimed_at)
+
+        # Its worker may still be sending it.
+        self.assertEquals(OutgoingEmail.objects.claim_pending(10), [])
+
+        # Its worker is gone.
+        OutgoingEmail.objects.filter(id=email.id).update(claimed_at=timezone.now() - timedelta(seconds=61))
+        self.assertEquals(len(OutgoingEmail.objects.send_queued()), 1)
+        email.refresh_from_db()
+        self.assertEquals(email.status, OutgoingEmail.STATUS_SENT)
+        self.assertEquals(len(mail.outbox), 1)
+
+    def test_claim_pending_reclaims_unleased(self):
+        email = OutgoingEmail.objects.enqueue('Hi', 'Hello there', 'sloth@example.com')
+        OutgoingEmail.objects.filter(id=email.id).update(status=OutgoingEmail.STATUS_SENDING, claimed_at=None)
+        self.assertEquals(OutgoingEmail.objects.claim_pending(10), [email])
+
+    @override_settings(
+        EMAIL_BACKEND='main.tests.test_managers.FailingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+        EMAIL_OUTBOX_RETRY_DELAY_IN_SECONDS=60,
+    )
+    def test_send_queued_retries(self):
+        email = OutgoingEmail.objects.enqueue('Hi', 'Hello there', 'sloth@example.com')
+
+        OutgoingEmail.objects.send_queued()
+        email.refresh_from_db()
+        self.assertEquals(email.status, OutgoingEmail.STATUS_PENDING)
+        self.assertEquals(email.attempts, 1)
+        self.assertEquals(email.last_error, 'SMTP server is down')
+        self.assertTrue(email.send_after > timezone.now() + timedelta(seconds=50))
+
+        # Backing off: not due yet.
+        self.assertEquals(OutgoingEmail.objects.send_queued(), [])
+
+        OutgoingEmail.objects.filter(id=email.id).update(send_after=timezone.now())
+        OutgoingEmail.objects.send_queued()
+        email.refresh_from_db()
+        self.assertEquals(email.status, OutgoingEmail.STATUS_FAILED)
+        self.assertEquals(email.attempts, 2)
+
+        # Given up.
+        OutgoingEmail.objects.filter(id=email.id).update(send_after=timezone.now())
+        self.assertEquals(OutgoingEmail.objects.send_queued(), [])
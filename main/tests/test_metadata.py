@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.db import connection
+from django.http import QueryDict
+from rest_framework.exceptions import ValidationError
+
+from main.metadata import (
+    PostgresEventMetadataIndex, get_event_metadata_index, get_metadata_filters, matches_metadata, parse_metadata_value
+)
+from main.models import Event
+from main.tests.base import CustomerFactory, EventFactory, TestCase
+
+
+class MetadataFiltersTestCase(TestCase):
+    def test_parse_value(self):
+        self.assertEquals(parse_metadata_value('paid'), ['paid'])
+        self.assertEquals(parse_metadata_value('3'), ['3', 3])
+        self.assertEquals(parse_metadata_value('1.5'), ['1.5', 1.5])
+        self.assertEquals(parse_metadata_value('true'), ['true', True])
+        self.assertEquals(parse_metadata_value('null'), ['null', None])
+        self.assertEquals(parse_metadata_value('"paid"'), ['"paid"'])
+        self.assertEquals(parse_metadata_value('{}'), ['{}'])
+
+    def test_get_filters(self):
+        query_params = QueryDict(
+            'metadata__order__status=paid&metadata__has_key=order&metadata__has_key=user&metadata__=1&search=x'
+        )
+        self.assertEquals(get_metadata_filters(query_params), {
+            'has_key': ['order', 'user'],
+            'exact': [(('order', 'status'), ['paid'])],
+        })
+        self.assertEquals(get_metadata_filters(QueryDict('object_type=x')), {})
+        self.assertEquals(get_metadata_filters(QueryDict('metadata__order.v2__x-y=1')), {
+            'exact': [(('order.v2', 'x-y'), ['1', 1])],
+        })
+
+    def test_get_filters_invalid_key(self):
+        for query_string in ('metadata__or"der=paid', 'metadata__has_key=a\'b', 'metadata__order__=paid'):
+            with self.assertRaises(ValidationError):
+                get_metadata_filters(QueryDict(query_string))
+
+    def test_matches(self):
+        metadata = {'order': {'status': 'paid', 'total': 10}, 'gift': False, 'note': None}
+
+        self.assertTrue(matches_metadata(metadata, {}))
+        self.assertTrue(matches_metadata(metadata, {'has_key': ['order', 'note']}))
+        self.assertFalse(matches_metadata(metadata, {'has_key': ['status']}))
+        self.assertTrue(matches_metadata(metadata, {'exact': [(('order', 'status'), ['paid'])]}))
+        self.assertTrue(matches_metadata(metadata, {'exact': [(('order', 'total'), ['10', 10])]}))
+        self.assertFalse(matches_metadata(metadata, {'exact': [(('order', 'total'), ['10'])]}))
+        self.assertTrue(matches_metadata(metadata, {'exact': [(('gift', ), ['false', False])]}))
+        self.assertFalse(matches_metadata(metadata, {'exact': [(('gift', ), ['0', 0])]}))
+        self.assertTrue(matches_metadata(metadata, {'exact': [(('note', ), ['null', None])]}))
+        self.assertFalse(matches_metadata(metadata, {'exact': [(('order', 'status', 'x'), ['paid'])]}))
+        self.assertFalse(matches_metadata(None, {'has_key': ['order']}))
+
+
+class EventMetadataIndexTestCase(TestCase):
+    def setUp(self):
+        super(EventMetadataIndexTestCase, self).setUp()
+        self.index = get_event_metadata_index(connection)
+        customer = CustomerFactory.create()
+        self.events = [
+            EventFactory.create(customer=customer, metadata=x) for x in (
+                {'order': {'status': 'paid', 'total': 10}, 'gift': True},
+                {'order': {'status': 'open', 'total': '10'}, 'gift': 1},
+                {'order': None, 'user': 'bart'},
+                [1, 2],
+                None,
+            )
+        ]
+
+    def filter(self, query_string):
+        filters = get_metadata_filters(QueryDict(query_string))
+        return set(self.index.filter(Event.objects.all(), filters))
+
+    def test_filter(self):
+        self.assertEquals(self.filter(''), set(self.events))
+        self.assertEquals(self.filter('metadata__order__status=paid'), set([self.events[0]]))
+        self.assertEquals(self.filter('metadata__order__total=10'), set(self.events[:2]))
+        self.assertEquals(self.filter('metadata__gift=true'), set([self.events[0]]))
+        self.assertEquals(self.filter('metadata__gift=1'), set([self.events[1]]))
+        self.assertEquals(self.filter('metadata__order=null'), set([self.events[2]]))
+        self.assertEquals(self.filter('metadata__has_key=order'), set(self.events[:3]))
+        self.assertEquals(self.filter('metadata__has_key=order&metadata__has_key=user'), set([self.events[2]]))
+        self.assertEquals(self.filter('metadata__order__status=paid&metadata__user=bart'), set())
+        self.assertEquals(self.filter('metadata__order__status=nope'), set())
+
+    def test_postgres_text_column(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('PostgreSQL only.')
+
+        index = PostgresEventMetadataIndex(connection)
+        for column_type in ('text', 'json'):
+            index.uninstall()
+            index.execute('ALTER TABLE main_event ALTER COLUMN metadata TYPE {}'.format(column_type))
+            index.convert_column()
+            index.execute(index.get_create_index_sql())
+            self.assertEquals(index.get_column_type(), 'jsonb')
+            self.assertEquals(self.filter('metadata__order__status=paid'), set([self.events[0]]))
+            self.assertEquals(self.filter('metadata__has_key=user'), set([self.events[2]]))
+
+    def test_postgres_create_index_sql(self):
+        index = PostgresEventMetadataIndex(connection)
+        self.assertEquals(
+            index.get_create_index_sql(concurrently=True),
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS main_event_metadata ON main_event USING GIN (metadata)'
+        )
+        self.assertEquals(
+            index.get_create_index_sql(),
+            'CREATE INDEX IF NOT EXISTS main_event_metadata ON main_event USING GIN (metadata)'
+        )
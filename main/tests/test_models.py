@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
-from datetime import datetime
+from datetime import datetime, timedelta
 
+import six
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from main.conditional import get_events_version
+from main.models import Customer, Event, EventRollup, OutgoingEmail, RetentionPolicy
 from main.tests.base import TestCase, CustomerFactory, EventFactory
 
 
@@ -20,8 +28,126 @@ class CustomerTestCase(TestCase):
         user = CustomerFactory.create(name='Filipe Waitman')
         self.assertEquals(user.get_short_name(), 'Filipe Waitman')
 
+    def test_save_does_not_query_old_instance(self):
+        user = Customer.objects.get(id=CustomerFactory.create().id)
+        user.name = 'Sloth'
+
+        with CaptureQueriesContext(connection) as context:
+            user.save()
+
+        # Only the uniqueness checks from full_clean - the customer itself is not fetched again.
+        queries = [x['sql'] for x in context.captured_queries]
+        self.assertEquals([x for x in queries if x.startswith('SELECT "main_customer"."password"')], [])
+
+    def test_save_email_changed(self):
+        user = CustomerFactory.create()
+        Customer.objects.filter(id=user.id).update(email_verified=True)
+        user = Customer.objects.get(id=user.id)
+        OutgoingEmail.objects.all().delete()
+
+        user.name = 'Sloth'
+        user.save()
+        self.assertTrue(user.email_verified)
+        self.assertEquals(OutgoingEmail.objects.count(), 0)
+
+        user.email = 'new@example.com'
+        user.save()
+        self.assertFalse(user.email_verified)
+        self.assertEquals(OutgoingEmail.objects.get().to, 'new@example.com')
+
+        user.save()  # Nothing changed since last save.
+        self.assertEquals(OutgoingEmail.objects.count(), 1)
+
+    def test_save_failed(self):
+        CustomerFactory.create(email='taken@example.com')
+        user = CustomerFactory.create()
+        OutgoingEmail.objects.all().delete()
+
+        user.email = 'taken@example.com'
+        with self.assertRaises(ValidationError):
+            user.save()
+        self.assertEquals(OutgoingEmail.objects.count(), 0)
+
+        with self.assertRaises(ValidationError):
+            CustomerFactory.create(email='taken@example.com')
+        self.assertEquals(OutgoingEmail.objects.count(), 0)
+
+
+class ModelBaseTestCase(TestCase):
+    def test_new_instance(self):
+        event = EventFactory.build()
+        self.assertTrue(event.has_changed('message'))
+        self.assertIn('message', event.changed_fields)
+        self.assertIsNone(event.get_loaded_value('message'))
+
+    def test_loaded_instance(self):
+        event = Event.objects.get(id=EventFactory.create(message='Hi').id)
+        self.assertFalse(event.has_changed('message'))
+        self.assertEquals(event.changed_fields, [])
+
+        event.message = 'Hello'
+        event.customer = CustomerFactory.create()
+        self.assertTrue(event.has_changed('message'))
+        self.assertEquals(event.get_loaded_value('message'), 'Hi')
+        self.assertEquals(set(event.changed_fields), {'customer', 'message'})
+
+        event.message = 'Hi'
+        self.assertFalse(event.has_changed('message'))
+
+    def test_saved_instance(self):
+        event = EventFactory.create(message='Hi')
+        self.assertEquals(event.changed_fields, [])
+
+        event.message = 'Hello'
+        event.save()
+        self.assertEquals(event.changed_fields, [])
+        self.assertEquals(event.get_loaded_value('message'), 'Hello')
+
+    def test_refreshed_instance(self):
+        event = EventFactory.create(message='Hi')
+        Event.objects.filter(id=event.id).update(message='Hello')
+
+        event.refresh_from_db()
+        self.assertEquals(event.changed_fields, [])
+        self.assertEquals(event.get_loaded_value('message'), 'Hello')
+
+    def test_deferred_fields(self):
+        event = Event.objects.only('id').get(id=EventFactory.create().id)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEquals(event.changed_fields, [])
+        self.assertEquals(len(context.captured_queries), 0)
+
+        event.message = 'Hello'
+        self.assertEquals(event.changed_fields, ['message'])
+
+    def test_load_deferred_field(self):
+        event = Event.objects.only('id').get(id=EventFactory.create(message='Hi').id)
+        event.timestamp = timezone.now()
+        event.object_type  # Loads it from the database.
+        self.assertTrue(event.has_changed('timestamp'))
+        self.assertFalse(event.has_changed('object_type'))
+
+        event = Event.objects.defer('metadata').get(id=event.id)
+        event.message = 'Hello'
+        event.metadata
+        self.assertTrue(event.has_changed('message'))
+        self.assertEquals(event.get_loaded_value('message'), 'Hi')
+        self.assertEquals(event.changed_fields, ['message'])
+
 
 class EventTestCase(TestCase):
+    def test_full_clean_on_save(self):
+        event = EventFactory.build(customer=CustomerFactory.create(), message='')
+        self.assertRaises(ValidationError, event.save)
+
+    def test_mark_clean(self):
+        event = EventFactory.build(customer=CustomerFactory.create(), message='')
+        event.mark_clean()
+        event.save()  # No full_clean here.
+
+        self.assertRaises(ValidationError, event.save)  # Trusted for a single save only.
+
     def test_representation(self):
         now = timezone.make_aware(datetime.now())
         event = EventFactory.create(
@@ -34,3 +160,103 @@ class EventTestCase(TestCase):
             '{}'.format(event),
             'users.models.User/abcd-efgh at {}: User signed up'.format(now.isoformat().replace('T', ' '))
         )
+
+    def test_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Event._meta.db_table)
+        indexes = [x['columns'] for x in constraints.values() if x['index'] and not x['unique']]
+
+        self.assertIn(['customer_id', 'timestamp'], indexes)
+        self.assertIn(['customer_id', 'object_type', 'object_id', 'timestamp'], indexes)
+        self.assertIn(['customer_id', 'human_identifier', 'timestamp'], indexes)
+
+        for column in ('customer_id', 'object_type', 'object_id', 'human_identifier', 'timestamp'):
+            self.assertNotIn([column], indexes)
+
+
+class RetentionPolicyTestCase(TestCase):
+    def setUp(self):
+        super(RetentionPolicyTestCase, self).setUp()
+        self.now = timezone.now()
+        self.customer = CustomerFactory.create()
+        self.events = {}
+        for object_type in ('users.User', 'orders.Order', 'carts.Cart'):
+            for days_ago in (1, 10, 100):
+                self.events[(object_type, days_ago)] = EventFactory.create(
+                    customer=self.customer, object_type=object_type, timestamp=self.now - timedelta(days=days_ago)
+                )
+        self.someone_else = EventFactory.create(timestamp=self.now - timedelta(days=100))
+
+    def get_remaining(self):
+        return set((x.object_type, (self.now - x.timestamp).days) for x in Event.objects.filter(customer=self.customer))
+
+    def test_expired_events(self):
+        default = RetentionPolicy.objects.create(customer=self.customer, days=50)
+        orders = RetentionPolicy.objects.create(customer=self.customer, object_type='orders.Order', days=5)
+        RetentionPolicy.objects.create(customer=self.customer, object_type='users.User', days=500)
+
+        self.assertEquals(
+            set(orders.get_expired_events(self.now)),
+            set([self.events[('orders.Order', 10)], self.events[('orders.Order', 100)]])
+        )
+        self.assertEquals(set(default.get_expired_events(self.now)), set([self.events[('carts.Cart', 100)]]))
+
+    def test_purge(self):
+        policy = RetentionPolicy.objects.create(customer=self.customer, days=5)
+        version = get_events_version(self.customer.pk)
+
+        chunks = list(policy.purge(chunk_size=4, now=self.now))
+        self.assertEquals([x[0] for x in chunks], [4, 2])
+        self.assertTrue(all(x[1] >= 0 for x in chunks))
+
+        self.assertEquals(self.get_remaining(), set([('users.User', 1), ('orders.Order', 1), ('carts.Cart', 1)]))
+        self.assertTrue(Event.objects.filter(id=self.someone_else.id).exists())
+        self.assertEquals(
+            sum(EventRollup.objects.filter(customer=self.customer, period='day').values_list('total', flat=True)), 3
+        )
+        self.assertNotEquals(get_events_version(self.customer.pk), version)
+
+        self.assertEquals(list(policy.purge(chunk_size=4, now=self.now)), [])
+
+    def test_purge_chunk_queries(self):
+        policy = RetentionPolicy.objects.create(customer=self.customer, object_type='users.User', days=5)
+        with CaptureQueriesContext(connection) as context:
+            list(policy.purge(chunk_size=1, now=self.now))
+
+        deletes = [x['sql'] for x in context.captured_queries if x['sql'].startswith('DELETE FROM "main_event"')]
+        self.assertEquals(len(deletes), 2)
+
+        # Paged on the (timestamp, id) keyset, not on primary key order.
+        selects = [x['sql'] for x in context.captured_queries if x['sql'].startswith('SELECT "main_event"."id"')]
+        self.assertTrue(all('ORDER BY "main_event"."timestamp" ASC, "main_event"."id" ASC' in x for x in selects))
+        self.assertIn('"main_event"."timestamp" > ', selects[-1])
+        self.assertEquals(self.get_remaining() & set([('users.User', 10), ('users.User', 100)]), set())
+
+    def test_purge_same_timestamp(self):
+        timestamp = self.now - timedelta(days=20)
+        EventFactory.create_batch(3, customer=self.customer, object_type='users.User', timestamp=timestamp)
+        policy = RetentionPolicy.objects.create(customer=self.customer, object_type='users.User', days=5)
+
+        self.assertEquals([x[0] for x in policy.purge(chunk_size=2, now=self.now)], [2, 2, 1])
+        self.assertEquals(Event.objects.filter(customer=self.customer, object_type='users.User').count(), 1)
+
+    def test_command(self):
+        RetentionPolicy.objects.create(customer=self.customer, object_type='orders.Order', days=5)
+        RetentionPolicy.objects.create(customer=self.customer, days=50)
+
+        out = six.StringIO()
+        call_command('purge_events', chunk_size=1, pause=0, stdout=out)
+        lines = out.getvalue().splitlines()
+
+        self.assertEquals(len(lines), 5)
+        self.assertTrue(lines[0].startswith('1 event(s) of {} purged (Default: 50 days) in '.format(
+            self.customer.email
+        )))
+        self.assertTrue(lines[2].startswith('1 event(s) of {} purged (orders.Order: 5 days) in '.format(
+            self.customer.email
+        )))
+        self.assertEquals(lines[4], '4 event(s) purged.')
+        self.assertEquals(
+            self.get_remaining(),
+            set([('users.User', 1), ('users.User', 10), ('orders.Order', 1), ('carts.Cart', 1), ('carts.Cart', 10)])
+        )
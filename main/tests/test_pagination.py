@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import timedelta
+
+import arrow
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from main.models import Event
+from main.pagination import EventCursorPagination
+from main.tests.base import TestCase, CustomerFactory, EventFactory
+
+
+class EventCursorPaginationTestCase(TestCase):
+    def setUp(self):
+        super(EventCursorPaginationTestCase, self).setUp()
+        self.customer = CustomerFactory.create()
+        self.factory = APIRequestFactory()
+
+        timestamp = arrow.get('2016-01-01T12:13:14').datetime
+        for x in range(4):
+            EventFactory.create(customer=self.customer, timestamp=timestamp)  # Ties must be broken by id.
+            EventFactory.create(customer=self.customer, timestamp=timestamp - timedelta(days=x + 1))
+        EventFactory.create()  # Someone else's.
+
+        self.queryset = Event.objects.filter(customer=self.customer)
+        self.expected = list(self.queryset.order_by('-timestamp', '-id'))
+
+    def paginate(self, url):
+        paginator = EventCursorPagination()
+        paginator.page_size = 3
+        page = paginator.paginate_queryset(self.queryset, Request(self.factory.get(url)))
+        return page, paginator.get_next_link(), paginator.get_previous_link()
+
+    def test_forward(self):
+        seen = []
+        url = '/api/events'
+        while url:
+            page, url, _ = self.paginate(url)
+            seen.extend(page)
+
+        self.assertEquals(seen, self.expected)
+
+    def test_backward(self):
+        page, next_url, previous_url = self.paginate('/api/events')
+        self.assertEquals(previous_url, None)
+
+        page, next_url, previous_url = self.paginate(next_url)
+        self.assertEquals(page, self.expected[3:6])
+
+        page, next_url, previous_url = self.paginate(next_url)
+        self.assertEquals(page, self.expected[6:])
+        self.assertEquals(next_url, None)
+
+        page, next_url, previous_url = self.paginate(previous_url)
+        self.assertEquals(page, self.expected[3:6])
+
+        page, next_url, previous_url = self.paginate(previous_url)
+        self.assertEquals(page, self.expected[:3])
+        self.assertEquals(previous_url, None)
+        self.assertEquals(self.paginate(next_url)[0], self.expected[3:6])
+
+    def test_no_count_query(self):
+        with self.assertNumQueries(1):
+            self.paginate('/api/events')
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(NotFound):
+            self.paginate('/api/events?cursor=invalid')
+
+        paginator = EventCursorPagination()
+        with self.assertRaises(NotFound):
+            paginator.decode_position('2016-01-01T12:13:14|invalid')
+        with self.assertRaises(NotFound):
+            paginator.decode_position('invalid')
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime
+
+import pytz
+import six
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+
+from main.metadata import get_event_metadata_index
+from main.models import Event
+from main.partitions import EventPartitions, add_months, month_range
+from main.search import EVENT_TABLE, get_event_search
+from main.tests.base import CustomerFactory, EventFactory, TestCase
+
+
+class PartitionsUtilsTestCase(TestCase):
+    def test_add_months(self):
+        month = datetime(2016, 11, 1, tzinfo=pytz.utc)
+        self.assertEquals(add_months(month, 1), datetime(2016, 12, 1, tzinfo=pytz.utc))
+        self.assertEquals(add_months(month, 2), datetime(2017, 1, 1, tzinfo=pytz.utc))
+        self.assertEquals(add_months(month, 14), datetime(2018, 1, 1, tzinfo=pytz.utc))
+        self.assertEquals(add_months(month, -11), datetime(2015, 12, 1, tzinfo=pytz.utc))
+
+    def test_month_range(self):
+        start = datetime(2016, 11, 20, 12, 12, 12, tzinfo=pytz.utc)
+        end = datetime(2017, 2, 1, tzinfo=pytz.utc)
+        self.assertEquals(list(month_range(start, end)), [
+            datetime(2016, 11, 1, tzinfo=pytz.utc),
+            datetime(2016, 12, 1, tzinfo=pytz.utc),
+            datetime(2017, 1, 1, tzinfo=pytz.utc),
+            datetime(2017, 2, 1, tzinfo=pytz.utc),
+        ])
+
+    def test_partition_name(self):
+        partitions = EventPartitions(connection)
+        self.assertEquals(partitions.get_partition_name(datetime(2016, 1, 1)), 'main_event_y2016m01')
+
+    def test_command_not_supported(self):
+        if EventPartitions(connection).is_supported():
+            self.skipTest('Partitioned storage is supported on this database.')
+
+        with self.assertRaises(CommandError):
+            call_command('event_partitions')
+
+
+class EventPartitionsTestCase(TestCase):
+    def setUp(self):
+        super(EventPartitionsTestCase, self).setUp()
+        self.partitions = EventPartitions(connection)
+        if not self.partitions.is_supported():
+            self.skipTest('Partitioned storage requires PostgreSQL 13+.')
+
+        self.now = datetime.now(pytz.utc)
+        self.customer = CustomerFactory.create()
+        self.events = [
+            EventFactory.create(customer=self.customer, timestamp=add_months(self.now, x), message='Event {}'.format(x))
+            for x in (-14, -1, 0)
+        ]
+
+    def count(self, table):
+        return self.partitions.fetchall('SELECT count(*) FROM {}'.format(table))[0][0]
+
+    def convert(self):
+        out = six.StringIO()
+        call_command('event_partitions', convert=True, months_ahead=1, stdout=out)
+        return out.getvalue()
+
+    def test_convert(self):
+        self.assertFalse(self.partitions.is_partitioned())
+        self.assertIn('Events table converted into a partitioned one.', self.convert())
+        self.assertTrue(self.partitions.is_partitioned())
+
+        partitions = self.partitions.get_partitions()
+        self.assertIn(self.partitions.default_partition, partitions)
+        for month in month_range(add_months(self.now, -14), add_months(self.now, 1)):
+            self.assertIn(self.partitions.get_partition_name(month), partitions)
+
+        self.assertEquals(set(Event.objects.values_list('id', flat=True)), set(x.id for x in self.events))
+        self.assertEquals(self.count(self.partitions.get_partition_name(add_months(self.now, -14))), 1)
+        self.assertEquals(self.count(self.partitions.default_partition), 0)
+
+        # Indexes, search and metadata filters keep working.
+        indexes = self.partitions.fetchall('SELECT indexname FROM pg_indexes WHERE tablename = %s', [EVENT_TABLE])
+        self.assertIn('{}_metadata'.format(EVENT_TABLE), [x[0] for x in indexes])
+        event = EventFactory.create(customer=self.customer, message='Brand new partitioned event')
+        self.assertEquals(list(get_event_search(connection).filter(Event.objects.all(), ['partitioned'])), [event])
+
+        with self.assertRaises(CommandError):
+            self.convert()
+
+    def test_metadata_index_install(self):
+        # Metadata index migration running on a table partitioned already: no CONCURRENTLY there.
+        self.convert()
+        index = get_event_metadata_index(connection)
+        index.uninstall()
+        index.install()
+        index.install()  # Nothing to do.
+
+        indexes = self.partitions.fetchall('SELECT indexname FROM pg_indexes WHERE tablename = %s', [EVENT_TABLE])
+        self.assertIn(index.index_name, [x[0] for x in indexes])
+
+    def test_create_partitions_moves_default_rows(self):
+        self.convert()
+        month = add_months(self.now, 6)
+        early = EventFactory.create(customer=self.customer, timestamp=month)
+        self.assertEquals(self.count(self.partitions.default_partition), 1)
+
+        created = self.partitions.create_partitions(self.now, month)
+        self.assertEquals(created[-1], self.partitions.get_partition_name(month))
+        self.assertEquals(self.count(self.partitions.default_partition), 0)
+        self.assertEquals(self.count(created[-1]), 1)
+        self.assertIn(self.partitions.default_partition, self.partitions.get_partitions())
+        self.assertEquals(Event.objects.get(id=early.id).timestamp, early.timestamp)
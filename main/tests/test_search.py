@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.utils.six import StringIO
+
+from main.models import Event
+from main.search import get_event_search
+from main.tests.base import TestCase, CustomerFactory, EventFactory
+
+
+class EventSearchTestCase(TestCase):
+    def setUp(self):
+        super(EventSearchTestCase, self).setUp()
+        self.customer = CustomerFactory.create()
+        self.event = EventFactory.create(
+            customer=self.customer,
+            object_type='users.models.User',
+            object_id='abcd-efgh',
+            human_identifier='Bart Simpson',
+            message='User signed up',
+            metadata={'plan': 'enterprise'},
+        )
+        self.search = get_event_search(connection)
+
+    def search_ids(self, *terms):
+        queryset = Event.objects.filter(customer=self.customer)
+        return set(self.search.filter(queryset, terms).values_list('id', flat=True))
+
+    def test_fields(self):
+        self.assertEquals(self.search_ids('signed'), {self.event.id})
+        self.assertEquals(self.search_ids('users'), {self.event.id})
+        self.assertEquals(self.search_ids('efgh'), {self.event.id})
+        self.assertEquals(self.search_ids('simpson'), {self.event.id})
+        self.assertEquals(self.search_ids('homer'), set())
+
+    def test_prefix(self):
+        self.assertEquals(self.search_ids('sig'), {self.event.id})
+        self.assertEquals(self.search_ids('Simp'), {self.event.id})
+
+    def test_all_terms_required(self):
+        self.assertEquals(self.search_ids('bart', 'signed'), {self.event.id})
+        self.assertEquals(self.search_ids('bart', 'homer'), set())
+
+    def test_punctuation(self):
+        self.assertEquals(self.search_ids('"bart'), {self.event.id})
+        self.assertEquals(self.search_ids("bart'"), {self.event.id})
+
+    def test_matches(self):
+        # Events out of events table (e.g. archived ones) are matched just like the index does.
+        for terms in [
+            ('signed', ), ('sig', ), ('igned', ), ('Simp', ), ('users.models', ), ('bart', 'signed'), ('bart', 'homer'),
+            ('"bart', ), ('efgh', ), ('fgh', ), ('enterprise', ),
+        ]:
+            self.assertEquals(self.search.matches(self.event, terms), bool(self.search_ids(*terms)), terms)
+
+    def test_update(self):
+        self.event.message = 'User got mad'
+        self.event.save()
+
+        self.assertEquals(self.search_ids('signed'), set())
+        self.assertEquals(self.search_ids('mad'), {self.event.id})
+
+    def test_delete(self):
+        self.event.delete()
+        self.assertEquals(self.search_ids('signed'), set())
+
+    def test_bulk_create(self):
+        event = EventFactory.build(customer=self.customer, message='Bulk inserted')
+        Event.objects.bulk_create([event])
+        self.assertEquals(self.search_ids('bulk'), {event.id})
+
+    def test_metadata(self):
+        self.assertEquals(self.search_ids('enterprise'), set())
+
+        search = get_event_search(connection, include_metadata=True)
+        search.install_triggers()
+        search.rebuild()
+        self.assertEquals(self.search_ids('enterprise'), {self.event.id})
+
+        event = EventFactory.create(customer=self.customer, metadata={'plan': 'enterprise'})
+        self.assertEquals(self.search_ids('enterprise'), {self.event.id, event.id})
+
+    @override_settings(EVENTS_SEARCH_INCLUDE_METADATA=True)
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command('rebuild_event_search', stdout=out)
+
+        self.assertEquals(self.search_ids('enterprise'), {self.event.id})
+        self.assertIn('metadata included: True', out.getvalue())
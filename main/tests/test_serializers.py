@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime
+
+import pytz
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from main.serializers import CompiledSerializer, EventSerializer
+from main.tests.base import TestCase, CustomerFactory, EventFactory
+
+
+class CompiledSerializerTestCase(TestCase):
+    def setUp(self):
+        super(CompiledSerializerTestCase, self).setUp()
+        customer = CustomerFactory.create()
+        self.events = [
+            EventFactory.create(customer=customer),
+            EventFactory.create(customer=customer, metadata={'a': 1, 'b': [1, 2, 'ç']}),
+            EventFactory.create(
+                customer=customer, message='Olá', timestamp=datetime(2016, 1, 2, 3, 4, 5, 6789, tzinfo=pytz.utc)
+            ),
+            EventFactory.create(
+                customer=customer, timestamp=pytz.timezone('America/Sao_Paulo').localize(datetime(2016, 1, 2, 3, 4))
+            ),
+        ]
+
+    def get_request(self, query_string=''):
+        return Request(APIRequestFactory().get('/api/events/?{}'.format(query_string)))
+
+    def assertSameRepresentation(self, query_string=''):
+        request = self.get_request(query_string)
+        expected = EventSerializer(self.events, many=True, context={'request': request}).data
+        compiled = CompiledSerializer.for_request(EventSerializer, request)
+        self.assertEquals(compiled.to_representation_many(self.events), list(expected))
+
+    def test_representation(self):
+        self.assertSameRepresentation()
+
+    def test_representation_fields(self):
+        self.assertSameRepresentation('fields=id,timestamp,metadata')
+        self.assertSameRepresentation('fields=message')
+        self.assertSameRepresentation('fields=unknown')
+
+    def test_representation_exclude(self):
+        self.assertSameRepresentation('exclude=metadata,created')
+        self.assertSameRepresentation('exclude=unknown')
+
+    def test_fields_and_exclude(self):
+        request = self.get_request('fields=id&exclude=metadata')
+        self.assertRaises(serializers.ValidationError, CompiledSerializer.for_request, EventSerializer, request)
+
+    def test_memoized(self):
+        compiled = CompiledSerializer.for_request(EventSerializer, self.get_request('fields=id,message'))
+        self.assertIs(CompiledSerializer.for_request(EventSerializer, self.get_request('fields=message,id')), compiled)
+        self.assertIs(CompiledSerializer.for_request(EventSerializer, self.get_request('exclude=')), (
+            CompiledSerializer.for_request(EventSerializer, self.get_request())
+        ))
+        self.assertIsNot(CompiledSerializer.for_request(EventSerializer, self.get_request('fields=id')), compiled)
+
+    def test_default_exclude(self):
+        compiled = CompiledSerializer.for_request(EventSerializer, self.get_request(), default_exclude=['metadata'])
+        self.assertNotIn('metadata', compiled.to_representation(self.events[0]))
+        self.assertNotIn('metadata', compiled.model_field_names)
+
+        request = self.get_request('exclude=message')
+        compiled = CompiledSerializer.for_request(EventSerializer, request, default_exclude=['metadata'])
+        self.assertEquals(set(compiled.to_representation(self.events[0])), {
+            'id', 'created', 'modified', 'object_id', 'object_type', 'human_identifier', 'timestamp',
+        })
+
+        request = self.get_request('fields=id,metadata')
+        compiled = CompiledSerializer.for_request(EventSerializer, request, default_exclude=['metadata'])
+        self.assertEquals(compiled.model_field_names, ('id', 'metadata'))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime
+import uuid
+
+import pytz
+
+from django.test import override_settings
+
+from main.throttling import CacheTokenBucket, EventsQuota, EventsQuotaExceeded, EventsThrottled, IngestionLimits
+from main.tests.base import TestCase
+
+
+class CacheTokenBucketTestCase(TestCase):
+    def setUp(self):
+        super(CacheTokenBucketTestCase, self).setUp()
+        self.bucket = CacheTokenBucket(uuid.uuid4(), rate=2, capacity=10)
+
+    def test_consume(self):
+        self.assertEquals(self.bucket.consume(4, now=100), 6)
+        self.assertEquals(self.bucket.consume(6, now=100), 0)
+
+        with self.assertRaises(EventsThrottled) as context:
+            self.bucket.consume(3, now=100.5)
+        self.assertEquals(context.exception.wait, 1)  # 1 token refilled, 2 more to go at 2 tokens/s.
+        self.assertEquals(context.exception.status_code, 429)
+
+        self.assertEquals(self.bucket.consume(3, now=101.5), 0)
+
+    def test_refill_up_to_capacity(self):
+        self.bucket.consume(10, now=100)
+        self.assertEquals(self.bucket.consume(1, now=1000), 9)
+
+    def test_consume_more_than_capacity(self):
+        self.assertEquals(self.bucket.consume(50, now=100), 0)  # Takes the whole bucket.
+        with self.assertRaises(EventsThrottled) as context:
+            self.bucket.consume(50, now=100)
+        self.assertEquals(context.exception.wait, 5)
+
+    def test_refund(self):
+        self.bucket.consume(10, now=100)
+        self.assertEquals(self.bucket.refund(4, now=100), 4)
+        self.assertEquals(self.bucket.consume(4, now=100), 0)
+
+        self.assertEquals(self.bucket.refund(50, now=200), 10)  # Never over capacity.
+
+    def test_per_customer(self):
+        self.bucket.consume(10, now=100)
+        self.assertEquals(CacheTokenBucket(uuid.uuid4(), rate=2, capacity=10).consume(10, now=100), 0)
+
+
+class EventsQuotaTestCase(TestCase):
+    def setUp(self):
+        super(EventsQuotaTestCase, self).setUp()
+        self.quota = EventsQuota(uuid.uuid4(), limit=5)
+        self.now = datetime(2016, 12, 20, 12, tzinfo=pytz.utc)
+
+    def test_consume(self):
+        self.assertEquals(self.quota.consume(3, now=self.now), 3)
+        self.assertEquals(self.quota.consume(2, now=self.now), 5)
+
+        with self.assertRaises(EventsQuotaExceeded) as context:
+            self.quota.consume(1, now=self.now)
+        self.assertEquals(context.exception.wait, 11.5 * 24 * 60 * 60)  # Until 2017-01-01.
+        self.assertEquals(self.quota.get_used(now=self.now), 5)
+
+        self.assertEquals(self.quota.consume(5, now=datetime(2017, 1, 1, tzinfo=pytz.utc)), 5)
+
+    def test_consume_is_all_or_nothing(self):
+        self.quota.consume(3, now=self.now)
+        with self.assertRaises(EventsQuotaExceeded):
+            self.quota.consume(3, now=self.now)
+        self.assertEquals(self.quota.consume(2, now=self.now), 5)
+
+    def test_refund(self):
+        self.quota.consume(5, now=self.now)
+        self.quota.refund(2, now=self.now)
+        self.assertEquals(self.quota.get_used(now=self.now), 3)
+
+    def test_no_limit(self):
+        quota = EventsQuota(uuid.uuid4(), limit=0)
+        self.assertIsNone(quota.consume(10 ** 6))
+        self.assertEquals(quota.get_used(), 0)
+
+
+class IngestionLimitsTestCase(TestCase):
+    @override_settings(EVENTS_THROTTLE_BURST=10, EVENTS_MONTHLY_QUOTA=100)
+    def test_headers(self):
+        limits = IngestionLimits(uuid.uuid4())
+        headers = limits.get_headers()
+        self.assertEquals(headers['X-RateLimit-Limit'], '10')
+        self.assertNotIn('X-RateLimit-Remaining', headers)
+        self.assertEquals(headers['X-Quota-Remaining'], '100')
+
+        limits.consume(4)
+        headers = limits.get_headers()
+        self.assertEquals(headers['X-RateLimit-Remaining'], '6')
+        self.assertEquals(headers['X-Quota-Limit'], '100')
+        self.assertEquals(headers['X-Quota-Remaining'], '96')
+        self.assertTrue(headers['X-Quota-Reset'].endswith('-01T00:00:00+00:00'))
+
+        limits.refund(4)
+        self.assertEquals(limits.get_headers()['X-Quota-Remaining'], '100')
+
+    @override_settings(EVENTS_THROTTLE_RATE=0.01, EVENTS_THROTTLE_BURST=10, EVENTS_MONTHLY_QUOTA=5)
+    def test_quota_exceeded_keeps_tokens(self):
+        limits = IngestionLimits(uuid.uuid4())
+        with self.assertRaises(EventsQuotaExceeded):
+            limits.consume(6)
+        self.assertEquals(limits.get_headers()['X-RateLimit-Remaining'], '10')
+
+    @override_settings(EVENTS_THROTTLE_RATE=0.01, EVENTS_THROTTLE_BURST=10)
+    def test_refund_tokens(self):
+        limits = IngestionLimits(uuid.uuid4())
+        limits.consume(8)
+        limits.refund(3)
+        self.assertEquals(limits.get_headers()['X-RateLimit-Remaining'], '5')
+
+    def test_headers_without_quota(self):
+        headers = IngestionLimits(uuid.uuid4()).get_headers()
+        self.assertNotIn('X-Quota-Limit', headers)
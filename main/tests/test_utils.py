@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import time
+
+from django.test import override_settings
+
+from main.models import Event
+from main.tests.base import CustomerFactory, EventFactory, TestCase
+from main.utils import generate_id, uuid7
+
+
+class UUID7TestCase(TestCase):
+    def test_format(self):
+        value = uuid7(now=1477958400.123456)
+        self.assertEquals(value.version, 7)
+        self.assertEquals(value.variant, 'specified in RFC 4122')
+        self.assertEquals(value.int >> 80, 1477958400123)
+        self.assertEquals(value.hex[:12], '{:012x}'.format(1477958400123))  # Same column type and format.
+        self.assertNotEquals(uuid7(now=1477958400.123456), value)
+
+    def test_ordering(self):
+        now = time.time()
+        ids = [uuid7(now=now + x / 1000000.0) for x in range(0, 5000, 7)]
+        self.assertEquals(sorted(ids), ids)
+        self.assertEquals(len(set(ids)), len(ids))
+
+    def test_generate_id(self):
+        self.assertEquals(generate_id().version, 4)
+        with override_settings(TIME_ORDERED_IDS=True):
+            self.assertEquals(generate_id().version, 7)
+
+    @override_settings(TIME_ORDERED_IDS=True)
+    def test_models(self):
+        events = [EventFactory.create(customer=CustomerFactory.create()) for x in range(3)]
+        self.assertTrue(all(x.id.version == 7 and x.customer.id.version == 7 for x in events))
+        self.assertEquals(list(Event.objects.order_by('id')), events)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime
+import math
+import threading
+import time
+
+import pytz
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from main.partitions import add_months
+
+
+class EventsThrottled(APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_detail = 'Too many events sent. Slow down.'
+
+    def __init__(self, wait, detail=None):
+        super(EventsThrottled, self).__init__(detail)
+        self.wait = int(math.ceil(wait))  # Sent on `Retry-After` header.
+
+
+class EventsQuotaExceeded(EventsThrottled):
+    default_detail = 'Monthly events quota exceeded.'
+
+
+def refill(tokens, timestamp, now, rate, capacity):
+    return min(capacity, tokens + max(0, now - timestamp) * rate)
+
+
+class BaseTokenBucket(object):
+    '''
+    Per customer token bucket: it holds up to `capacity` (EVENTS_THROTTLE_BURST) tokens, refilled at `rate`
+    (EVENTS_THROTTLE_RATE) tokens per second. Every event sent takes a token - customers may send bursts, but not
+    keep a pace faster than `rate`. Taking tokens must be atomic.
+    '''
+
+    def __init__(self, customer_id, rate=None, capacity=None):
+        self.customer_id = customer_id
+        self.rate = rate or settings.EVENTS_THROTTLE_RATE
+        self.capacity = capacity or settings.EVENTS_THROTTLE_BURST
+        self.tokens = None  # As of the last `consume`.
+
+    def get_cache_key(self):
+        return '{}:{}:bucket'.format(settings.CACHE_PREFIX['EVENTS_THROTTLE'], self.customer_id)
+
+    def get_ttl(self):
+        ''' Long enough for an empty bucket to get full again (after that, a missing bucket is just as good). '''
+        return int(math.ceil(self.capacity / float(self.rate))) + 1
+
+    def take(self, count, now):
+        '''
+        Takes `count` tokens, if there are that many - a negative `count` puts tokens back (up to `capacity`).
+        Returns (whether they were taken, tokens left).
+        '''
+        raise NotImplementedError
+
+    def consume(self, count, now=None):
+        '''
+        Takes `count` tokens (or the whole bucket, if `count` is bigger than it) or raises `EventsThrottled`.
+        Returns the tokens left.
+        '''
+        count = min(count, self.capacity)
+        taken, self.tokens = self.take(count, time.time() if now is None else now)
+        if not taken:
+            raise EventsThrottled(wait=(count - self.tokens) / float(self.rate))
+        return self.tokens
+
+    def refund(self, count, now=None):
+        ''' Puts back the tokens `consume(count)` took (for events that turned out not to be stored). '''
+        if count:
+            _, self.tokens = self.take(-min(count, self.capacity), time.time() if now is None else now)
+        return self.tokens
+
+
+class CacheTokenBucket(BaseTokenBucket):
+    '''
+    Bucket as a (tokens, timestamp) pair on the cache, updated under a lock - atomic within a process only, so this
+    is meant for local runs/tests (locmem cache) and single process deployments.
+    '''
+    lock = threading.Lock()
+
+    def take(self, count, now):
+        key = self.get_cache_key()
+        with self.lock:
+            tokens, timestamp = cache.get(key, (self.capacity, now))
+            tokens = refill(tokens, timestamp, now, self.rate, self.capacity)
+            taken = tokens >= count
+            if taken:
+                tokens = min(self.capacity, tokens - count)
+            cache.set(key, (tokens, now), self.get_ttl())
+        return taken, tokens
+
+
+class RedisTokenBucket(BaseTokenBucket):
+    ''' Bucket as a hash on Redis (the cache server), updated atomically by a Lua script. '''
+    script = '''
+        local capacity, rate, now, count = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+        local tokens = tonumber(bucket[1]) or capacity
+        local timestamp = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+
+        local taken = 0
+        if tokens >= count then
+            tokens = math.min(capacity, tokens - count)
+            taken = 1
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', tostring(now))
+        redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+        return {taken, tostring(tokens)}
+    '''
+
+    registered_script = None  # Registered once per process (see `get_script`).
+
+    def __init__(self, *args, **kwargs):
+        super(RedisTokenBucket, self).__init__(*args, **kwargs)
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+
+    @classmethod
+    def get_script(cls, redis):
+        if cls.registered_script is None:
+            cls.registered_script = redis.register_script(cls.script)
+        return cls.registered_script
+
+    def take(self, count, now):
+        taken, tokens = self.get_script(self.redis)(
+            keys=[cache.make_key(self.get_cache_key())],
+            args=[self.capacity, self.rate, repr(now), count, self.get_ttl()],
+            client=self.redis,
+        )
+        return bool(taken), float(tokens)
+
+
+def get_token_bucket(customer_id):
+    return import_string(settings.EVENTS_THROTTLE_BACKEND)(customer_id)
+
+
+class EventsQuota(object):
+    '''
+    Per customer limit of events sent per calendar month (UTC), EVENTS_MONTHLY_QUOTA - `0` means no limit.
+    Counted with atomic cache increments (`INCRBY` on Redis).
+    '''
+
+    def __init__(self, customer_id, limit=None):
+        self.customer_id = customer_id
+        self.limit = settings.EVENTS_MONTHLY_QUOTA if limit is None else limit
+
+    def get_month(self, now=None):
+        now = datetime.now(pytz.utc) if now is None else now
+        return datetime(now.year, now.month, 1, tzinfo=pytz.utc)
+
+    def get_reset(self, now=None):
+        return add_months(self.get_month(now), 1)
+
+    def get_cache_key(self, now=None):
+        prefix = settings.CACHE_PREFIX['EVENTS_THROTTLE']
+        return '{}:{}:quota:{:%Y-%m}'.format(prefix, self.customer_id, self.get_month(now))
+
+    def add(self, count, now=None):
+        key = self.get_cache_key(now)
+        ttl = int((self.get_reset(now) - self.get_month(now)).total_seconds())
+        cache.add(key, 0, ttl)
+        try:
+            return cache.incr(key, count)
+        except ValueError:  # Expired meanwhile.
+            cache.set(key, count, ttl)
+            return count
+
+    def get_used(self, now=None):
+        return cache.get(self.get_cache_key(now), 0)
+
+    def consume(self, count, now=None):
+        ''' Counts `count` events in, or raises `EventsQuotaExceeded` if that goes over the limit. Returns used. '''
+        if not self.limit:
+            return None
+
+        used = self.add(count, now)
+        if used > self.limit:
+            self.add(-count, now)
+            wait = (self.get_reset(now) - (now or datetime.now(pytz.utc))).total_seconds()
+            raise EventsQuotaExceeded(wait=wait)
+        return used
+
+    def refund(self, count, now=None):
+        ''' Counts `count` events out (the ones that turned out not to be stored). '''
+        if self.limit and count:
+            self.add(-count, now)
+
+
+class IngestionLimits(object):
+    ''' Token bucket and monthly quota of a customer, with their state for response headers. '''
+
+    def __init__(self, customer_id):
+        self.bucket = get_token_bucket(customer_id)
+        self.quota = EventsQuota(customer_id)
+        self.used = None
+
+    def consume(self, count):
+        if not count:
+            return
+
+        self.bucket.consume(count)
+        try:
+            self.used = self.quota.consume(count)
+        except EventsThrottled:
+            self.bucket.refund(count)  # Nothing is stored: it must not count against the rate either.
+            raise
+
+    def refund(self, count):
+        ''' Counts `count` events (consumed, but not stored) out of both the rate limit and the quota. '''
+        if not count:
+            return
+
+        self.bucket.refund(count)
+        self.quota.refund(count)
+        if self.used is not None:
+            self.used -= count
+
+    def get_headers(self):
+        headers = {'X-RateLimit-Limit': str(self.bucket.capacity)}
+        if self.bucket.tokens is not None:
+            headers['X-RateLimit-Remaining'] = str(int(self.bucket.tokens))
+
+        if self.quota.limit:
+            used = self.quota.get_used() if self.used is None else self.used
+            headers.update({
+                'X-Quota-Limit': str(self.quota.limit),
+                'X-Quota-Remaining': str(max(0, self.quota.limit - used)),
+                'X-Quota-Reset': self.quota.get_reset().isoformat(),
+            })
+        return headers
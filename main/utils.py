@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
+import itertools
 import os
+import random
+import time
+import uuid
 
 from django.conf import settings
 from django.template.loader import render_to_string
-from django.core.mail import EmailMultiAlternatives
 
 
 def send_email(subject_template, email_html_template, email_txt_template, context, to):
@@ -12,12 +15,11 @@ def send_email(subject_template, email_html_template, email_txt_template, contex
     subject = '{} {}'.format(settings.EMAIL_SUBJECT_PREFIX, ' '.join(subject.splitlines()))  # Newlines not allowed.
 
     message_txt = render_to_string(email_txt_template, context)
-    email_message = EmailMultiAlternatives(subject, message_txt, getattr(settings, 'DEFAULT_FROM_EMAIL'), [to, ])
-
     message_html = render_to_string(email_html_template, context)
-    email_message.attach_alternative(message_html, 'text/html')
 
-    email_message.send()
+    # Emails go to the outbox - they're actually sent by `send_queued_emails` management command.
+    from main.models import OutgoingEmail  # Avoiding circular imports.
+    OutgoingEmail.objects.enqueue(subject, message_txt, to, body_html=message_html)
 
 
 def send_email_plus(templates_path, context, to):
@@ -32,3 +34,37 @@ def send_email_plus(templates_path, context, to):
         context=context,
         to=to,
     )
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_random = random.SystemRandom()
+
+
+def uuid7(now=None):
+    '''
+    Time-ordered UUID (version 7, RFC 9562): 48 bits of Unix time in milliseconds, then 12 bits of sub-millisecond
+    fraction (so ids generated by a process keep increasing) and 62 random bits.
+    '''
+    now = time.time() if now is None else now
+    milliseconds = int(now * 1000)
+    fraction = int((now * 1000 - milliseconds) * 4096)
+
+    value = (milliseconds & 0xffffffffffff) << 80
+    value |= 0x7 << 76 | fraction << 64
+    value |= 0x2 << 62 | _random.getrandbits(62)
+    return uuid.UUID(int=value)
+
+
+def generate_id():
+    ''' Default primary key of models: random UUIDs, or time-ordered ones if TIME_ORDERED_IDS is enabled. '''
+    if settings.TIME_ORDERED_IDS:
+        return uuid7()
+    return uuid.uuid4()